@@ -3,8 +3,13 @@ nb_path.py - An enhanced path manipulation module that integrates pathlib, shuti
 """
 
 
+import asyncio
+import collections
+import concurrent.futures
 from contextlib import contextmanager
+import functools
 import hashlib
+import itertools
 import json
 import logging
 from logging import getLogger
@@ -18,11 +23,36 @@ import typing
 from pathlib import Path, WindowsPath, PosixPath
 import tempfile
 import re
-from collections import namedtuple
 import chardet
 
 from nb_log import nb_log
 
+from nb_path.nb_path_encoding import detect_file_encoding
+from nb_path.nb_path_matcher import PathMatcher
+from nb_path.nb_path_gitignore import GitIgnoreMatcher
+from nb_path.nb_path_walker import WalkCache, default_walk_cache, is_simple_name_pattern, scandir_tree
+from nb_path.nb_path_snapshot import TreeSnapshot
+from nb_path.nb_path_du import DiskUsage, disk_usage, format_size
+from nb_path.nb_path_watch import WatchEvent, Watcher
+from nb_path.nb_path_sync import (
+    COMPARE_MODES,
+    SYNC_MANIFEST_NAME,
+    SyncError,
+    SyncResult,
+    load_manifest,
+    manifest_after_sync,
+    manifest_digests,
+    plan_sync,
+    run_sync,
+    save_manifest,
+)
+from nb_path.nb_path_hash_cache import HashCache, file_digest
+from nb_path.nb_path_copy import copy2
+from nb_path.nb_path_grep import (
+    GrepResult, MultiGrepResult, GrepCount, GREP_MODES, GrepMatcher, GrepOptions, parse_context, iter_grep_file, grep_file_collect, restore_match,
+    iter_parallel, is_binary_chunk, BINARY_SNIFF_SIZE,
+)
+
 
 # --- Key Change 1: Dynamically select the correct base class ---
 # Depending on the current operating system, inherit from WindowsPath or PosixPath.
@@ -30,6 +60,15 @@ from nb_log import nb_log
 _Base = WindowsPath if sys.platform == "win32" else PosixPath
 
 
+def _nb_path_cache_dir() -> str:
+    """The per-user directory where nb_path keeps persistent caches and indexes."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "nb_path")
+
+
 class NbPath(
     _Base,
 ):
@@ -42,12 +81,31 @@ class NbPath(
 
     _modules_cache = {}
     _lock = threading.Lock()
+    _hash_cache = None
     # logger = getLogger(name="NbPath")
     logger = nb_log.get_logger('NbPath')
-    # Define a clear result type, which is better than returning a tuple
-    GrepResult = namedtuple(
-        "GrepResult", ["path", "line_number", "line_content", "match", "context_lines"]
-    )
+    # Define a clear result type, which is better than returning a tuple.
+    # It lives in nb_path_grep at module level so it can be pickled by process pools.
+    GrepResult = GrepResult
+    # Yielded instead of GrepResult when grep is given several patterns; `pattern_key` tells which one hit.
+    MultiGrepResult = MultiGrepResult
+    # Yielded by grep(mode="count"): `(path, count)` for each file with at least one hit.
+    GrepCount = GrepCount
+    # Returned by snapshot(); `NbPath.TreeSnapshot.load(file)` reads a saved one back.
+    TreeSnapshot = TreeSnapshot
+    # Returned by du(): `(total, file_count, dirs)`.
+    DiskUsage = DiskUsage
+    # Yielded by watch(): `(kind, path, is_dir)` with kind 'created', 'modified' or 'deleted'.
+    WatchEvent = WatchEvent
+    # The compiled glob set used for every pattern list (walk_tree, sync_to, grep, ...).
+    PathMatcher = PathMatcher
+    # Pass an instance as `cache=` to the walk methods to use a private listing cache.
+    WalkCache = WalkCache
+    # Returned by sync_to(): counts and byte totals, plus a SyncError(action, path, error) per failed file.
+    SyncResult = SyncResult
+    SyncError = SyncError
+    # The persistent digest cache behind hash(cache=True) and sync_to(compare="checksum").
+    HashCache = HashCache
 
     def __new__(cls, *args, **kwargs):
         return super().__new__(cls, *args, **kwargs)
@@ -115,13 +173,37 @@ class NbPath(
     # The read_text and write_text methods are already provided by the parent class, so they don't need to be overridden.
     # However, keeping them is a good choice for the convenience of setting a default encoding.
     def read_text(self, encoding: str = "utf-8", errors: str = None) -> str:
+        """
+        Reads the file as text. Pass `encoding="auto"` to detect the encoding from a bounded
+        sample of the file (see `detect_encoding()`), e.g. for mixed GBK / UTF-8 corpora.
+        """
+        if encoding == "auto":
+            encoding = self.detect_encoding()
         return super().read_text(encoding=encoding, errors=errors)
 
     def write_text(self, data: str, encoding: str = "utf-8", errors: str = None) -> int:
         return super().write_text(data, encoding=encoding, errors=errors)
 
-    def chardet_detect(self) -> dict:
-        return chardet.detect(self.read_bytes())
+    def chardet_detect(self, sample_size: int = None) -> dict:
+        """
+        Runs chardet on the file content and returns its full result dict.
+        :param sample_size: If given, only the first `sample_size` bytes are read and analysed.
+        """
+        if sample_size is None:
+            return chardet.detect(self.read_bytes())
+        with self.open("rb") as f:
+            return chardet.detect(f.read(sample_size))
+
+    def detect_encoding(self, sample_size: int = 64 * 1024) -> str:
+        """
+        Detects the text encoding of the file and returns a codec name usable with `open()`.
+
+        Unlike `chardet_detect()`, this never reads the whole file: chardet's incremental
+        detector is fed at most `sample_size` bytes and stops as soon as it is confident.
+        Results are cached per (path, mtime, size), so repeated calls on an unchanged file
+        cost a single `stat`. Pure ASCII samples (and undetectable ones) report 'utf-8'.
+        """
+        return detect_file_encoding(self, sample_size)
     
     def write_text_with_utf8_bom(self, data: str, ) -> int:
         self.write_bytes(b'\xef\xbb\xbf' + data.encode('utf-8'))
@@ -200,16 +282,53 @@ class NbPath(
 
     def size_human(self) -> str:
         """Returns a human-readable file size string (e.g., '1.23 MB')."""
-        size_bytes = self.size()
-        if size_bytes == 0:
-            return "0 B"
-        size_name = ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
-        import math
+        return format_size(self.size())
+
+    def du(
+        self,
+        workers: int = None,
+        cache: bool = False,
+        cache_path: typing.Union[os.PathLike, str] = None,
+        apparent_size: bool = True,
+    ) -> DiskUsage:
+        """
+        Calculates the recursive size of this directory and of every directory below it, like `du`.
+
+        Each directory is listed once with `os.scandir`. Files with several hard links are counted
+        once, and symlinks are neither followed nor counted.
+
+        Args:
+            workers (int, optional): If set, directories are listed on this many threads at once,
+                                     which pays off on network filesystems. Defaults to None.
+            cache (bool, optional): If True, each directory's own summary is stored keyed by its device, inode
+                                    and mtime, and directories that have not changed since the last call are not
+                                    listed again. Rewriting an existing file in place does not change its
+                                    directory's mtime, so only use this for trees whose files are written once.
+                                    Directories modified in the last 2 seconds are not stored, as a change within
+                                    the same mtime tick would go unnoticed. Defaults to False.
+            cache_path (os.PathLike or str, optional): Where the cache lives. Defaults to a file under the
+                                                       user cache directory keyed by this directory.
+            apparent_size (bool, optional): If True (default), file sizes are summed (like `du --apparent-size`);
+                                            if False, the allocated disk blocks are (POSIX only).
 
-        i = int(math.floor(math.log(size_bytes, 1024)))
-        p = math.pow(1024, i)
-        s = round(size_bytes / p, 2)
-        return f"{s} {size_name[i]}"
+        Returns:
+            DiskUsage: A named tuple `(total, file_count, dirs)`, where `dirs` maps every directory's path
+                       relative to this one ('.' for itself, '/'-separated) to its recursive size in bytes.
+
+        Example:
+            >>> usage = NbPath('/data/artifacts').du(workers=16, cache=True)
+            >>> print(format_size(usage.total), usage.file_count)
+            >>> for rel_dir, size in sorted(usage.dirs.items(), key=lambda kv: -kv[1])[:10]:
+            ...     print(f"{size:>15,}  {rel_dir}")
+        """
+        if not self.is_dir():
+            raise NotADirectoryError(f"{self} is not a directory.")
+        if cache and cache_path is None:
+            root = os.path.abspath(str(self))
+            key = hashlib.sha1(f"{root}\0{apparent_size}".encode("utf-8")).hexdigest()
+            cache_path = os.path.join(_nb_path_cache_dir(), "du", f"{key}.json")
+        return disk_usage(self, workers=workers, cache_path=os.fspath(cache_path) if cache else None,
+                          apparent_size=apparent_size)
 
     def copy_to(
         self, destination: typing.Union[os.PathLike, str], dirs_exist_ok: bool = True
@@ -218,26 +337,28 @@ class NbPath(
         Copies the file or directory to the specified location.
         - If destination is a directory, copies the source into that directory.
         - If destination is a file path, copies and renames the source.
+        Metadata is preserved like `shutil.copy2`. File contents are copied by the kernel where
+        possible: as a reflink on copy-on-write filesystems (btrfs, XFS), which is near-instant,
+        else with copy_file_range / sendfile, without passing the data through Python.
         :param destination: The target path.
         :param dirs_exist_ok: (For directories only) If True, allows merging if the destination directory exists. (Python 3.8+)
         :return: A new NbPath object pointing to the destination.
         """
         dest_path = Path(destination)
         if self.is_file():
-            shutil.copy2(self, dest_path)
-            return self.__class__(dest_path)
+            return self.__class__(copy2(self, dest_path))
         elif self.is_dir():
             dest_path_final = (
                 dest_path if not dest_path.is_dir() else dest_path / self.name
             )
             if sys.version_info >= (3, 8):
-                shutil.copytree(self, dest_path_final, dirs_exist_ok=dirs_exist_ok)
+                shutil.copytree(self, dest_path_final, dirs_exist_ok=dirs_exist_ok, copy_function=copy2)
             else:  # Compatibility for older Python versions
                 if dest_path_final.exists():
                     raise FileExistsError(
                         f"Destination directory {dest_path_final} already exists."
                     )
-                shutil.copytree(self, dest_path_final)
+                shutil.copytree(self, dest_path_final, copy_function=copy2)
             return self.__class__(dest_path_final)
         raise FileNotFoundError(
             f"Source path {self} does not exist or is not a file/directory."
@@ -255,23 +376,71 @@ class NbPath(
         delete_extraneous: bool = False,
         ignore_patterns: typing.List[str] = None,
         dry_run: bool = False,
-    ):
+        workers: int = None,
+        compare: str = "mtime",
+        hash_cache: bool = True,
+        delta_threshold: int = None,
+        manifest: bool = False,
+    ) -> SyncResult:
         """
         Intelligently synchronizes this directory to a destination directory (like rsync).
 
         It only copies new or modified files, making it highly efficient for repeated runs.
+        A file that cannot be copied or deleted is logged and recorded in the result instead
+        of aborting the sync.
 
         Args:
             destination: The target directory to sync to.
             delete_extraneous: If True, deletes files in the destination that do not
                                exist in the source directory (Mirroring). Defaults to False.
             ignore_patterns: A list of glob patterns to ignore during sync,
-                             e.g., ['*.pyc', '__pycache__'].
+                             e.g., ['*.pyc', '__pycache__']. Matching directories are skipped
+                             without being read (see `walk_tree()` for the pattern rules).
             dry_run: If True, prints the operations that would be performed without
                      actually executing them. Defaults to False.
+            workers: If set, the source and destination trees are walked with this many
+                     threads each (see `walk_tree()`), and files are copied and deleted on a
+                     pool of this many threads. Worth it for many small files or network
+                     storage, where per-file latency dominates. Defaults to None.
+            compare: How a file present on both sides is found to have changed:
+                     - "mtime": the source is newer (default).
+                     - "size+mtime": the size or the mtime differs either way, so a destination
+                       that was touched, restored or written by a skewed clock is fixed too.
+                     - "checksum": the size or the content hash differs. Unchanged content is
+                       never copied again, whatever the mtimes, and silently changed
+                       destination content is detected.
+            hash_cache: In "checksum" mode, keep the digests in the persistent cache used by
+                        `hash(cache=True)`, so only files whose size, mtime, ctime or inode
+                        changed are read again. Set it to False to re-read every file of equal
+                        size on both sides, e.g. to check the destination for bit rot.
+            delta_threshold: If set, a changed file of at least this many bytes that already
+                             exists in the destination is updated in place, rewriting only the
+                             64 KB blocks that differ, instead of being copied whole. Suits large
+                             files changed in place (database dumps, VM images); it reads both
+                             files, so it does not pay off for files that change completely.
+            manifest: If True, what was synced (path, size, mtime and, with compare="checksum",
+                      the digest of every file) is saved in a `.nb_path_sync_manifest` file at
+                      the destination, and the next sync compares the source with it instead of
+                      walking the destination: one tree walk instead of two. Only use it when
+                      nothing else writes to the destination. The manifest is ignored when the
+                      ignore patterns change, and removed by a sync without `manifest`.
+
+        Returns:
+            A `SyncResult` with the counts and byte totals of copied, skipped (up to date)
+            and deleted files, the bytes actually written (`written_bytes`), and `errors`,
+            one `SyncError(action, path, error)` per failed file.
+
+        Example:
+            >>> result = NbPath("./src").sync_to("/mnt/nfs/deploy", delete_extraneous=True, workers=32)
+            >>> print(result)
+            copied 1520 files (48213377 bytes), skipped 98480 (...), deleted 3 (...), failed 0, wrote 48213377 bytes
+            >>> for error in result.errors:
+            ...     print(error.action, error.path, error.error)
         """
         if not self.is_dir():
             raise NotADirectoryError(f"Source '{self}' is not a directory.")
+        if compare not in COMPARE_MODES:
+            raise ValueError(f"compare must be one of {COMPARE_MODES}, not {compare!r}.")
 
         dest_path = NbPath(destination)
         if not dry_run:
@@ -280,42 +449,54 @@ class NbPath(
             if not dest_path.exists():
                 self.logger.info(f"[DRY RUN] Would create directory: {dest_path}")
 
-        source_files = {p.relative_to(self) for p in self.rglob_files("*")}
-        dest_files = {p.relative_to(dest_path) for p in dest_path.rglob_files("*")}
-
-        # 1. Copy new or modified files
-        for rel_path in source_files:
-            source_file = self / rel_path
-            dest_file = dest_path / rel_path
-
-            # Simple ignore logic
-            if ignore_patterns and any(rel_path.match(p) for p in ignore_patterns):
-                continue
-
-            if (
-                not dest_file.exists()
-                or source_file.stat().st_mtime > dest_file.stat().st_mtime
-            ):
-                if not dry_run:
-                    self.logger.debug(f"Syncing: {source_file} -> {dest_file}")
-                    dest_file.ensure_parent()
-                    shutil.copy2(source_file, dest_file)
-                else:
-                    self.logger.info(
-                        f"[DRY RUN] Would copy: {source_file} -> {dest_file}"
-                    )
-
-        # 2. Delete extraneous files if requested
-        if delete_extraneous:
-            for rel_path in dest_files - source_files:
-                dest_file = dest_path / rel_path
-                if not dry_run:
-                    self.logger.debug(f"Deleting extraneous file: {dest_file}")
-                    dest_file.delete(missing_ok=True)
-                else:
-                    self.logger.info(
-                        f"[DRY RUN] Would delete extraneous file: {dest_file}"
-                    )
+        # Ignored files and directories are pruned from both walks: ignored directories are
+        # never read, and ignored files in the destination are never deleted.
+        # Both trees are stat'ed exactly once, while they are walked (the destination not at all
+        # when its manifest is used). The manifest at either root is never synced; files of that
+        # name in subdirectories are ordinary files.
+        exclude = (ignore_patterns or []) + ["/" + SYNC_MANIFEST_NAME]
+        source_snapshot = self.snapshot(exclude=exclude, workers=workers)
+        manifest_path = dest_path / SYNC_MANIFEST_NAME
+        manifest_header = None
+        dest_snapshot = dest_digests = None
+        if manifest and dest_path.is_dir():
+            # The manifest only describes this very directory, synced with these ignore patterns.
+            dest_st = dest_path.stat()
+            manifest_header = {
+                "ignore_patterns": sorted(ignore_patterns or []), "dest": [dest_st.st_dev, dest_st.st_ino]
+            }
+            loaded = load_manifest(manifest_path, manifest_header)
+            if loaded is not None:
+                dest_snapshot, dest_digests = loaded
+                dest_snapshot.root = dest_path
+                self.logger.debug(f"Using sync manifest {manifest_path} instead of walking {dest_path}")
+        if dest_snapshot is None:
+            dest_snapshot = dest_path.snapshot(exclude=exclude, workers=workers)
+
+        digest_cache = self._default_hash_cache() if compare == "checksum" and hash_cache else None
+        # Without the cache, a file hashed by plan_sync is not read again for the manifest's digests.
+        digest = digest_cache.hash if digest_cache else functools.lru_cache(maxsize=None)(file_digest)
+        plan = plan_sync(source_snapshot, dest_snapshot, delete_extraneous, compare=compare,
+                         digest=digest, workers=workers, dest_digests=dest_digests)
+        result = run_sync(self, dest_path, plan, workers=workers, dry_run=dry_run, dest=dest_snapshot,
+                          logger=self.logger, delta_threshold=delta_threshold)
+
+        if manifest and not dry_run:
+            synced = manifest_after_sync(source_snapshot, dest_snapshot, plan, result)
+            digests = None
+            if compare == "checksum":
+                digests = manifest_digests(source_snapshot, synced, digest, dest_digests, workers)
+            save_manifest(manifest_path, synced, manifest_header, digests)
+        elif not manifest and not dry_run:
+            # This sync may have changed the destination behind an old manifest's back.
+            manifest_path.delete(missing_ok=True)
+        if digest_cache:
+            digest_cache.flush()
+        if result.errors:
+            self.logger.warning(f"Sync {self} -> {dest_path} finished with errors: {result}")
+        else:
+            self.logger.debug(f"Sync {self} -> {dest_path}: {result}")
+        return result
 
     def download_from_url(
         self, url: str, overwrite: bool = False, **kwargs
@@ -456,12 +637,13 @@ class NbPath(
         )
 
     def zip_to(
-        self, destination: typing.Union[os.PathLike, str], overwrite: bool = False
+        self, destination: typing.Union[os.PathLike, str], overwrite: bool = False, workers: int = None
     ):
         """
         Compresses the current file or directory into a ZIP file.
         :param destination: The path for the destination ZIP file.
         :param overwrite: If True, overwrites the destination file if it already exists.
+        :param workers: If set, the directory tree is walked with this many threads (see `walk_tree()`).
         """
         dest_path = NbPath(destination)
         if dest_path.exists() and not overwrite:
@@ -471,8 +653,9 @@ class NbPath(
             if self.is_file():
                 zf.write(self, self.name)
             elif self.is_dir():
-                for file in self.rglob("*"):
-                    zf.write(file, file.relative_to(self))
+                for _, dirs, files in scandir_tree(self, workers=workers):
+                    for entry in dirs + files:
+                        zf.write(entry.path, os.path.relpath(entry.path, self))
 
         return dest_path
 
@@ -488,23 +671,253 @@ class NbPath(
             zf.extractall(dest_path)
         return dest_path
 
-    def rglob_files(self, pattern: str) -> typing.List["NbPath"]:
-        """Recursively finds all matching files and returns a list of NbPath objects."""
-        # self.path.rglob -> self.rglob
-        return [p for p in self.rglob(pattern) if p.is_file()]
+    def walk_tree(
+        self,
+        include: typing.List[str] = None,
+        exclude: typing.List[str] = None,
+        respect_gitignore: bool = False,
+        workers: int = None,
+        cache: typing.Union[bool, WalkCache] = False,
+    ) -> typing.Generator[typing.Tuple["NbPath", typing.List[str], typing.List[str]], None, None]:
+        """
+        Walks the directory tree top-down like `os.walk`, pruning excluded subtrees before they are read.
+
+        Patterns are globs matched against each entry's path relative to this directory, from the right
+        like `PurePath.match`: '*.pyc' and '__pycache__' match at any depth, 'docs/*.md' matches any
+        `docs` directory, and a leading '/' anchors a pattern to this directory ('/build'). A trailing
+        '/' only matches directories, and '**' matches any number of directories.
+        An excluded directory is never opened, so skipping `.git` or `node_modules` costs nothing.
+
+        Args:
+            include (list, optional): If given, only files matching one of these patterns are reported.
+            exclude (list, optional): Files and directories to leave out, e.g. ['.git', 'node_modules', '*.pyc'].
+            respect_gitignore (bool, optional): If True, paths ignored by git are left out as well, with git's rules:
+                                                the `.gitignore` of every directory (including those between the
+                                                repository root and this directory) and `.git/info/exclude`,
+                                                negation ('!'), anchoring and directory-only rules. Ignored
+                                                directories are pruned, and `.git` is always skipped.
+                                                Defaults to False.
+            workers (int, optional): If set, directories are listed concurrently on this many threads, which
+                                     pays off on high-latency filesystems (NFS, SMB). Directories are then
+                                     yielded in completion order, each still after its parent.
+                                     Defaults to None (one directory at a time).
+            cache (bool or WalkCache, optional): If True, directory listings are kept in a process-wide LRU
+                                                 (of up to 100,000 directories) keyed by each directory's inode
+                                                 and mtime, so walking a mostly unchanged tree again costs one
+                                                 `stat` per directory and only changed directories are listed.
+                                                 Pass a `NbPath.WalkCache(max_dirs=...)` to use a private one.
+                                                 Defaults to False.
+
+        Yields:
+            tuple: `(dirpath, dirnames, filenames)`, with `dirpath` an NbPath and the names as strings.
+                   As with `os.walk`, removing names from `dirnames` stops the walk descending into them.
+                   Symlinks to directories are listed in `dirnames` but not followed.
+
+        Example:
+            >>> for dirpath, dirnames, filenames in NbPath('.').walk_tree(exclude=['.git', '.venv', '__pycache__']):
+            ...     print(dirpath, len(filenames))
+        """
+        cls = self.__class__
+        for dirpath, dirs, files in scandir_tree(
+            self, *self._walk_rules(include, exclude, respect_gitignore), workers=workers,
+            cache=self._walk_cache(cache),
+        ):
+            dirnames = [entry.name for entry in dirs]
+            yield cls(dirpath), dirnames, [entry.name for entry in files]
+            if len(dirnames) != len(dirs) or any(entry.name != name for entry, name in zip(dirs, dirnames)):
+                kept = set(dirnames)
+                dirs[:] = [entry for entry in dirs if entry.name in kept]
+
+    @staticmethod
+    def _walk_cache(cache: typing.Union[bool, WalkCache, None]) -> typing.Optional[WalkCache]:
+        if isinstance(cache, WalkCache):
+            return cache
+        return default_walk_cache if cache else None
+
+    def _walk_rules(
+        self, include: typing.Optional[typing.List[str]], exclude: typing.Optional[typing.List[str]],
+        respect_gitignore: bool,
+    ) -> typing.Tuple[typing.Union[PathMatcher, GitIgnoreMatcher, None], typing.Optional[PathMatcher]]:
+        """Compiles walk_tree's filters into the `(exclude, include)` arguments of the scandir walker."""
+        exclude = PathMatcher.compile(exclude) if exclude else None
+        if respect_gitignore:
+            exclude = GitIgnoreMatcher(self, extra=exclude)
+        return exclude, (PathMatcher.compile(include) if include else None)
+
+    def snapshot(
+        self,
+        include: typing.List[str] = None,
+        exclude: typing.List[str] = None,
+        respect_gitignore: bool = False,
+        workers: int = None,
+    ) -> TreeSnapshot:
+        """
+        Records the relative path, size, mtime, mode, inode and device of every file and directory
+        below this directory in one walk, so later work can use the metadata instead of stat'ing again.
+
+        The arguments are the same as for `walk_tree()`. The result is a compact, column-wise
+        `TreeSnapshot`: look entries up by relative path ('/'-separated), `filter()` them, `diff()`
+        two snapshots, and `save()` / `TreeSnapshot.load()` one to reuse it across runs.
+
+        Example:
+            >>> before = NbPath('./data').snapshot(exclude=['.git'])
+            >>> ...  # something changes files
+            >>> changes = NbPath('./data').snapshot(exclude=['.git']).diff(before)
+            >>> print(changes.added, changes.removed, changes.modified)
+            >>> big_files = before.filter(lambda e: e.is_file and e.size > 100 * 1024 * 1024)
+        """
+        exclude, include = self._walk_rules(include, exclude, respect_gitignore)
+        return TreeSnapshot.take(self, exclude, include, workers=workers)
+
+    def watch(
+        self,
+        exclude: typing.List[str] = None,
+        respect_gitignore: bool = False,
+        debounce: float = 0.1,
+        backend: str = "auto",
+        poll_interval: float = 1.0,
+        workers: int = None,
+    ) -> Watcher:
+        """
+        Watches this directory tree for created, modified and deleted files and directories.
+
+        On Linux, inotify is used (through ctypes), so changes are reported as they happen without
+        walking the tree. Elsewhere, or if inotify cannot be used, the tree is polled by diffing a
+        `snapshot()` every `poll_interval` seconds. Changes are reported from the moment `watch()` returns.
+
+        Args:
+            exclude (list, optional): Paths not to watch, with the same rules as `walk_tree()`,
+                                      e.g. ['.git', 'node_modules', '*.tmp'].
+            respect_gitignore (bool, optional): If True, paths ignored by git are not watched (see `walk_tree()`).
+                                                Defaults to False.
+            debounce (float, optional): After a change, further changes are collected until the tree has been
+                                        quiet for this many seconds, and each path is then reported once (a file
+                                        that is written several times is one 'modified' event; one created and
+                                        deleted again is none). Defaults to 0.1.
+            backend (str, optional): 'auto' (default), 'inotify' (raise if unavailable) or 'poll'.
+            poll_interval (float, optional): Seconds between two polls with the 'poll' backend. Defaults to 1.0.
+            workers (int, optional): Threads used to walk the tree for each poll (see `walk_tree()`).
+
+        Returns:
+            Watcher: An iterator and async iterator of `WatchEvent(kind, path, is_dir)` tuples that runs until
+                     `close()` is called; `read(timeout)` returns one batch of events instead. Use it as a
+                     context manager.
+
+        Example:
+            >>> with NbPath('./incoming').watch(exclude=['*.part']) as watcher:
+            ...     for event in watcher:
+            ...         if event.kind == "created" and not event.is_dir:
+            ...             process(event.path)
+
+            >>> async def consume():
+            ...     with NbPath('./incoming').watch() as watcher:
+            ...         async for event in watcher:
+            ...             print(event.kind, event.path)
+        """
+        if not self.is_dir():
+            raise NotADirectoryError(f"{self} is not a directory.")
+        exclude, _ = self._walk_rules(None, exclude, respect_gitignore)
+        return Watcher(
+            self, self.__class__, exclude=exclude, debounce=debounce, backend=backend,
+            poll_interval=poll_interval, workers=workers, logger=self.logger,
+        )
+
+    def iter_files(
+        self, pattern: typing.Union[str, typing.List[str]] = "*", workers: int = None,
+        cache: typing.Union[bool, WalkCache] = False,
+    ) -> typing.Generator["NbPath", None, None]:
+        """
+        Recursively yields the matching files as NbPath objects while the tree is being walked.
+
+        The lazy counterpart of `rglob_files()`, accepting the same patterns: work on the first
+        files can start before the walk is finished, and the paths are never all held in memory.
 
-    def rglob_dirs(self, pattern: str) -> typing.List["NbPath"]:
-        """Recursively finds all matching directories and returns a list of NbPath objects."""
-        return [p for p in self.rglob(pattern) if p.is_dir()]
+        Name patterns such as '*.py' are served by an `os.scandir` walk that reads each entry's
+        type from the directory listing, so no extra `stat` is needed per entry and only matching
+        files become NbPath objects. A single pattern containing separators or '**' uses `Path.rglob`.
+        A list of patterns (e.g. ['*.py', '*.pyi', 'Makefile']) is compiled into one `PathMatcher`
+        and matched in a single pass, with the rules of `walk_tree()`.
+
+        With `workers`, directories are listed concurrently on that many threads (see `walk_tree()`),
+        and files come out in completion order. With `cache`, listings of unchanged directories
+        are reused from earlier walks (see `walk_tree()`), e.g. for plugin directories scanned on
+        every request.
+        """
+        yield from self._iter_files(pattern, workers, cache)
+
+    def _iter_files(
+        self, pattern: typing.Union[str, typing.List[str]] = "*", workers: int = None,
+        cache: typing.Union[bool, WalkCache] = False, stop: threading.Event = None,
+    ) -> typing.Generator["NbPath", None, None]:
+        """`iter_files()`, ending early once `stop` is set (checked for every directory, not just every match)."""
+        if isinstance(pattern, str) and not is_simple_name_pattern(pattern):
+            for p in self.rglob(pattern):
+                if stop is not None and stop.is_set():
+                    return
+                if p.is_file():
+                    yield p
+            return
+        patterns = [pattern] if isinstance(pattern, str) else list(pattern)
+        include = None if patterns == ["*"] else PathMatcher.compile(patterns)
+        cls = self.__class__
+        for _, _, files in scandir_tree(self, include=include, workers=workers, cache=self._walk_cache(cache)):
+            if stop is not None and stop.is_set():
+                return
+            for entry in files:
+                yield cls(entry.path)
+
+    def iter_dirs(
+        self, pattern: typing.Union[str, typing.List[str]] = "*", workers: int = None,
+        cache: typing.Union[bool, WalkCache] = False,
+    ) -> typing.Generator["NbPath", None, None]:
+        """Recursively yields the matching directories as NbPath objects; the lazy `rglob_dirs()`. See `iter_files()`."""
+        if isinstance(pattern, str) and not is_simple_name_pattern(pattern):
+            yield from (p for p in self.rglob(pattern) if p.is_dir())
+            return
+        patterns = [pattern] if isinstance(pattern, str) else list(pattern)
+        matcher = None if patterns == ["*"] else PathMatcher.compile(patterns)
+        cls = self.__class__
+        top = os.fspath(self)
+        for dirpath, dirs, _ in scandir_tree(self, workers=workers, cache=self._walk_cache(cache)):
+            rel_dir = os.path.relpath(dirpath, top).replace(os.sep, "/")
+            prefix = "" if rel_dir == "." else rel_dir + "/"
+            for entry in dirs:
+                if matcher is None or matcher.match(prefix + entry.name, True):
+                    yield cls(entry.path)
+
+    def rglob_files(
+        self, pattern: typing.Union[str, typing.List[str]], workers: int = None,
+        cache: typing.Union[bool, WalkCache] = False,
+    ) -> typing.List["NbPath"]:
+        """Recursively finds all matching files and returns a list of NbPath objects. See `iter_files()`."""
+        return list(self.iter_files(pattern, workers=workers, cache=cache))
+
+    def rglob_dirs(
+        self, pattern: typing.Union[str, typing.List[str]], workers: int = None,
+        cache: typing.Union[bool, WalkCache] = False,
+    ) -> typing.List["NbPath"]:
+        """Recursively finds all matching directories and returns a list of NbPath objects. See `iter_dirs()`."""
+        return list(self.iter_dirs(pattern, workers=workers, cache=cache))
 
     def grep(
         self,
-        pattern: str,
-        file_pattern: str = "*",
+        pattern: typing.Union[str, typing.List[str], typing.Dict[typing.Any, str]],
+        file_pattern: typing.Union[str, typing.List[str]] = "*",
         is_regex: bool = True,
         ignore_case: bool = False,
         encoding: str = "utf-8",
         context: typing.Union[int, typing.Tuple[int, int]] = None,
+        merge_context: bool = False,
+        workers: int = None,
+        executor: str = "thread",
+        ordered: bool = True,
+        max_pending: int = None,
+        skip_binary: bool = True,
+        search_compressed: bool = False,
+        mode: str = "lines",
+        max_count: int = None,
+        use_index: bool = False,
+        index_path: typing.Union[os.PathLike, str] = None,
     ) -> typing.Generator[GrepResult, None, None]:
         """
         Searches for a pattern within files, similar to the command-line 'grep'.
@@ -513,23 +926,76 @@ class NbPath(
         making it memory-efficient for searching through large directories. It now supports
         displaying context lines around each match.
 
+        When no context is requested, files are scanned in large blocks with a single regex
+        (or substring) search per block, and only the lines containing a hit are split out and
+        numbered. Patterns whose meaning depends on line ends (`$`, `\\Z`, lookarounds, ...)
+        fall back to the line-by-line scan; the results are identical either way.
+
+        Before a file is decoded at all, it is sniffed for binary content and, when the pattern
+        contains a literal that every match must include, checked for that literal with a single
+        bytes search. Most files in a large tree never get past this check.
+
         It can be called on a directory to search recursively, or on a single file.
 
         Args:
-            pattern (str): The string or regex pattern to search for.
-            file_pattern (str, optional): A glob pattern to filter which files to search.
-                                          Only used when calling grep on a directory. Defaults to '*'.
+            pattern (str, list or dict): The string or regex pattern to search for. A list or dict of patterns
+                                         searches for all of them in a single pass over each file; every hit is
+                                         then a `MultiGrepResult` whose `pattern_key` is the dict key (or the
+                                         pattern itself for a list). A line matching several patterns yields
+                                         one result per pattern.
+            file_pattern (str or list, optional): A glob pattern, or a list of them, to filter which files
+                                                  to search (see `iter_files()`). Only used when calling grep
+                                                  on a directory. Defaults to '*'.
             is_regex (bool, optional): If True (default), treats 'pattern' as a regular expression.
                                        If False, performs a simple string search.
             ignore_case (bool, optional): If True, performs a case-insensitive search. Defaults to False.
-            encoding (str, optional): The file encoding to use. Defaults to 'utf-8'.
+            encoding (str, optional): The file encoding to use. Defaults to 'utf-8'. Use 'auto' to detect each
+                                      file's encoding from a bounded sample (cached per path, mtime and size).
             context (int or tuple, optional): If specified, includes context lines around the match.
                                               - An `int` `n` shows `n` lines before and `n` lines after.
                                               - A `tuple` `(before, after)` shows `before` lines before and `after` lines after.
                                               Defaults to None.
+                                              Lines inside another match's context are still searched, so nearby
+                                              matches each get their own result.
+            merge_context (bool, optional): If True, matches whose context windows overlap or touch form one block
+                                            (like the groups GNU grep separates with `--`). Every result of a block
+                                            shares the same `context_lines` list covering the whole block, instead of
+                                            each carrying its own copy. Defaults to False.
+            workers (int, optional): If set, files are searched concurrently on a pool of this many workers.
+                                     Results are still yielded from this generator. Defaults to None (single thread).
+            executor (str, optional): 'thread' (default) or 'process'. Threads suit I/O-bound trees (network
+                                      filesystems); processes suit CPU-heavy regexes. Only used with `workers`.
+            ordered (bool, optional): With `workers`, if True (default) results come out in the same file order
+                                      as a single-threaded grep; if False, files are yielded as soon as they finish.
+            max_pending (int, optional): With `workers`, the maximum number of files in flight at once,
+                                         which bounds memory held by finished-but-unconsumed results.
+                                         Defaults to `workers * 4`.
+            skip_binary (bool, optional): If True (default), files that look binary (a null byte in the
+                                          first 1KB, the same check as `is_binary()`) are not searched. UTF-16/32
+                                          text (by `encoding`, the detected encoding or a BOM) is not binary.
+            search_compressed (bool, optional): If True, gzip, bz2 and xz files (recognised by their magic bytes,
+                                                whatever their name) are decompressed on the fly and searched, and
+                                                every member of a ZIP archive is searched too, reported with a path
+                                                of the form `archive.zip!member/name.txt`. Nothing is extracted to
+                                                disk. Defaults to False.
+            mode (str, optional): What to yield. Every mode stops reading a file as soon as it has what it needs.
+                                  - 'lines' (default): a `GrepResult` for every match.
+                                  - 'first': only the first `GrepResult` of each file.
+                                  - 'count': a `GrepCount(path, count)` per file with at least one match, without
+                                    building any per-match objects.
+                                  - 'files': just the path of each file with at least one match.
+            max_count (int, optional): Stop reading a file after this many matches (in 'lines' mode), or cap
+                                       the per-file count (in 'count' mode). Defaults to None (no limit).
+            use_index (bool, optional): If True, the persistent trigram index of this directory (see
+                                        `build_search_index()`) is refreshed for changed files and used to
+                                        skip files that cannot contain the pattern's required literal.
+            index_path (os.PathLike or str, optional): Where the index lives. Defaults to a file under the
+                                                       user cache directory keyed by directory and file_pattern.
 
         Yields:
             GrepResult: A named tuple for each match, containing `(path, line_number, line_content, match, context_lines)`.
+                        (`MultiGrepResult`, with an extra `pattern_key`, when several patterns are given.)
+                        In 'count' and 'files' modes, `GrepCount` tuples and paths respectively.
                         The `match` attribute is the matched string or regex match object. `context_lines` is a list of `(line_num, line_text)` tuples.
 
         Example:
@@ -548,88 +1014,231 @@ class NbPath(
             ...     for num, line in result.context_lines:
             ...         prefix = ">>" if num == result.line_number else "  "
             ...         print(f"{prefix} {num:4d}: {line.rstrip()}")
-        """
-        files_to_search = [self] if self.is_file() else self.rglob_files(file_pattern)
 
-        re_flags = re.IGNORECASE if ignore_case else 0
+            >>> # 4. Triage a log directory for several patterns at once, reading each file only once
+            >>> patterns = {"oom": r"OutOfMemory", "timeout": r"timed? ?out", "5xx": r" 5\\d\\d "}
+            >>> for result in NbPath('/var/log/app').grep(patterns, file_pattern='*.log', ignore_case=True):
+            ...     print(result.pattern_key, result.path.name, result.line_number)
 
-        if is_regex:
-            try:
-                compiled_pattern = re.compile(pattern, re_flags)
-            except re.error as e:
-                raise ValueError(f"Invalid regular expression: {pattern}") from e
-        else:
-            search_str = pattern.lower() if ignore_case else pattern
-
-        # Parse context parameter
-        before, after = 0, 0
-        if context is not None:
-            if isinstance(context, int):
-                before = after = context
-            elif isinstance(context, tuple) and len(context) == 2:
-                before, after = context
-            else:
-                raise ValueError(
-                    "`context` must be an integer or a tuple of two integers (before, after)."
-                )
+            >>> # 5. Dashboards: per-file hit counts, or just the files that match
+            >>> error_counts = {c.path: c.count for c in src_dir.grep("ERROR", file_pattern='*.log', mode="count")}
+            >>> matching_files = list(src_dir.grep("ERROR", file_pattern='*.log', mode="files"))
+
+            >>> # 6. Search a large tree on 16 threads, taking results in completion order
+            >>> for result in src_dir.grep("TODO", file_pattern='*.py', workers=16, ordered=False):
+            ...     print(result.path, result.line_number)
+        """
+        files_to_search, matcher, options = self._plan_grep(
+            pattern, file_pattern, is_regex, ignore_case, encoding, context, merge_context,
+            skip_binary, search_compressed, mode, max_count, use_index, index_path,
+        )
+
+        if workers:
+            for file, results, error in iter_parallel(
+                grep_file_collect,
+                files_to_search,
+                args=(matcher, options, executor == "process"),
+                workers=workers,
+                executor=executor,
+                ordered=ordered,
+                max_pending=max_pending,
+            ):
+                if error is not None:
+                    self.logger.warning(f"Could not grep file {file}: {error}")
+                for result in results:
+                    yield restore_match(result, matcher)
+            return
 
         for file in files_to_search:
             try:
-                with file.open("r", encoding=encoding, errors="ignore") as f:
-                    lines_buffer = []
-                    if before > 0:
-                        from collections import deque
-
-                        lines_buffer = deque(maxlen=before)
-
-                    for line_num, line in enumerate(f, 1):
-                        match_found = False
-                        match_result = None
-
-                        if is_regex:
-                            # Use search to find the first match to trigger context collection
-                            match_obj = compiled_pattern.search(line)
-                            if match_obj:
-                                match_found = True
-                                match_result = match_obj
-                        else:
-                            line_to_search = line.lower() if ignore_case else line
-                            if search_str in line_to_search:
-                                match_found = True
-                                match_result = pattern
-
-                        if match_found:
-                            context_lines = list(lines_buffer)
-                            context_lines.append((line_num, line))
-
-                            # Read 'after' lines
-                            for _ in range(after):
-                                try:
-                                    after_line = next(f)
-                                    context_lines.append((line_num + 1 + _, after_line))
-                                except StopIteration:
-                                    break
-
-                            yield self.GrepResult(
-                                file, line_num, line, match_result, context_lines
-                            )
-
-                        if before > 0:
-                            lines_buffer.append((line_num, line))
-
+                yield from iter_grep_file(file, matcher, options)
             except Exception as e:
                 self.logger.warning(f"Could not grep file {file}: {e}")
 
-    def hash(self, algorithm: str = "sha256") -> str:
-        """Calculates the hash of the file's content."""
-        hasher = hashlib.new(algorithm)
-        with self.open("rb") as f:
+    def _plan_grep(
+        self, pattern, file_pattern, is_regex, ignore_case, encoding, context, merge_context,
+        skip_binary, search_compressed, mode, max_count, use_index, index_path,
+        stop: threading.Event = None,
+    ) -> typing.Tuple[typing.Iterable["NbPath"], GrepMatcher, GrepOptions]:
+        """
+        Everything grep and agrep do before the first file is read: compile, narrow by index.
+        Without an index the files are returned as a lazy walk, so searching overlaps with walking;
+        setting `stop` ends that walk.
+        """
+        if mode not in GREP_MODES:
+            raise ValueError(f"`mode` must be one of {GREP_MODES}, got {mode!r}.")
+        files_to_search = [self] if self.is_file() else self._iter_files(file_pattern, stop=stop)
+
+        matcher = GrepMatcher(pattern, is_regex=is_regex, ignore_case=ignore_case)
+        before, after = parse_context(context)
+        options = GrepOptions(
+            encoding=encoding, before=before, after=after, skip_binary=skip_binary, merge_context=merge_context,
+            search_compressed=search_compressed, mode=mode, max_count=max_count,
+        )
+
+        if use_index and self.is_dir():
+            files_to_search = list(files_to_search)
+            with self.build_search_index(file_pattern, index_path, files=files_to_search) as index:
+                candidates = index.candidates(matcher.required_bytes(encoding))
+            if candidates is not None:
+                files_to_search = [f for f in files_to_search if os.path.normpath(str(f)) in candidates]
+        return files_to_search, matcher, options
+
+    async def agrep(
+        self,
+        pattern: typing.Union[str, typing.List[str], typing.Dict[typing.Any, str]],
+        file_pattern: typing.Union[str, typing.List[str]] = "*",
+        is_regex: bool = True,
+        ignore_case: bool = False,
+        encoding: str = "utf-8",
+        context: typing.Union[int, typing.Tuple[int, int]] = None,
+        merge_context: bool = False,
+        concurrency: int = 8,
+        ordered: bool = True,
+        skip_binary: bool = True,
+        search_compressed: bool = False,
+        mode: str = "lines",
+        max_count: int = None,
+        use_index: bool = False,
+        index_path: typing.Union[os.PathLike, str] = None,
+    ) -> typing.AsyncGenerator[GrepResult, None]:
+        """
+        The asyncio version of `grep()`: an async generator with the same arguments and results.
+
+        The directory walk and all file reads run on a private thread pool, so the event loop
+        is never blocked by file I/O. Files are pulled from the walk a few at a time, so the
+        search starts before the walk ends. At most `concurrency` files are searched at the same
+        time. Breaking out of the loop, closing the generator or cancelling the consuming task
+        stops the walk and drops every file that has not started yet; files already being read
+        finish in the background and their results are discarded.
+
+        Args:
+            concurrency (int, optional): The maximum number of files searched at once. Defaults to 8.
+            ordered (bool, optional): If True (default), results come out in the same order as `grep()`;
+                                      if False, each file's results are yielded as soon as it is done.
+            The other arguments are the same as for `grep()`.
+
+        Example:
+            >>> async def handler(request):
+            ...     hits = []
+            ...     async for result in NbPath('./logs').agrep("ERROR", file_pattern='*.log', is_regex=False):
+            ...         hits.append(f"{result.path.name}:{result.line_number}")
+            ...     return hits
+        """
+        loop = asyncio.get_running_loop()
+        concurrency = max(concurrency, 1)
+        # One more thread than files searched at once, so the walk never waits for a search.
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency + 1)
+        stop = threading.Event()
+        pending = collections.deque()
+        try:
+            files_to_search, matcher, options = await loop.run_in_executor(
+                pool,
+                functools.partial(
+                    self._plan_grep, pattern, file_pattern, is_regex, ignore_case, encoding, context,
+                    merge_context, skip_binary, search_compressed, mode, max_count, use_index, index_path,
+                    stop=stop,
+                ),
+            )
+
+            files_iter = iter(files_to_search)
+            walked_all = False
             while True:
-                chunk = f.read(8192)
-                if not chunk:
+                if not walked_all and len(pending) < concurrency:
+                    # The walk must not run on the event loop either: pull the next files on the pool.
+                    wanted = concurrency - len(pending)
+                    batch = await loop.run_in_executor(pool, list, itertools.islice(files_iter, wanted))
+                    walked_all = len(batch) < wanted
+                    for file in batch:
+                        pending.append(loop.run_in_executor(pool, grep_file_collect, file, matcher, options))
+                if not pending:
                     break
-                hasher.update(chunk)
-        return hasher.hexdigest()
+                if ordered:
+                    finished = [await pending[0]]
+                    pending.popleft()
+                else:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    finished = [future.result() for future in done]
+                    for future in done:
+                        pending.remove(future)
+                for file, results, error in finished:
+                    if error is not None:
+                        self.logger.warning(f"Could not grep file {file}: {error}")
+                    for result in results:
+                        yield result
+        finally:
+            stop.set()
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def build_search_index(
+        self,
+        file_pattern: typing.Union[str, typing.List[str]] = "*",
+        index_path: typing.Union[os.PathLike, str] = None,
+        files: typing.List["NbPath"] = None,
+    ):
+        """
+        Builds, or incrementally refreshes, the persistent trigram index of this directory.
+
+        Only files that are new or whose mtime/size changed since the last call are read,
+        so calling this repeatedly on a mostly unchanged tree is cheap. `grep(..., use_index=True)`
+        calls it automatically.
+
+        Args:
+            file_pattern (str or list, optional): Which files to index, as in `grep`. Defaults to '*'.
+            index_path (os.PathLike or str, optional): The index database file. Defaults to a file under
+                                                       the user cache directory keyed by this directory
+                                                       and `file_pattern`.
+            files (list, optional): The files to index, if the caller already walked the tree.
+
+        Returns:
+            NbPathSearchIndex: The open index; use it as a context manager or call `close()`.
+
+        Example:
+            >>> with NbPath('./src').build_search_index('*.py') as index:
+            ...     print(index.index_path)
+            >>> for result in NbPath('./src').grep("my_function", file_pattern='*.py', use_index=True):
+            ...     print(result.path, result.line_number)
+        """
+        from nb_path.nb_path_search_index import NbPathSearchIndex
+
+        if not self.is_dir():
+            raise NotADirectoryError(f"{self} is not a directory.")
+        root = os.path.abspath(str(self))
+        if index_path is None:
+            key = hashlib.sha1(f"{root}\0{file_pattern}".encode("utf-8")).hexdigest()
+            index_path = os.path.join(_nb_path_cache_dir(), "search_index", f"{key}.sqlite")
+        if files is None:
+            files = self.iter_files(file_pattern)
+
+        index = NbPathSearchIndex(str(self), index_path)
+        stats = index.refresh(files)
+        self.logger.debug(f"Search index {index.index_path} refreshed: {stats}")
+        return index
+
+    def hash(self, algorithm: str = "sha256", cache: bool = False) -> str:
+        """
+        Calculates the hash of the file's content.
+
+        Args:
+            algorithm: Any algorithm name accepted by `hashlib.new()`.
+            cache: If True, the digest is kept in a persistent cache in the user cache directory,
+                   and the file is only read again once its size, mtime, ctime or inode changed.
+        """
+        if cache:
+            hash_cache = self._default_hash_cache()
+            digest = hash_cache.hash(self, algorithm)
+            hash_cache.flush()
+            return digest
+        return file_digest(self, algorithm)
+
+    @classmethod
+    def _default_hash_cache(cls) -> HashCache:
+        with cls._lock:
+            if NbPath._hash_cache is None:
+                NbPath._hash_cache = HashCache(os.path.join(_nb_path_cache_dir(), "hashes.sqlite"))
+            return NbPath._hash_cache
 
     def is_text(self) -> bool:
         """
@@ -650,8 +1259,8 @@ class NbPath(
             return False
         try:
             with self.open("rb") as f:
-                chunk = f.read(1024)  # Read the first 1KB of the file
-                return b"\x00" in chunk
+                chunk = f.read(BINARY_SNIFF_SIZE)  # Read the first 1KB of the file
+                return is_binary_chunk(chunk)
         except Exception as e:
             self.logger.warning(f"Could not perform binary check on file {self}: {e}")
             return False
@@ -0,0 +1,143 @@
+"""
+nb_path_copy.py - The file copy engine behind NbPath.copy_to() and sync_to().
+
+`copy_file` copies a file's content with the cheapest mechanism the platform and the
+filesystems allow, in this order:
+
+  1. reflink (the FICLONE ioctl, Linux): on copy-on-write filesystems (btrfs, XFS with
+     reflink, bcachefs, ...) the copy shares the source's blocks, so it takes constant
+     time and no space, whatever the file size;
+  2. os.copy_file_range (Linux): the kernel copies, without the data passing through user
+     space; NFS 4.2 and SMB3 servers can even do it server-side;
+  3. os.sendfile (Linux): the same idea on older kernels and between filesystems;
+  4. a read/write loop with a 1 MB buffer.
+
+A mechanism that reports it is unsupported for this pair of files (EXDEV, EOPNOTSUPP,
+ENOSYS, ...) before copying anything falls through to the next one. On other platforms
+`shutil.copyfile` does the copy, with its own fast paths (fcopyfile on macOS, ...).
+`copy2` adds the metadata (mtime, mode, flags, extended attributes) like `shutil.copy2`.
+"""
+
+import errno
+import os
+import shutil
+import stat as stat_module
+import sys
+import typing
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_LINUX = sys.platform.startswith("linux")
+# _IOW(0x94, 9, int) from <linux/fs.h>
+FICLONE = 0x40049409
+# Kernel copies are issued in pieces of this size, so a huge file never hits an int overflow.
+_KERNEL_CHUNK_SIZE = 1 << 30
+_BUFFER_SIZE = 1 << 20
+
+# The errors that mean "this mechanism cannot copy these two files", as opposed to a real I/O error.
+_UNSUPPORTED_ERRNOS = {
+    getattr(errno, name)
+    for name in ("EXDEV", "EOPNOTSUPP", "ENOTSUP", "ENOSYS", "EINVAL", "ENOTTY", "EBADF", "ETXTBSY", "EPERM")
+    if hasattr(errno, name)
+}
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None or not _LINUX:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as e:
+        if e.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, _KERNEL_CHUNK_SIZE, offset, offset)
+
+
+def _sendfile(src_fd: int, dst_fd: int, offset: int) -> int:
+    return os.sendfile(dst_fd, src_fd, offset, _KERNEL_CHUNK_SIZE)
+
+
+def _kernel_copy(copy_chunk: typing.Callable[[int, int, int], int], src_fd: int, dst_fd: int) -> bool:
+    """
+    Copies with `copy_chunk(src_fd, dst_fd, offset)` until EOF. Returns False, with nothing
+    copied, if the first call fails as unsupported or copies nothing (some virtual
+    filesystems report a size of 0 and only give their content to read()).
+    """
+    offset = 0
+    while True:
+        try:
+            copied = copy_chunk(src_fd, dst_fd, offset)
+        except OSError as e:
+            if offset == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+                return False
+            raise
+        if copied == 0:
+            return offset > 0
+        offset += copied
+
+
+def _buffered_copy(fsrc: typing.BinaryIO, fdst: typing.BinaryIO):
+    buffer = bytearray(_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        n = fsrc.readinto(buffer)
+        if not n:
+            break
+        fdst.write(view[:n])
+
+
+def copy_file(src: typing.Union[os.PathLike, str], dst: typing.Union[os.PathLike, str]) -> str:
+    """
+    Copies the content of the file `src` to the file `dst` (created or truncated), like
+    `shutil.copyfile`, and returns the mechanism that did it: 'reflink', 'copy_file_range',
+    'sendfile', 'buffer', or 'copyfile' outside Linux. Raises `shutil.SameFileError` if both
+    are the same file and `shutil.SpecialFileError` if either is a named pipe.
+    """
+    if not _LINUX:
+        shutil.copyfile(src, dst)
+        return "copyfile"
+    with open(src, "rb") as fsrc:
+        src_st = os.fstat(fsrc.fileno())
+        if stat_module.S_ISFIFO(src_st.st_mode):
+            raise shutil.SpecialFileError(f"`{src}` is a named pipe")
+        try:
+            dst_st = os.stat(dst)
+        except OSError:
+            pass
+        else:
+            # Checked before dst is opened for writing, which would truncate src.
+            if os.path.samestat(src_st, dst_st):
+                raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+            # Opening a named pipe for writing would block until something reads it.
+            if stat_module.S_ISFIFO(dst_st.st_mode):
+                raise shutil.SpecialFileError(f"`{dst}` is a named pipe")
+        with open(dst, "wb") as fdst:
+            src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+            if _reflink(src_fd, dst_fd):
+                return "reflink"
+            if hasattr(os, "copy_file_range") and _kernel_copy(_copy_file_range, src_fd, dst_fd):
+                return "copy_file_range"
+            if hasattr(os, "sendfile") and _kernel_copy(_sendfile, src_fd, dst_fd):
+                return "sendfile"
+            _buffered_copy(fsrc, fdst)
+            return "buffer"
+
+
+def copy2(src: typing.Union[os.PathLike, str], dst: typing.Union[os.PathLike, str]) -> str:
+    """
+    A drop-in for `shutil.copy2` (also as `shutil.copytree`'s `copy_function`): copies the file
+    with `copy_file`, into `dst` if it is a directory, then its metadata. Returns the destination.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    copy_file(src, dst)
+    shutil.copystat(src, dst)
+    return dst
@@ -0,0 +1,189 @@
+"""
+nb_path_du.py - Recursive directory sizes for NbPath.du(), like the `du` command.
+
+Every directory is listed once with os.scandir and its files are summed on the spot.
+A file with several hard links is counted once, at the first path it is seen under
+(in sorted path order), like `du` does. Symlinks are not followed and not counted.
+
+With a cache file, each directory's own summary (the bytes of its files, its
+subdirectory names and its hard-linked inodes) is stored keyed by the directory's
+device, inode and mtime. A directory whose mtime has not changed is then not listed
+again: only the directory itself is stat'ed. The mtime of a directory changes when
+entries are created, deleted or renamed in it, but not when an existing file is
+rewritten in place, so the cache suits trees whose files are written once (artifact
+stores, backups, datasets). Directories modified in the last couple of seconds are not
+stored: an entry added within the same timestamp tick would otherwise go unnoticed.
+"""
+
+from collections import namedtuple
+import concurrent.futures
+import json
+import math
+import os
+import time
+import typing
+
+# The result of NbPath.du(). `dirs` maps each directory's path relative to the root
+# ('.' for the root itself, '/'-separated) to its recursive total in bytes.
+DiskUsage = namedtuple("DiskUsage", ["total", "file_count", "dirs"])
+
+# What is known about one directory without looking at its subdirectories.
+_DirSummary = namedtuple("_DirSummary", ["dev", "ino", "mtime_ns", "size", "file_count", "subdirs", "hardlinks"])
+
+
+def format_size(size_bytes: int) -> str:
+    """Formats a byte count for humans, e.g. '1.23 MB'."""
+    if size_bytes == 0:
+        return "0 B"
+    size_name = ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
+    i = int(math.floor(math.log(size_bytes, 1024)))
+    p = math.pow(1024, i)
+    s = round(size_bytes / p, 2)
+    return f"{s} {size_name[i]}"
+
+
+def _file_bytes(st: os.stat_result, apparent_size: bool) -> int:
+    if apparent_size or not hasattr(st, "st_blocks"):
+        return st.st_size
+    return st.st_blocks * 512
+
+
+def _summarize_dir(
+    path: str, cached: typing.Optional[_DirSummary], apparent_size: bool
+) -> typing.Optional[_DirSummary]:
+    """Returns the summary of one directory, reusing `cached` if the directory has not changed."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if cached is not None and (cached.dev, cached.ino, cached.mtime_ns) == (st.st_dev, st.st_ino, st.st_mtime_ns):
+        return cached
+    size = file_count = 0
+    subdirs, hardlinks = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_symlink():
+                        continue
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    entry_st = entry.stat()
+                except OSError:
+                    continue
+                file_count += 1
+                if entry_st.st_nlink > 1:
+                    hardlinks.append((entry_st.st_dev, entry_st.st_ino, _file_bytes(entry_st, apparent_size)))
+                else:
+                    size += _file_bytes(entry_st, apparent_size)
+    except OSError:
+        return None
+    return _DirSummary(st.st_dev, st.st_ino, st.st_mtime_ns, size, file_count, sorted(subdirs), hardlinks)
+
+
+def _summarize_tree(
+    top: str, cache: typing.Dict[str, _DirSummary], apparent_size: bool, workers: typing.Optional[int]
+) -> typing.Dict[str, _DirSummary]:
+    """Summarizes every directory below `top`, keyed by relative path ('.' for `top`)."""
+    summaries = {}
+
+    def child_jobs(rel: str, summary: _DirSummary):
+        for name in summary.subdirs:
+            child_rel = name if rel == "." else f"{rel}/{name}"
+            yield child_rel, os.path.join(top, *child_rel.split("/"))
+
+    if workers is None or workers <= 1:
+        stack = [(".", top)]
+        while stack:
+            rel, path = stack.pop()
+            summary = _summarize_dir(path, cache.get(rel), apparent_size)
+            if summary is not None:
+                summaries[rel] = summary
+                stack.extend(child_jobs(rel, summary))
+        return summaries
+
+    # As in the parallel walker, only a few directories per worker are queued on the pool;
+    # the others wait here as plain paths.
+    limit = workers * 4
+    backlog = [(".", top)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nb_path_du") as pool:
+        pending = {}
+        while backlog or pending:
+            while backlog and len(pending) < limit:
+                rel, path = backlog.pop()
+                pending[pool.submit(_summarize_dir, path, cache.get(rel), apparent_size)] = rel
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                rel = pending.pop(future)
+                summary = future.result()
+                if summary is None:
+                    continue
+                summaries[rel] = summary
+                backlog.extend(child_jobs(rel, summary))
+    return summaries
+
+
+def _load_cache(cache_path: typing.Optional[str]) -> typing.Dict[str, _DirSummary]:
+    if not cache_path:
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        return {
+            rel: _DirSummary(dev, ino, mtime_ns, size, file_count, subdirs, [tuple(h) for h in hardlinks])
+            for rel, (dev, ino, mtime_ns, size, file_count, subdirs, hardlinks) in raw.items()
+        }
+    except (OSError, ValueError, TypeError):
+        # Unreadable, or written by an older version: start over.
+        return {}
+
+
+def _save_cache(cache_path: str, summaries: typing.Dict[str, _DirSummary], racy_ns: int):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    now = time.time_ns()
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({rel: list(summary) for rel, summary in summaries.items() if now - summary.mtime_ns >= racy_ns}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def disk_usage(
+    top: typing.Union[os.PathLike, str],
+    workers: typing.Optional[int] = None,
+    cache_path: typing.Optional[str] = None,
+    apparent_size: bool = True,
+    racy_seconds: float = 2.0,
+) -> DiskUsage:
+    """
+    Computes the `DiskUsage` of the tree below `top` (see the module docstring). Summaries of
+    directories modified less than `racy_seconds` ago are not written to the cache.
+    """
+    top = os.fspath(top)
+    summaries = _summarize_tree(top, _load_cache(cache_path), apparent_size, workers)
+    if cache_path:
+        _save_cache(cache_path, summaries, int(racy_seconds * 1e9))
+
+    # Count each hard-linked inode once, under the first directory (in path order) that has it.
+    seen_inodes = set()
+    own_size = {}
+    for rel in sorted(summaries):
+        summary = summaries[rel]
+        size = summary.size
+        for dev, ino, link_size in summary.hardlinks:
+            if (dev, ino) not in seen_inodes:
+                seen_inodes.add((dev, ino))
+                size += link_size
+        own_size[rel] = size
+
+    # Roll the sizes up, deepest directories first.
+    totals = dict(own_size)
+    for rel in sorted(summaries, key=lambda r: r.count("/"), reverse=True):
+        if rel != ".":
+            parent = rel.rpartition("/")[0] or "."
+            if parent in totals:
+                totals[parent] += totals[rel]
+    file_count = sum(summary.file_count for summary in summaries.values())
+    return DiskUsage(totals.get(".", 0), file_count, totals)
@@ -0,0 +1,90 @@
+"""
+nb_path_encoding.py - Bounded, cached text encoding detection for NbPath.read_text and grep.
+
+Detection feeds chardet's incremental UniversalDetector with at most `sample_size`
+bytes from the start of the file and stops as soon as the detector is confident.
+Results are cached per (absolute path, mtime, size), so a file is only sniffed again
+after it changes. Files modified in the last couple of seconds are not cached: a rewrite
+within the same timestamp tick, with the same size, would otherwise go unnoticed.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+import typing
+
+try:
+    from chardet import UniversalDetector
+except ImportError:  # chardet < 5
+    from chardet.universaldetector import UniversalDetector
+
+# How many bytes are sampled by default.
+DEFAULT_SAMPLE_SIZE = 64 * 1024
+
+# What is returned when nothing could be detected (e.g. an empty file).
+FALLBACK_ENCODING = "utf-8"
+
+_FEED_SIZE = 4096
+_CACHE_MAX_SIZE = 4096
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _normalize(encoding: typing.Optional[str]) -> str:
+    if not encoding:
+        return FALLBACK_ENCODING
+    encoding = encoding.lower()
+    # A pure-ASCII sample says nothing about the rest of the file; UTF-8 decodes ASCII
+    # identically and does not drop later non-ASCII text.
+    if encoding == "ascii":
+        return FALLBACK_ENCODING
+    return encoding
+
+
+def detect_bytes_encoding(sample: bytes) -> str:
+    """Detects the encoding of an in-memory sample (e.g. the head of a decompressed stream)."""
+    detector = UniversalDetector()
+    for start in range(0, len(sample), _FEED_SIZE):
+        detector.feed(sample[start:start + _FEED_SIZE])
+        if detector.done:
+            break
+    detector.close()
+    return _normalize(detector.result.get("encoding"))
+
+
+def detect_file_encoding(
+    path: typing.Union[os.PathLike, str], sample_size: int = DEFAULT_SAMPLE_SIZE, racy_seconds: float = 2.0
+) -> str:
+    """
+    Detects the encoding of a file from at most `sample_size` bytes, using the
+    (path, mtime, size) cache. Returns a codec name usable with `open()`. Files modified
+    less than `racy_seconds` ago are sniffed every time.
+    """
+    path = os.path.abspath(os.fspath(path))
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size, sample_size)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    detector = UniversalDetector()
+    remaining = sample_size
+    with open(path, "rb") as f:
+        while remaining > 0 and not detector.done:
+            chunk = f.read(min(_FEED_SIZE, remaining))
+            if not chunk:
+                break
+            detector.feed(chunk)
+            remaining -= len(chunk)
+    detector.close()
+    encoding = _normalize(detector.result.get("encoding"))
+
+    if time.time_ns() - st.st_mtime_ns < int(racy_seconds * 1e9):
+        return encoding
+    with _cache_lock:
+        _cache[key] = encoding
+        while len(_cache) > _CACHE_MAX_SIZE:
+            _cache.popitem(last=False)
+    return encoding
@@ -0,0 +1,235 @@
+"""
+nb_path_gitignore.py - .gitignore semantics for NbPath.walk_tree(respect_gitignore=True).
+
+Implements the rules of `git help gitignore`:
+  - every directory may have its own .gitignore, whose patterns are relative to it;
+    rules of deeper files take precedence over those of their parents, and
+    `.git/info/exclude` comes last, below the root .gitignore;
+  - within the rules that apply, the last matching rule decides, so a later `!pattern`
+    re-includes what an earlier rule ignored;
+  - a pattern with a '/' at the start or in the middle is anchored to the directory of its
+    .gitignore, otherwise it matches a name at any depth below it;
+  - a trailing '/' only matches directories; '**' matches any number of directories;
+  - a file cannot be re-included if one of its parent directories is ignored, which falls out
+    of the walker never entering ignored directories.
+
+The rules of one .gitignore file are not tried one by one. Plain names and '*'+suffix rules
+go into dicts, the remaining name globs and path globs into one combined regex each. Only
+when a combined regex matches and the file has negated rules are its rules tried
+individually (from the last one) to find which rule decides.
+"""
+
+import os
+import re
+import threading
+import typing
+
+from nb_path.nb_path_matcher import PathMatcher, _CASE_INSENSITIVE, _NAME_FLAGS, _WILDCARDS, _glob_part_regex
+
+GITIGNORE_FILE_NAME = ".gitignore"
+
+
+def parse_gitignore_line(line: str) -> typing.Optional[typing.Tuple[str, bool, bool, bool]]:
+    """
+    Parses one line of a .gitignore file into `(pattern, negated, dir_only, anchored)`,
+    or returns None for blank lines and comments. `pattern` has no leading or trailing '/'.
+    """
+    line = line.rstrip("\r\n")
+    # Trailing spaces are ignored unless escaped with a backslash.
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        stripped += " "
+    line = stripped
+    if not line or line.startswith("#"):
+        return None
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    anchored = "/" in line
+    return line.lstrip("/"), negated, dir_only, anchored
+
+
+def _anchored_regex(pattern: str) -> str:
+    """The regex (without anchors) of a pattern matched against the whole path below its directory."""
+    parts = pattern.split("/")
+    out = []
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == "**":
+            # 'a/**' matches everything inside a; '**/b' and 'a/**/b' match zero or more directories.
+            out.append(".*" if last else "(?:.*/)?")
+        else:
+            out.append(_glob_part_regex(part, escapes=True) + ("" if last else "/"))
+    return "".join(out)
+
+
+def _unescape(name: str) -> str:
+    return re.sub(r"\\(.)", r"\1", name)
+
+
+class IgnoreRules:
+    """The compiled rules of one ignore file. `check()` tells whether the last matching rule ignores a path."""
+
+    def __init__(self, lines: typing.Iterable[str]):
+        self.negated = []
+        # For files and for directories: name -> index of the last rule, suffix -> index, and the
+        # combined regexes of the other name globs and of the anchored path globs.
+        self._names = ({}, {})
+        self._suffixes = ({}, {})
+        self._name_res = ([], [])
+        self._path_res = ([], [])
+        for line in lines:
+            parsed = parse_gitignore_line(line)
+            if parsed is None:
+                continue
+            pattern, negated, dir_only, anchored = parsed
+            index = len(self.negated)
+            self.negated.append(negated)
+            kinds = (1,) if dir_only else (0, 1)
+            if anchored:
+                for kind in kinds:
+                    self._path_res[kind].append((index, _anchored_regex(pattern)))
+            elif not _WILDCARDS.intersection(pattern):
+                for kind in kinds:
+                    self._names[kind][_fold(_unescape(pattern))] = index
+            # A bare '*' has an empty suffix, which the suffix table cannot match: it goes to the regex.
+            elif (len(pattern) > 1 and pattern[0] == "*" and not _WILDCARDS.intersection(pattern[1:])
+                  and "\\" not in pattern):
+                for kind in kinds:
+                    self._suffixes[kind][_fold(pattern[1:])] = index
+            else:
+                for kind in kinds:
+                    self._name_res[kind].append((index, _glob_part_regex(pattern, escapes=True)))
+        self._has_negation = any(self.negated)
+        self._suffix_lengths = tuple(sorted({len(s) for d in self._suffixes for s in d}))
+        self._name_res = tuple(_combine(rules) for rules in self._name_res)
+        self._path_res = tuple(_combine(rules) for rules in self._path_res)
+
+    def __bool__(self):
+        return bool(self.negated)
+
+    def check(self, sub_path: str, is_dir: bool) -> typing.Optional[bool]:
+        """
+        For a path relative to the directory of the ignore file: True if ignored, False if re-included
+        by a negated rule, None if no rule matches.
+        """
+        kind = 1 if is_dir else 0
+        name = sub_path.rpartition("/")[2]
+        folded = _fold(name)
+        best = self._names[kind].get(folded, -1)
+        suffixes = self._suffixes[kind]
+        if suffixes:
+            for length in self._suffix_lengths:
+                best = max(best, suffixes.get(folded[-length:], -1))
+        for combined, text in ((self._name_res[kind], name), (self._path_res[kind], sub_path)):
+            if combined is None:
+                continue
+            any_match, rules = combined
+            if any_match(text) is None:
+                continue
+            if not self._has_negation:
+                return True
+            best = max(best, next(index for index, rule_match in rules if rule_match(text)))
+        if best < 0:
+            return None
+        return not self.negated[best]
+
+
+def _fold(name: str) -> str:
+    return name.lower() if _CASE_INSENSITIVE else name
+
+
+def _combine(rules: typing.List[typing.Tuple[int, str]]):
+    """
+    Returns `(any_match, [(rule index, match), ...])` for a list of `(rule index, regex)`, the
+    individual matchers from the last rule to the first. (Capturing groups to tell the matching
+    alternative apart would make the combined regex quadratic in the number of rules.)
+    """
+    if not rules:
+        return None
+    any_match = re.compile("|".join(body for _, body in rules), _NAME_FLAGS).fullmatch
+    individual = [(index, re.compile(body, _NAME_FLAGS).fullmatch) for index, body in sorted(rules, reverse=True)]
+    return any_match, individual
+
+
+def _find_git_root(directory: str) -> typing.Optional[str]:
+    current = os.path.abspath(directory)
+    while True:
+        if os.path.exists(os.path.join(current, ".git")):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+
+class GitIgnoreMatcher:
+    """
+    Decides whether paths below `root` are ignored by git, reading every .gitignore on the way
+    (lazily, once per directory) from the repository root down. If `root` is not inside a git
+    repository, `root` itself is where .gitignore files start to apply. The `.git` directory is
+    always ignored. Optional `extra` patterns (a `PathMatcher`) are excluded too.
+
+    It has the same `match(rel_path, is_dir)` interface as `PathMatcher`, so the walker can prune with it.
+    Thread-safe, so it can be shared by the threads of a parallel walk.
+    """
+
+    def __init__(self, root: typing.Union[os.PathLike, str], extra: typing.Optional[PathMatcher] = None):
+        self.root = os.path.abspath(os.fspath(root))
+        self.extra = extra
+        self.git_root = _find_git_root(self.root) or self.root
+        base = os.path.relpath(self.root, self.git_root).replace(os.sep, "/")
+        self._base = "" if base == "." else base + "/"
+        self._rules = {}
+        self._lock = threading.Lock()
+        self._info_exclude = self._read_rules(os.path.join(self.git_root, ".git", "info", "exclude"))
+
+    def __bool__(self):
+        return True
+
+    @staticmethod
+    def _read_rules(path: str) -> typing.Optional[IgnoreRules]:
+        try:
+            with open(path, "r", encoding="utf-8", errors="surrogateescape") as f:
+                rules = IgnoreRules(f)
+        except OSError:
+            return None
+        return rules or None
+
+    def _rules_of(self, rel_dir: str) -> typing.Optional[IgnoreRules]:
+        """The compiled .gitignore of a directory given relative to the git root ('' for the root)."""
+        try:
+            return self._rules[rel_dir]
+        except KeyError:
+            pass
+        rules = self._read_rules(os.path.join(self.git_root, *rel_dir.split("/"), GITIGNORE_FILE_NAME))
+        with self._lock:
+            return self._rules.setdefault(rel_dir, rules)
+
+    def match(self, rel_path: str, is_dir: bool = False) -> bool:
+        """True if the path (relative to `root`, '/'-separated) is ignored."""
+        if self.extra and self.extra.match(rel_path, is_dir):
+            return True
+        path = self._base + rel_path
+        if is_dir and path.rpartition("/")[2] == ".git":
+            return True
+        # From the deepest .gitignore up: the first one with a matching rule decides.
+        end = len(path)
+        while True:
+            cut = path.rfind("/", 0, end)
+            rel_dir = path[:cut] if cut > 0 else ""
+            rules = self._rules_of(rel_dir)
+            if rules is not None:
+                result = rules.check(path[cut + 1:], is_dir)
+                if result is not None:
+                    return result
+            if cut <= 0:
+                break
+            end = cut
+        if self._info_exclude is not None:
+            return bool(self._info_exclude.check(path, is_dir))
+        return False
@@ -0,0 +1,713 @@
+"""
+nb_path_grep.py - The search engine behind NbPath.grep.
+
+Everything here is module-level so that it can be pickled and shipped to worker
+processes when `grep(workers=..., executor="process")` is used.
+"""
+
+import bz2
+import codecs
+from collections import deque, namedtuple
+import concurrent.futures
+import gzip
+import io
+import itertools
+import lzma
+import mmap
+import os
+import re
+import typing
+import zipfile
+
+from nb_path.nb_path_encoding import DEFAULT_SAMPLE_SIZE, detect_bytes_encoding, detect_file_encoding
+
+try:
+    import re._parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# Defined at module level (and re-exposed as NbPath.GrepResult) so that results
+# can cross process boundaries when grepping with a process pool.
+GrepResult = namedtuple(
+    "GrepResult", ["path", "line_number", "line_content", "match", "context_lines"]
+)
+
+# What multi-pattern grep yields: a GrepResult plus the key of the pattern that hit.
+MultiGrepResult = namedtuple(
+    "MultiGrepResult", ["path", "line_number", "line_content", "match", "context_lines", "pattern_key"]
+)
+
+_LINE_RESULT_TYPES = (GrepResult, MultiGrepResult)
+
+# What grep(mode="count") yields: the number of hits in one file.
+GrepCount = namedtuple("GrepCount", ["path", "count"])
+
+# The values accepted by grep's `mode` argument.
+GREP_MODES = ("lines", "first", "count", "files")
+
+# The `encoding` value that asks grep to detect each file's encoding.
+AUTO_ENCODING = "auto"
+
+# Per-file settings shared by every file of one grep call.
+GrepOptions = namedtuple(
+    "GrepOptions",
+    ["encoding", "before", "after", "skip_binary", "merge_context", "search_compressed", "mode", "max_count"],
+    defaults=["utf-8", 0, 0, True, False, False, "lines", None],
+)
+
+# How much of a file is sniffed for null bytes (shared with NbPath.is_binary).
+BINARY_SNIFF_SIZE = 1024
+
+# Compressed formats grep can read through, by magic bytes.
+_COMPRESSION_MAGIC = [
+    (b"\x1f\x8b", "gz"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"PK\x03\x04", "zip"),
+    (b"PK\x05\x06", "zip"),  # An empty archive.
+]
+_COMPRESSED_OPENERS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+# Size of the decoded text blocks read by the whole-buffer fast path.
+BUFFER_CHUNK_SIZE = 1 << 20
+
+# With merge_context, a block of context is ended at the next match once it holds this
+# many lines, so a file full of matches is not kept in memory as one block.
+MERGED_GROUP_MAX_LINES = 10_000
+
+# Regex constructs whose meaning depends on where the searched string ends
+# (`$`, `\Z`, `\B` at the line end, lookarounds, `\A`). A line-by-line search and a
+# whole-buffer search can disagree on them, so such patterns use the line loop.
+_BUFFER_UNSAFE_RE = re.compile(r"\$|\\[AZB]|\(\?[=!<]")
+
+# Backreferences cannot be combined into one alternation: group numbers would shift.
+_BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+def is_binary_chunk(chunk: bytes) -> bool:
+    """The null-byte heuristic used by NbPath.is_binary and grep's binary-file skip."""
+    return b"\x00" in chunk
+
+
+# UTF-16 and UTF-32 text is full of null bytes (UTF-32 LE's BOM starts with UTF-16 LE's).
+_WIDE_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE, codecs.BOM_UTF32_BE)
+
+
+def _is_wide_encoding(encoding: str) -> bool:
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    return name.startswith(("utf-16", "utf-32"))
+
+
+def skip_as_binary(chunk: bytes, encoding: str) -> bool:
+    """
+    grep's binary-file skip: `is_binary_chunk`, except for text that is UTF-16/32 by its
+    (given or detected) `encoding` or by a byte order mark.
+    """
+    if chunk.startswith(_WIDE_BOMS) or _is_wide_encoding(encoding):
+        return False
+    return is_binary_chunk(chunk)
+
+
+def parse_context(context: typing.Union[int, typing.Tuple[int, int]] = None) -> typing.Tuple[int, int]:
+    """Normalizes the `context` argument of grep into a `(before, after)` tuple."""
+    if context is None:
+        return 0, 0
+    if isinstance(context, int):
+        return context, context
+    if isinstance(context, tuple) and len(context) == 2:
+        return context
+    raise ValueError(
+        "`context` must be an integer or a tuple of two integers (before, after)."
+    )
+
+
+class _PatternSpec:
+    """One search pattern of a grep call, compiled."""
+
+    def __init__(self, key, pattern: str, is_regex: bool, ignore_case: bool):
+        self.key = key
+        self.pattern = pattern
+        self.is_regex = is_regex
+        self.ignore_case = ignore_case
+        if is_regex:
+            try:
+                self.compiled_pattern = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+            except re.error as e:
+                raise ValueError(f"Invalid regular expression: {pattern}") from e
+        else:
+            self.search_str = pattern.lower() if ignore_case else pattern
+        self.required_literal = self._find_required_literal()
+
+    def search(self, line: str):
+        if self.is_regex:
+            return self.compiled_pattern.search(line)
+        line_to_search = line.lower() if self.ignore_case else line
+        if self.search_str in line_to_search:
+            return self.pattern
+        return None
+
+    def _find_required_literal(self) -> typing.Optional[str]:
+        """
+        Returns a substring that every matching line must contain, or None if there is none.
+        Used to reject whole files with a bytes search before decoding them.
+        """
+        ignore_case = self.ignore_case
+        if not self.is_regex:
+            candidates = [self.pattern]
+        else:
+            try:
+                parsed = sre_parse.parse(self.pattern, self.compiled_pattern.flags)
+            except Exception:
+                return None
+            ignore_case = ignore_case or bool(parsed.state.flags & re.IGNORECASE)  # inline (?i)
+            candidates = _literal_runs(parsed)
+
+        if ignore_case:
+            # Case folding (e.g. 'K' and the Kelvin sign) makes byte comparison unreliable,
+            # so only caseless characters such as digits and punctuation can be used.
+            candidates = [
+                part
+                for c in candidates
+                for part in "".join(ch if ch.lower() == ch.upper() else "\0" for ch in c).split("\0")
+            ]
+        # Line endings are translated when decoding, so they never appear verbatim in the raw bytes.
+        candidates = [part for c in candidates for part in re.split(r"[\r\n]", c) if part]
+        return max(candidates, key=len) if candidates else None
+
+
+class GrepMatcher:
+    """
+    A picklable line matcher built once per grep call.
+
+    `pattern` is a single pattern, or a list / dict of patterns that are all searched in
+    the same pass (the dict keys, or the patterns themselves for a list, tag the hits).
+
+    `search(line)` returns None when the line does not match. Otherwise, for a single
+    pattern it returns the regex match object (regex mode) or the original pattern string
+    (plain string mode); for several patterns it returns a list of `(key, match)` pairs.
+    """
+
+    def __init__(
+        self,
+        pattern: typing.Union[str, typing.List[str], typing.Dict[typing.Any, str]],
+        is_regex: bool = True,
+        ignore_case: bool = False,
+    ):
+        self.is_regex = is_regex
+        self.ignore_case = ignore_case
+        self.is_multi = not isinstance(pattern, str)
+        if not self.is_multi:
+            items = [(None, pattern)]
+        elif isinstance(pattern, dict):
+            items = list(pattern.items())
+        else:
+            items = [(p, p) for p in pattern]
+        if not items:
+            raise ValueError("At least one pattern is required.")
+        self.specs = [_PatternSpec(key, p, is_regex, ignore_case) for key, p in items]
+        self.specs_by_key = {spec.key: spec for spec in self.specs}
+        self._single = None if self.is_multi else self.specs[0]
+        self._required_bytes = {}
+
+        # Plain strings searched case-insensitively are matched against lowercased text.
+        self.lowercase_text = not is_regex and ignore_case
+
+        # One alternation of all patterns, used to reject lines (or whole buffers) with a
+        # single search. None for a single pattern, or when the patterns cannot be combined
+        # (backreferences, conflicting group names or inline flags).
+        self.combined_pattern = None
+        if self.is_multi:
+            if is_regex:
+                sources = [p for _, p in items]
+                if not any(_BACKREF_RE.search(p) for p in sources):
+                    self.combined_pattern = _try_compile(
+                        "|".join(f"(?:{p})" for p in sources), re.IGNORECASE if ignore_case else 0
+                    )
+            else:
+                literals = sorted({spec.search_str for spec in self.specs}, key=len, reverse=True)
+                self.combined_pattern = _try_compile("|".join(re.escape(lit) for lit in literals))
+
+        # The pattern used by the whole-buffer fast path. Every candidate it finds is
+        # re-checked with `search(line)`, so it only has to never miss a line.
+        self.buffer_pattern = None
+        if not is_regex:
+            if self.is_multi:
+                self.buffer_pattern = self.combined_pattern
+        elif not any(_BUFFER_UNSAFE_RE.search(spec.pattern) for spec in self.specs):
+            base = self.combined_pattern if self.is_multi else self._single.compiled_pattern
+            if base is not None:
+                self.buffer_pattern = re.compile(base.pattern, base.flags | re.MULTILINE)
+
+    @property
+    def supports_buffer_scan(self) -> bool:
+        return self.buffer_pattern is not None or (self._single is not None and not self.is_regex)
+
+    def find_in_buffer(self, buffer: str, pos: int) -> int:
+        """
+        Returns the index of the first candidate hit at or after `pos`, or -1.
+        When `lowercase_text` is set, `buffer` must already be lowercased.
+        """
+        if self.buffer_pattern is not None:
+            m = self.buffer_pattern.search(buffer, pos)
+            return m.start() if m else -1
+        return buffer.find(self._single.search_str, pos)
+
+    @property
+    def required_literals(self) -> typing.Optional[typing.List[str]]:
+        """
+        Substrings of which every matching line must contain at least one, or None
+        when some pattern has no required literal.
+        """
+        literals = [spec.required_literal for spec in self.specs]
+        return None if None in literals else literals
+
+    def required_bytes(self, encoding: str) -> typing.Optional[typing.List[bytes]]:
+        """`required_literals` encoded the way they would appear inside a file in `encoding`."""
+        if encoding not in self._required_bytes:
+            needles = None
+            if self.required_literals is not None:
+                try:
+                    # Encoding after a prefix drops any BOM the codec would emit at the start.
+                    prefix = " ".encode(encoding)
+                    needles = [(" " + lit).encode(encoding)[len(prefix):] for lit in self.required_literals]
+                except (LookupError, UnicodeError):
+                    needles = None
+            self._required_bytes[encoding] = needles if needles and all(needles) else None
+        return self._required_bytes[encoding]
+
+    def search(self, line: str):
+        if self._single is not None:
+            return self._single.search(line)
+
+        text = line.lower() if self.lowercase_text else line
+        if self.combined_pattern is not None and not self.combined_pattern.search(text):
+            return None
+        if self.is_regex:
+            hits = []
+            for spec in self.specs:
+                m = spec.compiled_pattern.search(line)
+                if m is not None:
+                    hits.append((spec.key, m))
+        else:
+            hits = [(spec.key, spec.pattern) for spec in self.specs if spec.search_str in text]
+        return hits or None
+
+    def make_results(self, file, line_num: int, line: str, hit, context_lines: list) -> list:
+        """Turns a non-None `search()` return value into the result tuples to yield."""
+        if self._single is not None:
+            return [GrepResult(file, line_num, line, hit, context_lines)]
+        return [MultiGrepResult(file, line_num, line, m, context_lines, key) for key, m in hit]
+
+
+def _try_compile(pattern: str, flags: int = 0):
+    try:
+        return re.compile(pattern, flags)
+    except re.error:
+        return None
+
+
+def _literal_runs(parsed) -> typing.List[str]:
+    """Collects the runs of consecutive literal characters that every match must contain."""
+    runs, current = [], []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(av))
+            continue
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            # A plain group: its own top-level sequence is just as mandatory.
+            runs.append("".join(current))
+            current = []
+            runs.extend(_literal_runs(av[3]))
+            continue
+        runs.append("".join(current))
+        current = []
+    runs.append("".join(current))
+    return [r for r in runs if r]
+
+
+def may_contain_match(file, matcher: GrepMatcher, options: GrepOptions) -> bool:
+    """
+    Cheap whole-file checks done on raw bytes before any decoding: skips binary files
+    (when `options.skip_binary`) and files that lack the pattern's required literal.
+    """
+    needles = matcher.required_bytes(options.encoding)
+    if not options.skip_binary and needles is None:
+        return True
+    with open(file, "rb") as f:
+        head = f.read(BINARY_SNIFF_SIZE)
+        if options.skip_binary and skip_as_binary(head, options.encoding):
+            return False
+        if needles is None:
+            return True
+        if len(head) < BINARY_SNIFF_SIZE:
+            return any(needle in head for needle in needles)
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return any(mm.find(needle) != -1 for needle in needles)
+        except (ValueError, OSError):
+            # Not mappable (special files, some network filesystems): just scan it.
+            return True
+
+
+def iter_grep_file(
+    file, matcher: GrepMatcher, options: GrepOptions = GrepOptions()
+) -> typing.Generator[GrepResult, None, None]:
+    """
+    Yields the matches of a single file.
+
+    Binary files and files without the required literal are rejected by
+    `may_contain_match` first. Without context lines, and when the pattern allows it,
+    the file is scanned in large blocks by `scan_buffer`; otherwise it is read line by
+    line by `scan_lines`. Both produce identical results.
+
+    With `options.search_compressed`, gzip / bz2 / xz files are decompressed on the fly
+    and every member of a ZIP archive is searched (reported as `archive!member`).
+    With `options.encoding == "auto"`, each file's encoding is detected from a sample.
+    """
+    if options.search_compressed:
+        compression = detect_compression(file)
+        if compression == "zip":
+            yield from _grep_zip(file, matcher, options)
+            return
+        if compression is not None:
+            with _COMPRESSED_OPENERS[compression](file, "rb") as stream:
+                yield from _grep_binary_stream(stream, file, matcher, options)
+            return
+
+    if options.encoding == AUTO_ENCODING:
+        options = options._replace(encoding=detect_file_encoding(file))
+    if not may_contain_match(file, matcher, options):
+        return
+    with open(file, "r", encoding=options.encoding, errors="ignore") as f:
+        yield from _scan_text(f, file, matcher, options)
+
+
+def _scan_text(f, file, matcher: GrepMatcher, options: GrepOptions):
+    if options.mode in ("count", "files"):
+        count = count_matches(f, matcher, 1 if options.mode == "files" else options.max_count)
+        if count:
+            yield GrepCount(file, count) if options.mode == "count" else file
+        return
+
+    before, after = options.before, options.after
+    if before == 0 and after == 0 and matcher.supports_buffer_scan:
+        results = scan_buffer(f, file, matcher)
+    else:
+        results = scan_lines(f, file, matcher, before, after, merge_context=options.merge_context)
+    limit = 1 if options.mode == "first" else options.max_count
+    if limit is not None:
+        # Stop pulling (and reading the file) once enough results were produced.
+        results = itertools.islice(results, limit)
+    yield from results
+
+
+def detect_compression(file) -> typing.Optional[str]:
+    """Returns 'gz', 'bz2', 'xz' or 'zip' based on the file's magic bytes, or None."""
+    with open(file, "rb") as f:
+        head = f.read(6)
+    for magic, compression in _COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _grep_binary_stream(stream, file, matcher: GrepMatcher, options: GrepOptions):
+    """Greps a decompressed binary stream (anything with `peek`, e.g. GzipFile, ZipExtFile)."""
+    if options.encoding == AUTO_ENCODING:
+        options = options._replace(encoding=detect_bytes_encoding(stream.peek(DEFAULT_SAMPLE_SIZE)))
+    if options.skip_binary and skip_as_binary(stream.peek(BINARY_SNIFF_SIZE)[:BINARY_SNIFF_SIZE], options.encoding):
+        return
+    text = io.TextIOWrapper(stream, encoding=options.encoding, errors="ignore")
+    try:
+        yield from _scan_text(text, file, matcher, options)
+    finally:
+        text.detach()  # Leave closing the stream to its owner.
+
+
+def _grep_zip(file, matcher: GrepMatcher, options: GrepOptions):
+    with zipfile.ZipFile(file) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            member_path = type(file)(f"{file}!{info.filename}")
+            with zf.open(info) as stream:
+                yield from _grep_binary_stream(stream, member_path, matcher, options)
+
+
+def scan_lines(
+    f,
+    file,
+    matcher: GrepMatcher,
+    before: int = 0,
+    after: int = 0,
+    first_line_num: int = 1,
+    merge_context: bool = False,
+) -> typing.Generator[GrepResult, None, None]:
+    """
+    The reference line-by-line scanner: runs the matcher on every line of `f`, in one pass.
+
+    The last `before` lines are kept in a ring buffer. A result that still needs its
+    `after` lines waits in a small queue and is yielded once they have been read, so
+    every line (including those inside another match's context) is tested, and at
+    most `after + 1` results are held at a time.
+
+    With `merge_context=True`, matches whose context windows overlap or touch form one
+    group, like the blocks GNU grep separates with `--`: all results of a group share a
+    single `context_lines` list covering the whole block, and are yielded when it ends.
+    A block that grows beyond `MERGED_GROUP_MAX_LINES` lines is split at its next match.
+    """
+    if merge_context:
+        yield from _scan_lines_merged(f, file, matcher, before, after, first_line_num)
+        return
+
+    lines_buffer = deque(maxlen=before)
+    waiting = deque()  # [results of one line, which share context_lines; after lines still missing]
+
+    for line_num, line in enumerate(f, first_line_num):
+        for entry in waiting:
+            entry[0][0].context_lines.append((line_num, line))
+            entry[1] -= 1
+        while waiting and waiting[0][1] == 0:
+            yield from waiting.popleft()[0]
+
+        hit = matcher.search(line)
+        if hit is not None:
+            context_lines = list(lines_buffer)
+            context_lines.append((line_num, line))
+            results = matcher.make_results(file, line_num, line, hit, context_lines)
+            if after > 0:
+                waiting.append([results, after])
+            else:
+                yield from results
+
+        if before > 0:
+            lines_buffer.append((line_num, line))
+
+    # End of file: whatever is still waiting gets a shorter 'after' context.
+    for results, _ in waiting:
+        yield from results
+
+
+def _scan_lines_merged(f, file, matcher: GrepMatcher, before: int, after: int, first_line_num: int):
+    lines_buffer = deque(maxlen=before)
+    group_lines, group_results = None, []
+    last_match_num = 0
+
+    for line_num, line in enumerate(f, first_line_num):
+        hit = matcher.search(line)
+        if hit is not None:
+            if group_lines is not None and len(group_lines) >= MERGED_GROUP_MAX_LINES:
+                yield from group_results
+                group_lines, group_results = None, []
+            if group_lines is None:
+                group_lines = list(lines_buffer)
+            else:
+                # Lines between the previous 'after' window and this match's 'before' window.
+                group_lines.extend(item for item in lines_buffer if item[0] > group_lines[-1][0])
+            group_lines.append((line_num, line))
+            group_results.extend(matcher.make_results(file, line_num, line, hit, group_lines))
+            last_match_num = line_num
+        elif group_lines is not None:
+            if line_num <= last_match_num + after:
+                group_lines.append((line_num, line))
+            elif line_num > last_match_num + after + before:
+                # No later match can reach back into this group any more.
+                yield from group_results
+                group_lines, group_results = None, []
+
+        if before > 0:
+            lines_buffer.append((line_num, line))
+
+    yield from group_results
+
+
+def scan_buffer(
+    f, file, matcher: GrepMatcher, chunk_size: int = BUFFER_CHUNK_SIZE
+) -> typing.Generator[GrepResult, None, None]:
+    """
+    The fast scanner: reads `f` in blocks of whole lines, searches each block with a
+    single regex / `str.find` call, and only slices out and numbers the lines that
+    contain a hit. The text is still decoded by the file object, so newline
+    translation and decoding are exactly those of `scan_lines`.
+    """
+    for line_num, line, hit in iter_hit_lines(f, matcher, chunk_size):
+        yield from matcher.make_results(file, line_num, line, hit, [(line_num, line)])
+
+
+def iter_hit_lines(
+    f, matcher: GrepMatcher, chunk_size: int = BUFFER_CHUNK_SIZE
+) -> typing.Generator[typing.Tuple[int, str, typing.Any], None, None]:
+    """Yields `(line_number, line, hit)` for every matching line, using block scans when possible."""
+    if not matcher.supports_buffer_scan:
+        for line_num, line in enumerate(f, 1):
+            hit = matcher.search(line)
+            if hit is not None:
+                yield line_num, line, hit
+        return
+
+    carry = ""
+    first_line_num = 1
+    while True:
+        chunk = f.read(chunk_size)
+        if chunk:
+            block = carry + chunk
+            cut = block.rfind("\n") + 1
+            if cut == 0:  # No complete line yet (a very long line): keep reading.
+                carry = block
+                continue
+            block, carry = block[:cut], block[cut:]
+        else:
+            block, carry = carry, ""
+            if not block:
+                return
+
+        yield from _block_hit_lines(block, first_line_num, matcher)
+        first_line_num += block.count("\n")
+
+        if not chunk:
+            return
+
+
+def _split_keepends(block: str) -> typing.Iterator[str]:
+    """Splits on '\\n' only (unlike str.splitlines), keeping the line endings."""
+    return (m.group() for m in re.finditer(r"[^\n]*\n|[^\n]+", block))
+
+
+def _block_hit_lines(block: str, first_line_num: int, matcher: GrepMatcher):
+    haystack = block
+    if matcher.lowercase_text:
+        haystack = block.lower()
+        if len(haystack) != len(block):
+            # Lowercasing changed some lengths, so offsets no longer line up with `block`.
+            for line_num, line in enumerate(_split_keepends(block), first_line_num):
+                hit = matcher.search(line)
+                if hit is not None:
+                    yield line_num, line, hit
+            return
+
+    counted_pos, line_num = 0, first_line_num
+    pos, block_len = 0, len(block)
+    while pos < block_len:
+        hit = matcher.find_in_buffer(haystack, pos)
+        if hit < 0:
+            return
+        line_start = block.rfind("\n", 0, hit) + 1
+        if line_start >= block_len:
+            return
+        line_end = block.find("\n", hit)
+        line_end = block_len if line_end < 0 else line_end + 1
+
+        line_num += block.count("\n", counted_pos, line_start)
+        counted_pos = line_start
+
+        line = block[line_start:line_end]
+        hit = matcher.search(line)
+        if hit is not None:
+            yield line_num, line, hit
+        pos = line_end
+
+
+def count_matches(f, matcher: GrepMatcher, limit: int = None) -> int:
+    """
+    Counts what `scan_lines` would yield for `f` (one per matching line, or one per
+    pattern hit for multi-pattern matchers) without building any result objects.
+    Stops reading as soon as `limit` is reached.
+    """
+    count = 0
+    for _, _, hit in iter_hit_lines(f, matcher):
+        count += len(hit) if matcher.is_multi else 1
+        if limit is not None and count >= limit:
+            return limit
+    return count
+
+
+def grep_file_collect(
+    file,
+    matcher: GrepMatcher,
+    options: GrepOptions = GrepOptions(),
+    strip_match: bool = False,
+) -> typing.Tuple[typing.Any, typing.List[GrepResult], typing.Optional[str]]:
+    """
+    Worker entry point for parallel grep: greps one file and returns
+    `(file, results, error_message)` instead of raising, so a single unreadable
+    file never tears down the pool.
+
+    `re.Match` objects cannot be pickled, so process workers pass `strip_match=True`
+    and the parent rebuilds them with `restore_match`.
+    """
+    try:
+        results = list(iter_grep_file(file, matcher, options))
+    except Exception as e:
+        return file, [], str(e)
+    if strip_match:
+        results = [r._replace(match=None) if isinstance(r, _LINE_RESULT_TYPES) else r for r in results]
+    return file, results, None
+
+
+def restore_match(result, matcher: GrepMatcher):
+    """Re-runs the matcher on an already matched line to recover the match object."""
+    if not isinstance(result, _LINE_RESULT_TYPES) or result.match is not None:
+        return result
+    if isinstance(result, MultiGrepResult):
+        return result._replace(match=matcher.specs_by_key[result.pattern_key].search(result.line_content))
+    return result._replace(match=matcher.search(result.line_content))
+
+
+def iter_parallel(
+    func: typing.Callable,
+    items: typing.Iterable,
+    args: tuple = (),
+    workers: int = 4,
+    executor: str = "thread",
+    ordered: bool = True,
+    max_pending: int = None,
+) -> typing.Generator[typing.Any, None, None]:
+    """
+    Runs `func(item, *args)` for every item on a thread or process pool and yields
+    the return values as they become available.
+
+    At most `max_pending` calls (default `workers * 4`) are in flight at any time, so
+    memory stays bounded no matter how many items there are. With `ordered=True` the
+    values are yielded in the order of `items`; otherwise in completion order.
+    """
+    if executor == "thread":
+        pool_cls = concurrent.futures.ThreadPoolExecutor
+    elif executor == "process":
+        pool_cls = concurrent.futures.ProcessPoolExecutor
+    else:
+        raise ValueError("`executor` must be 'thread' or 'process'.")
+    if max_pending is None:
+        max_pending = workers * 4
+    max_pending = max(max_pending, 1)
+
+    items_iter = iter(items)
+    with pool_cls(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for item in items_iter:
+                pending.append(pool.submit(func, item, *args))
+                if len(pending) < max_pending:
+                    continue
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        pending.remove(future)
+                        yield future.result()
+            if ordered:
+                while pending:
+                    yield pending.popleft().result()
+            else:
+                for future in concurrent.futures.as_completed(pending):
+                    yield future.result()
+                pending.clear()
+        finally:
+            # The consumer stopped early (break / close()): drop the queued work.
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,123 @@
+"""
+nb_path_hash_cache.py - A persistent cache of file content hashes for NbPath.hash(cache=True)
+and sync_to(compare="checksum").
+
+Each digest is stored in a SQLite database keyed by the file's absolute path and the hash
+algorithm, together with the device, inode, size, mtime and ctime the file had when it was
+hashed. A lookup stats the file and only trusts the stored digest if all of them are
+unchanged, so a file is read again exactly when it may have been written. (Writing a file
+always updates its ctime, even if its mtime is set back afterwards.)
+
+Digests of files modified in the last couple of seconds are not stored: a write within the
+same timestamp tick would otherwise go unnoticed.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+_HASH_CHUNK_SIZE = 1 << 20
+# Stored rows are written in batches instead of one transaction per file.
+_FLUSH_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (path, algorithm)
+) WITHOUT ROWID;
+"""
+
+
+def file_digest(path: typing.Union[os.PathLike, str], algorithm: str = "sha256") -> str:
+    """The hex digest of a file's content."""
+    hasher = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _version(st: os.stat_result) -> typing.Tuple[int, int, int, int, int]:
+    # SQLite integers are signed 64-bit; st_dev and st_ino can use the full unsigned range.
+    return st.st_dev & 0x7FFFFFFFFFFFFFFF, st.st_ino & 0x7FFFFFFFFFFFFFFF, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+
+class HashCache:
+    """
+    The on-disk hash cache. Thread-safe: `hash()` can be called from a thread pool.
+    Pending rows are written every thousand files and on `flush()` / `close()`.
+    """
+
+    def __init__(self, cache_path: typing.Union[os.PathLike, str], racy_seconds: float = 2.0):
+        self.cache_path = os.fspath(cache_path)
+        self.racy_ns = int(racy_seconds * 1e9)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.cache_path, timeout=60, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key + row for key, row in self._pending.items()),
+                )
+            self._pending = {}
+
+    def hash(self, path: typing.Union[os.PathLike, str], algorithm: str = "sha256") -> str:
+        """Returns the digest of a file, from the cache if the file has not changed since it was hashed."""
+        key = os.path.abspath(os.fspath(path))
+        current = os.stat(key)
+        version = _version(current)
+        with self._lock:
+            row = self._pending.get((key, algorithm))
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT dev, ino, size, mtime_ns, ctime_ns, digest FROM hashes WHERE path = ? AND algorithm = ?",
+                    (key, algorithm),
+                ).fetchone()
+            if row is not None and tuple(row[:5]) == version:
+                self.hits += 1
+                return row[5]
+            self.misses += 1
+        digest = file_digest(key, algorithm)
+        # Only store the digest if the file did not change while it was read and is not too fresh.
+        after = os.stat(key)
+        if _version(after) == version and time.time_ns() - max(after.st_mtime_ns, after.st_ctime_ns) >= self.racy_ns:
+            with self._lock:
+                self._pending[(key, algorithm)] = (*version, digest)
+                if len(self._pending) >= _FLUSH_EVERY:
+                    self._flush_locked()
+        return digest
@@ -0,0 +1,145 @@
+"""
+nb_path_matcher.py - PathMatcher, a set of path globs compiled once and matched in one pass.
+
+Used for every pattern list in nb_path: the walker's include/exclude rules (and with them
+sync_to's ignore_patterns, snapshot() and watch()), and grep's file patterns.
+
+Matching a path does not loop over the patterns. Patterns are sorted into three groups:
+  - plain names ('node_modules', '.git'): one set lookup of the path's last component;
+  - '*' followed by a plain suffix ('*.pyc', '*~', '*_test.py'): one set lookup per
+    distinct suffix length;
+  - everything else: a single regex combining all of them, so the path is scanned once.
+"""
+
+import functools
+import os
+import re
+import sys
+import typing
+
+# Path components are compared case-insensitively on Windows, like pathlib does.
+_CASE_INSENSITIVE = sys.platform == "win32"
+_NAME_FLAGS = re.IGNORECASE if _CASE_INSENSITIVE else 0
+_WILDCARDS = frozenset("*?[")
+
+
+def _glob_part_regex(part: str, escapes: bool = False) -> str:
+    """
+    Translates one path component of a glob; wildcards never cross a '/'.
+    With `escapes`, a backslash makes the next character literal (as in .gitignore files).
+    """
+    if part == "**":
+        return "(?:[^/]*(?:/[^/]*)*)?"
+    out, i, n = [], 0, len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+        if escapes and c == "\\" and i < n:
+            out.append(re.escape(part[i]))
+            i += 1
+        elif c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = part.find("]", i + 1 if i < n and part[i] in "!]" else i)
+            if j == -1:
+                out.append(re.escape(c))
+                continue
+            body = part[i:j].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = j + 1
+        else:
+            out.append(re.escape(c))
+    return "".join(out)
+
+
+def _glob_regex(pattern: str) -> str:
+    """
+    Translates a glob for relative paths ('/'-separated) with `PurePath.match` semantics:
+    a relative pattern matches from the right ('*.pyc' matches 'a/b/x.pyc'), a pattern
+    starting with '/' must match the whole path. A '**' component matches any number of
+    components.
+    """
+    anchored = pattern.startswith("/")
+    parts = [part for part in pattern.strip("/").split("/") if part]
+    body = "/".join(_glob_part_regex(part) for part in parts)
+    body = body.replace("(?:[^/]*(?:/[^/]*)*)?/", "(?:[^/]*/)*")
+    return ("^" if anchored else "(?:^|/)") + body + "$"
+
+
+class PathMatcher:
+    """
+    A compiled set of path globs, tested against '/'-separated paths relative to a root.
+
+    A relative pattern matches from the right like `PurePath.match` ('*.pyc' matches 'a/b/x.pyc',
+    'docs/*.md' matches 'x/docs/a.md'); a pattern starting with '/' must match the whole path.
+    A '**' component matches any number of components, and patterns ending in '/' only match
+    directories. `PathMatcher.compile()` caches compiled sets by their pattern list.
+
+    Example:
+        >>> matcher = PathMatcher.compile(['.git', 'node_modules/', '*.pyc', 'build/*.log'])
+        >>> matcher.match('pkg/__pycache__/x.pyc')
+        True
+        >>> matcher.match('node_modules', is_dir=True)
+        True
+    """
+
+    def __init__(self, patterns: typing.Iterable[str]):
+        self.patterns = tuple(os.fspath(p).replace(os.sep, "/") if os.sep != "/" else os.fspath(p) for p in patterns)
+        self._names, self._dir_names = set(), set()
+        self._suffixes = set()
+        any_kind, dir_only = [], []
+        for pattern in self.patterns:
+            body = pattern.strip("/")
+            if not body:
+                continue
+            is_dir_only = pattern.endswith("/")
+            if not pattern.startswith("/") and "/" not in body:
+                if not _WILDCARDS.intersection(body):
+                    (self._dir_names if is_dir_only else self._names).add(self._fold(body))
+                    continue
+                # A bare '*' has an empty suffix, which `name[-0:]` could never match: leave it to the regex.
+                if not is_dir_only and len(body) > 1 and body[0] == "*" and not _WILDCARDS.intersection(body[1:]):
+                    self._suffixes.add(self._fold(body[1:]))
+                    continue
+            (dir_only if is_dir_only else any_kind).append(_glob_regex(pattern))
+        self._suffix_lengths = sorted({len(suffix) for suffix in self._suffixes})
+        self._any_re = re.compile("|".join(any_kind), _NAME_FLAGS).search if any_kind else None
+        self._dir_re = re.compile("|".join(dir_only), _NAME_FLAGS).search if dir_only else None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _compile_cached(patterns: typing.Tuple[str, ...]) -> "PathMatcher":
+        return PathMatcher(patterns)
+
+    @classmethod
+    def compile(cls, patterns: typing.Iterable[str]) -> "PathMatcher":
+        """Returns the compiled matcher for `patterns`, reusing an earlier one for the same list."""
+        if isinstance(patterns, PathMatcher):
+            return patterns
+        return cls._compile_cached(tuple(os.fspath(p) for p in patterns))
+
+    @staticmethod
+    def _fold(name: str) -> str:
+        return name.lower() if _CASE_INSENSITIVE else name
+
+    def __bool__(self):
+        return bool(self._names or self._dir_names or self._suffixes or self._any_re or self._dir_re)
+
+    def __repr__(self):
+        return f"PathMatcher({list(self.patterns)!r})"
+
+    def match(self, rel_path: str, is_dir: bool = False) -> bool:
+        """True if the relative path (of a directory, if `is_dir`) matches any of the patterns."""
+        name = self._fold(rel_path.rpartition("/")[2])
+        if name in self._names or (is_dir and name in self._dir_names):
+            return True
+        for length in self._suffix_lengths:
+            if name[-length:] in self._suffixes:
+                return True
+        if self._any_re is not None and self._any_re(rel_path):
+            return True
+        return is_dir and self._dir_re is not None and self._dir_re(rel_path) is not None
@@ -0,0 +1,196 @@
+"""
+nb_path_search_index.py - A persistent trigram index that lets NbPath.grep skip files.
+
+For every indexed file the set of byte trigrams it contains is stored in a SQLite
+database, together with the file's mtime and size. A search for a literal can then
+only match files that contain all of the literal's trigrams, which is answered from
+the index without reading any file. Files whose mtime or size changed are re-indexed
+on the next refresh, so the index never has to be rebuilt from scratch.
+
+A file modified in the last couple of seconds is indexed, but recorded as changed, so it
+is indexed again on the next refresh: a write within the same timestamp tick would
+otherwise leave its mtime and size as they were, and the index stale.
+"""
+
+from array import array
+import os
+import sqlite3
+import time
+import typing
+
+from nb_path.nb_path_grep import BINARY_SNIFF_SIZE, is_binary_chunk
+
+# The mtime recorded for files indexed while they were too fresh to be trusted; it never matches.
+_RACY_MTIME_NS = -1
+
+# Files are indexed in blocks of this size (plus a 2-byte overlap) to keep memory flat.
+_INDEX_CHUNK_SIZE = 1 << 22
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    is_binary INTEGER NOT NULL,
+    trigrams BLOB
+);
+CREATE TABLE IF NOT EXISTS postings (
+    trigram INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, file_id)
+) WITHOUT ROWID;
+"""
+
+
+def bytes_trigrams(data: bytes) -> typing.Set[int]:
+    """Returns the set of trigrams of `data`, each packed into a 24-bit integer."""
+    return {(a << 16) | (b << 8) | c for a, b, c in zip(data, data[1:], data[2:])}
+
+
+def file_trigrams(path: str) -> typing.Tuple[typing.Set[int], bool]:
+    """Returns `(trigrams, is_binary)` for a file. Binary files are not tokenized."""
+    trigrams = set()
+    with open(path, "rb") as f:
+        tail = b""
+        first = True
+        while True:
+            chunk = f.read(_INDEX_CHUNK_SIZE)
+            if not chunk:
+                break
+            if first and is_binary_chunk(chunk[:BINARY_SNIFF_SIZE]):
+                return set(), True
+            first = False
+            trigrams |= bytes_trigrams(tail + chunk)
+            tail = chunk[-2:]
+    return trigrams, False
+
+
+class NbPathSearchIndex:
+    """
+    The on-disk trigram index of one directory tree.
+
+    Paths are stored relative to `root`. Use `refresh()` to bring the index up to date
+    with a list of files and `candidates()` to narrow a search down.
+    """
+
+    def __init__(
+        self,
+        root: typing.Union[os.PathLike, str],
+        index_path: typing.Union[os.PathLike, str],
+        racy_seconds: float = 2.0,
+    ):
+        self.root = os.fspath(root)
+        self.index_path = os.fspath(index_path)
+        self.racy_ns = int(racy_seconds * 1e9)
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.index_path, timeout=60)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def refresh(self, files: typing.Iterable[typing.Union[os.PathLike, str]]) -> typing.Dict[str, int]:
+        """
+        Makes the index match `files` exactly: new and changed files (by mtime and size)
+        are (re-)indexed, and files no longer in the list are dropped.
+
+        Returns counts of `added`, `updated`, `removed` and `unchanged` files.
+        """
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        known = {
+            path: (file_id, mtime_ns, size)
+            for file_id, path, mtime_ns, size in self._conn.execute(
+                "SELECT id, path, mtime_ns, size FROM files"
+            )
+        }
+        seen = set()
+        with self._conn:
+            for file in files:
+                rel = os.path.relpath(os.fspath(file), self.root)
+                seen.add(rel)
+                try:
+                    st = os.stat(file)
+                except OSError:
+                    continue
+                old = known.get(rel)
+                if old is not None and old[1] == st.st_mtime_ns and old[2] == st.st_size:
+                    stats["unchanged"] += 1
+                    continue
+                if old is not None:
+                    self._remove(old[0])
+                try:
+                    self._add(rel, os.fspath(file), st)
+                except OSError:
+                    continue
+                stats["updated" if old is not None else "added"] += 1
+
+            for rel, (file_id, _, _) in known.items():
+                if rel not in seen:
+                    self._remove(file_id)
+                    stats["removed"] += 1
+        return stats
+
+    def _add(self, rel: str, path: str, st: os.stat_result):
+        trigrams, is_binary = file_trigrams(path)
+        packed = array("I", sorted(trigrams)).tobytes()
+        mtime_ns = st.st_mtime_ns if time.time_ns() - st.st_mtime_ns >= self.racy_ns else _RACY_MTIME_NS
+        cursor = self._conn.execute(
+            "INSERT INTO files (path, mtime_ns, size, is_binary, trigrams) VALUES (?, ?, ?, ?, ?)",
+            (rel, mtime_ns, st.st_size, int(is_binary), packed),
+        )
+        file_id = cursor.lastrowid
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO postings (trigram, file_id) VALUES (?, ?)",
+            ((t, file_id) for t in trigrams),
+        )
+
+    def _remove(self, file_id: int):
+        row = self._conn.execute("SELECT trigrams FROM files WHERE id = ?", (file_id,)).fetchone()
+        if row and row[0]:
+            trigrams = array("I")
+            trigrams.frombytes(row[0])
+            self._conn.executemany(
+                "DELETE FROM postings WHERE trigram = ? AND file_id = ?",
+                ((t, file_id) for t in trigrams),
+            )
+        self._conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def candidates(self, needles: typing.Optional[typing.List[bytes]]) -> typing.Optional[typing.Set[str]]:
+        """
+        Returns the paths (joined onto `root`) of indexed files that may contain at least one
+        of `needles`, or None when some needle is too short (under 3 bytes) to narrow anything
+        down. Binary files were not tokenized, so they are always returned.
+        """
+        if not needles or any(len(needle) < 3 for needle in needles):
+            return None
+        file_ids = set()
+        for needle in needles:
+            file_ids |= self._file_ids_containing(needle)
+        file_ids |= {row[0] for row in self._conn.execute("SELECT id FROM files WHERE is_binary = 1")}
+        if not file_ids:
+            return set()
+        paths = set()
+        for file_id, rel in self._conn.execute("SELECT id, path FROM files"):
+            if file_id in file_ids:
+                paths.add(os.path.normpath(os.path.join(self.root, rel)))
+        return paths
+
+    def _file_ids_containing(self, needle: bytes) -> typing.Set[int]:
+        file_ids = None
+        # Intersect the posting lists, stopping as soon as nothing is left.
+        for trigram in bytes_trigrams(needle):
+            ids = {
+                row[0]
+                for row in self._conn.execute("SELECT file_id FROM postings WHERE trigram = ?", (trigram,))
+            }
+            file_ids = ids if file_ids is None else file_ids & ids
+            if not file_ids:
+                break
+        return file_ids or set()
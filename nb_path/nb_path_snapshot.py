@@ -0,0 +1,221 @@
+"""
+nb_path_snapshot.py - TreeSnapshot, the stat metadata of a whole directory tree taken in one walk.
+
+A snapshot stores its entries column-wise: one list of relative paths plus one `array`
+per stat field, so a million entries cost a few tens of MB instead of a million stat
+results. Operations that would otherwise walk and stat a tree again (sync_to, diffing two
+states of a tree, ...) can work on a snapshot instead.
+"""
+
+from array import array
+from collections import namedtuple
+import json
+import os
+import stat as stat_module
+import sys
+import typing
+
+from nb_path.nb_path_matcher import PathMatcher
+from nb_path.nb_path_walker import scandir_tree
+
+# One entry of a snapshot. `path` is relative to the snapshot root and always uses '/'.
+_SnapshotEntryBase = namedtuple("SnapshotEntry", ["path", "size", "mtime_ns", "mode", "ino", "dev"])
+
+
+class SnapshotEntry(_SnapshotEntryBase):
+    __slots__ = ()
+
+    @property
+    def is_dir(self) -> bool:
+        return stat_module.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self) -> bool:
+        return stat_module.S_ISREG(self.mode)
+
+
+# The result of `TreeSnapshot.diff()`: sorted lists of relative paths.
+SnapshotDiff = namedtuple("SnapshotDiff", ["added", "removed", "modified"])
+
+_MAGIC = b"NBSNAP1\n"
+# (field, array typecode) of the stat columns, in file order.
+_COLUMNS = (("size", "q"), ("mtime_ns", "q"), ("mode", "I"), ("ino", "Q"), ("dev", "Q"))
+
+
+class TreeSnapshot:
+    """
+    The relative path, size, mtime, mode, inode and device of every file and directory below `root`.
+
+    Entries are sorted by path. Look one up with `snapshot["pkg/mod.py"]`, iterate over
+    `SnapshotEntry` tuples, narrow with `filter()`, compare two snapshots with `diff()` or
+    `-` (the entries whose path is not in the other snapshot), and persist with `save()` / `load()`.
+    """
+
+    __slots__ = ("root", "paths", "size", "mtime_ns", "mode", "ino", "dev", "_index")
+
+    def __init__(self, root: typing.Union[os.PathLike, str], entries: typing.Iterable[tuple] = ()):
+        self.root = root
+        self.paths = []
+        for name, typecode in _COLUMNS:
+            setattr(self, name, array(typecode))
+        for entry in sorted(entries):
+            self._append(*entry)
+        self._index = None
+
+    def _append(self, path: str, size: int, mtime_ns: int, mode: int, ino: int, dev: int):
+        self.paths.append(path)
+        self.size.append(size)
+        self.mtime_ns.append(mtime_ns)
+        self.mode.append(mode)
+        self.ino.append(ino)
+        self.dev.append(dev)
+
+    @classmethod
+    def take(
+        cls,
+        root: typing.Union[os.PathLike, str],
+        exclude: typing.Optional[PathMatcher] = None,
+        include: typing.Optional[PathMatcher] = None,
+        workers: typing.Optional[int] = None,
+    ) -> "TreeSnapshot":
+        """Walks `root` once (see `scandir_tree`) and records every directory and file below it."""
+        top = os.fspath(root)
+        rows = []
+        for dirpath, dirs, files in scandir_tree(top, exclude, include, workers=workers, stat=True):
+            rel_dir = os.path.relpath(dirpath, top).replace(os.sep, "/")
+            prefix = "" if rel_dir == "." else rel_dir + "/"
+            for entry in dirs + files:
+                st = entry.stat()
+                rows.append((prefix + entry.name, st.st_size, st.st_mtime_ns, st.st_mode, st.st_ino, st.st_dev))
+        return cls(root, rows)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def _entry(self, i: int) -> SnapshotEntry:
+        return SnapshotEntry(self.paths[i], self.size[i], self.mtime_ns[i], self.mode[i], self.ino[i], self.dev[i])
+
+    def __iter__(self) -> typing.Iterator[SnapshotEntry]:
+        return (self._entry(i) for i in range(len(self.paths)))
+
+    def _lookup(self) -> typing.Dict[str, int]:
+        if self._index is None:
+            self._index = {path: i for i, path in enumerate(self.paths)}
+        return self._index
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._lookup()
+
+    def __getitem__(self, path: str) -> SnapshotEntry:
+        return self._entry(self._lookup()[path])
+
+    def get(self, path: str, default=None) -> typing.Optional[SnapshotEntry]:
+        i = self._lookup().get(path)
+        return default if i is None else self._entry(i)
+
+    def __repr__(self):
+        return f"<TreeSnapshot of {os.fspath(self.root)!r}: {len(self)} entries>"
+
+    def files(self) -> typing.Iterator[SnapshotEntry]:
+        """The regular-file entries (symlinks to files count as files, as with `Path.is_file`)."""
+        return (self._entry(i) for i, mode in enumerate(self.mode) if stat_module.S_ISREG(mode))
+
+    def dirs(self) -> typing.Iterator[SnapshotEntry]:
+        return (self._entry(i) for i, mode in enumerate(self.mode) if stat_module.S_ISDIR(mode))
+
+    def _select(self, indexes: typing.Iterable[int]) -> "TreeSnapshot":
+        result = TreeSnapshot(self.root)
+        for i in indexes:
+            result._append(self.paths[i], self.size[i], self.mtime_ns[i], self.mode[i], self.ino[i], self.dev[i])
+        return result
+
+    def filter(
+        self,
+        predicate: typing.Callable[[SnapshotEntry], bool] = None,
+        include: typing.List[str] = None,
+        exclude: typing.List[str] = None,
+    ) -> "TreeSnapshot":
+        """
+        Returns a new snapshot with the entries that satisfy `predicate` and the path globs
+        (same rules as `NbPath.walk_tree()`; an excluded directory also drops everything below it).
+        `include` only applies to files.
+        """
+        include = PathMatcher.compile(include) if include else None
+        exclude = PathMatcher.compile(exclude) if exclude else None
+        keep = []
+        for i, path in enumerate(self.paths):
+            is_dir = stat_module.S_ISDIR(self.mode[i])
+            if exclude and _excluded_with_parents(exclude, path, is_dir):
+                continue
+            if include and not is_dir and not include.match(path):
+                continue
+            if predicate is not None and not predicate(self._entry(i)):
+                continue
+            keep.append(i)
+        return self._select(keep)
+
+    def __sub__(self, other: "TreeSnapshot") -> "TreeSnapshot":
+        """The entries of this snapshot whose path is not in `other`."""
+        other_paths = other._lookup()
+        return self._select(i for i, path in enumerate(self.paths) if path not in other_paths)
+
+    def diff(self, old: "TreeSnapshot") -> SnapshotDiff:
+        """
+        Compares this (newer) snapshot with an `old` one. An entry is modified when its size,
+        mtime or file type/permissions changed.
+        """
+        old_index = old._lookup()
+        added, modified = [], []
+        for i, path in enumerate(self.paths):
+            j = old_index.get(path)
+            if j is None:
+                added.append(path)
+            elif (self.size[i], self.mtime_ns[i], self.mode[i]) != (old.size[j], old.mtime_ns[j], old.mode[j]):
+                modified.append(path)
+        new_index = self._lookup()
+        removed = [path for path in old.paths if path not in new_index]
+        return SnapshotDiff(added, removed, modified)
+
+    def save(self, path: typing.Union[os.PathLike, str]):
+        """Writes the snapshot to a compact binary file (a JSON header, the paths, then the raw arrays)."""
+        with open(path, "wb") as f:
+            self._write_to(f)
+
+    def _write_to(self, f: typing.BinaryIO):
+        header = {"root": os.fspath(self.root), "count": len(self), "byteorder": sys.byteorder}
+        names = "\0".join(self.paths).encode("utf-8", "surrogateescape")
+        f.write(_MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(len(names).to_bytes(8, "little"))
+        f.write(names)
+        for name, _ in _COLUMNS:
+            getattr(self, name).tofile(f)
+
+    @classmethod
+    def load(cls, path: typing.Union[os.PathLike, str]) -> "TreeSnapshot":
+        """Reads a snapshot written by `save()`. Its `root` is the saved root as a string."""
+        with open(path, "rb") as f:
+            return cls._read_from(f, path)
+
+    @classmethod
+    def _read_from(cls, f: typing.BinaryIO, path: typing.Union[os.PathLike, str]) -> "TreeSnapshot":
+        if f.readline() != _MAGIC:
+            raise ValueError(f"{path} is not a TreeSnapshot file.")
+        header = json.loads(f.readline())
+        names = f.read(int.from_bytes(f.read(8), "little")).decode("utf-8", "surrogateescape")
+        snapshot = cls(header["root"])
+        count = header["count"]
+        snapshot.paths = names.split("\0") if count else []
+        for name, _ in _COLUMNS:
+            column = getattr(snapshot, name)
+            column.fromfile(f, count)
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+        return snapshot
+
+
+def _excluded_with_parents(exclude: PathMatcher, path: str, is_dir: bool) -> bool:
+    if exclude.match(path, is_dir):
+        return True
+    parts = path.split("/")
+    return any(exclude.match("/".join(parts[:n]), True) for n in range(1, len(parts)))
@@ -0,0 +1,424 @@
+"""
+nb_path_sync.py - The copy pipeline behind NbPath.sync_to().
+
+The source and destination trees are each walked and stat'ed once into a TreeSnapshot,
+the two snapshots are compared in memory into a `SyncPlan` (hashing the candidate files
+in 'checksum' mode), and only then are files copied (with the zero-copy engine of
+nb_path_copy) and deleted. With `workers`, the copies and deletions run on a bounded
+thread pool: when the destination is on network storage, syncing many small files is dominated by
+per-file round trips (create, write, close, utime) rather than by bandwidth, and keeping
+many files in flight hides that latency.
+
+With a `delta_threshold`, a file of at least that size which already exists in the
+destination is not copied whole: both files are read side by side in aligned blocks and
+only the blocks that differ are rewritten in place (then the file is truncated or extended
+to the source size). Database dumps and VM images that change a few pages then cost a read
+of both files but only a few blocks of writes. Interrupted halfway, the destination keeps
+its old mtime, so the next sync looks at it again.
+
+With a manifest, the state of the destination after each sync (the path, size, mtime and,
+in 'checksum' mode, the digest of every file sync_to put there) is saved in a
+`SYNC_MANIFEST_NAME` file at the destination root. The next sync diffs the source against
+the manifest instead of walking and stat'ing the destination, so only the source tree is
+walked. The manifest trusts that nothing else writes to the destination; changes made there
+by other programs go unnoticed until a sync without the manifest.
+
+A file that cannot be copied or deleted does not abort the sync. Its error is recorded in
+the returned `SyncResult` and the remaining files are still processed.
+"""
+
+from collections import namedtuple
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import typing
+
+from nb_path.nb_path_copy import copy_file
+from nb_path.nb_path_hash_cache import file_digest
+from nb_path.nb_path_snapshot import TreeSnapshot
+
+# How plan_sync decides that a file which exists on both sides must be copied again:
+#   'mtime': the source is newer (the original sync_to rule);
+#   'size+mtime': the sizes or the mtimes differ in any direction (rsync's quick check);
+#   'checksum': the sizes or the content hashes differ, whatever the mtimes say.
+COMPARE_MODES = ("mtime", "size+mtime", "checksum")
+
+# What sync_to will do: lists of `(relative path, size)` to copy, skip (already up to date)
+# and delete. Paths are relative to the source/destination roots and always use '/'.
+SyncPlan = namedtuple("SyncPlan", ["copy", "skip", "delete"])
+
+# One file that could not be synced: `action` is 'copy' or 'delete', `error` the OSError raised.
+SyncError = namedtuple("SyncError", ["action", "path", "error"])
+
+_SyncResultBase = namedtuple(
+    "SyncResult",
+    ["copied", "copied_bytes", "skipped", "skipped_bytes", "deleted", "deleted_bytes", "written_bytes", "errors"],
+)
+
+# The manifest file kept at the destination root by sync_to(manifest=True).
+SYNC_MANIFEST_NAME = ".nb_path_sync_manifest"
+_MANIFEST_MAGIC = b"NBSYNC1\n"
+_MANIFEST_ALGORITHM = "sha256"
+
+_DELTA_READ_SIZE = 1 << 22
+_DELTA_BLOCK_SIZE = 1 << 16
+
+
+class SyncResult(_SyncResultBase):
+    """
+    The summary returned by NbPath.sync_to(): file counts and byte totals of what was copied,
+    skipped (already up to date) and deleted, plus a `SyncError` for every file that failed.
+    `written_bytes` is what was actually written to the destination, which is less than
+    `copied_bytes` when large files were updated block by block.
+    In a dry run, the counts are what would have been done (`written_bytes` is an upper bound).
+    """
+
+    __slots__ = ()
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def __str__(self):
+        return (
+            f"copied {self.copied} files ({self.copied_bytes} bytes), "
+            f"skipped {self.skipped} ({self.skipped_bytes} bytes), "
+            f"deleted {self.deleted} ({self.deleted_bytes} bytes), failed {self.failed}, "
+            f"wrote {self.written_bytes} bytes"
+        )
+
+
+def plan_sync(
+    source: TreeSnapshot,
+    dest: TreeSnapshot,
+    delete_extraneous: bool = False,
+    compare: str = "mtime",
+    digest: typing.Callable[[str], str] = None,
+    workers: typing.Optional[int] = None,
+    dest_digests: typing.Optional[typing.Dict[str, str]] = None,
+) -> SyncPlan:
+    """
+    Compares two snapshots: a source file is copied if the destination lacks it or it changed
+    according to `compare` (see `COMPARE_MODES`). With `delete_extraneous`, destination files
+    missing from the source are deleted.
+
+    In 'checksum' mode only files of equal size are hashed, with `digest(path)` (default:
+    `file_digest`), on `workers` threads. A file that cannot be hashed is copied. Destination
+    digests found in `dest_digests` (from a manifest) are used without reading the file.
+    """
+    if compare not in COMPARE_MODES:
+        raise ValueError(f"compare must be one of {COMPARE_MODES}, not {compare!r}.")
+    copy, skip, to_hash = [], [], []
+    for entry in source.files():
+        dest_entry = dest.get(entry.path)
+        if dest_entry is None or not dest_entry.is_file:
+            changed = True
+        elif compare == "mtime":
+            changed = entry.mtime_ns > dest_entry.mtime_ns
+        elif entry.size != dest_entry.size:
+            changed = True
+        elif compare == "size+mtime":
+            changed = entry.mtime_ns != dest_entry.mtime_ns
+        else:
+            to_hash.append((entry.path, entry.size))
+            continue
+        (copy if changed else skip).append((entry.path, entry.size))
+
+    if to_hash:
+        digest = digest or file_digest
+        source_root, dest_root = os.fspath(source.root), os.fspath(dest.root)
+        dest_digests = dest_digests or {}
+
+        def same_content(item):
+            rel_path = item[0]
+            try:
+                dest_digest = dest_digests.get(rel_path) or digest(os.path.join(dest_root, rel_path))
+                return item, digest(os.path.join(source_root, rel_path)) == dest_digest
+            except OSError:
+                return item, False
+
+        for item, same in _bounded_map(same_content, to_hash, workers):
+            (skip if same else copy).append(item)
+        copy.sort()
+        skip.sort()
+
+    delete = []
+    if delete_extraneous:
+        delete = [(entry.path, entry.size) for entry in dest.files() if entry.path not in source]
+    return SyncPlan(copy, skip, delete)
+
+
+def _bounded_map(
+    fn: typing.Callable, items: typing.Iterable, workers: typing.Optional[int]
+) -> typing.Iterator:
+    """
+    Yields `fn(item)` for every item, in completion order. With `workers` > 1 the calls run on
+    a thread pool that never holds more than a few tasks per worker, so a plan of a million
+    files does not become a million queued futures.
+    """
+    if workers is None or workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    limit = workers * 4
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nb_path_sync") as pool:
+        pending = set()
+        for item in items:
+            if len(pending) >= limit:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(fn, item))
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def delta_copy(
+    source_file: typing.Union[os.PathLike, str],
+    dest_file: typing.Union[os.PathLike, str],
+    block_size: int = _DELTA_BLOCK_SIZE,
+) -> int:
+    """
+    Makes `dest_file` identical to `source_file` by rewriting only the `block_size` blocks
+    that differ, then truncating or extending it to the source size. Returns the bytes written.
+    File metadata (mtime, mode) is left to the caller.
+    """
+    written = 0
+    offset = 0
+    with open(source_file, "rb") as src, open(dest_file, "r+b") as dst:
+        while True:
+            chunk = src.read(_DELTA_READ_SIZE)
+            if not chunk:
+                break
+            old = dst.read(len(chunk))
+            if chunk != old:
+                for start in range(0, len(chunk), block_size):
+                    block = chunk[start:start + block_size]
+                    if block != old[start:start + block_size]:
+                        dst.seek(offset + start)
+                        dst.write(block)
+                        written += len(block)
+                dst.seek(offset + len(chunk))
+            offset += len(chunk)
+        dst.truncate(offset)
+    return written
+
+
+def _make_parent_dirs(dest_root: str, plan: SyncPlan, dest: TreeSnapshot) -> typing.Dict[str, OSError]:
+    """
+    Creates the destination directories the copies need, once each and before any copy starts,
+    so the copy threads never race on makedirs. Returns the directories that could not be created.
+    """
+    failed = {}
+    needed = {rel_path.rpartition("/")[0] for rel_path, _ in plan.copy}
+    for rel_dir in sorted(needed):
+        existing = dest.get(rel_dir) if rel_dir else None
+        if not rel_dir or (existing is not None and existing.is_dir):
+            continue
+        try:
+            os.makedirs(os.path.join(dest_root, *rel_dir.split("/")), exist_ok=True)
+        except OSError as e:
+            failed[rel_dir] = e
+    return failed
+
+
+def run_sync(
+    source_root: typing.Union[os.PathLike, str],
+    dest_root: typing.Union[os.PathLike, str],
+    plan: SyncPlan,
+    workers: typing.Optional[int] = None,
+    dry_run: bool = False,
+    dest: typing.Optional[TreeSnapshot] = None,
+    logger: typing.Optional[logging.Logger] = None,
+    delta_threshold: typing.Optional[int] = None,
+) -> SyncResult:
+    """
+    Carries out a `SyncPlan` (copies first, then deletions) and summarizes it. Files of at least
+    `delta_threshold` bytes that `dest` (the destination snapshot) has are updated with `delta_copy`.
+    """
+    source_root, dest_root = os.fspath(source_root), os.fspath(dest_root)
+    logger = logger or logging.getLogger(__name__)
+    skipped_bytes = sum(size for _, size in plan.skip)
+    if dry_run:
+        for rel_path, _ in plan.copy:
+            logger.info(f"[DRY RUN] Would copy: {os.path.join(source_root, rel_path)} -> {os.path.join(dest_root, rel_path)}")
+        for rel_path, _ in plan.delete:
+            logger.info(f"[DRY RUN] Would delete extraneous file: {os.path.join(dest_root, rel_path)}")
+        return SyncResult(
+            len(plan.copy), sum(size for _, size in plan.copy), len(plan.skip), skipped_bytes,
+            len(plan.delete), sum(size for _, size in plan.delete), sum(size for _, size in plan.copy), [],
+        )
+
+    errors = []
+    dest = dest if dest is not None else TreeSnapshot(dest_root)
+    dir_errors = _make_parent_dirs(dest_root, plan, dest)
+
+    def use_delta(rel_path, size):
+        if delta_threshold is None or size < delta_threshold:
+            return False
+        dest_entry = dest.get(rel_path)
+        return dest_entry is not None and dest_entry.is_file
+
+    def copy_one(item):
+        rel_path, size = item
+        source_file = os.path.join(source_root, rel_path)
+        dest_file = os.path.join(dest_root, rel_path)
+        dir_error = dir_errors.get(rel_path.rpartition("/")[0])
+        if dir_error is not None:
+            return rel_path, size, 0, dir_error
+        try:
+            if use_delta(rel_path, size):
+                written = delta_copy(source_file, dest_file)
+                logger.debug(f"Syncing (delta, {written} bytes written): {source_file} -> {dest_file}")
+            else:
+                # Not copy2, which would copy *into* a directory standing where the file belongs.
+                method = copy_file(source_file, dest_file)
+                logger.debug(f"Syncing ({method}): {source_file} -> {dest_file}")
+                written = size
+            shutil.copystat(source_file, dest_file)
+        except OSError as e:
+            return rel_path, size, 0, e
+        return rel_path, size, written, None
+
+    def delete_one(item):
+        rel_path, size = item
+        dest_file = os.path.join(dest_root, rel_path)
+        logger.debug(f"Deleting extraneous file: {dest_file}")
+        try:
+            os.remove(dest_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return rel_path, size, e
+        return rel_path, size, None
+
+    copied = copied_bytes = written_bytes = 0
+    for rel_path, size, written, error in _bounded_map(copy_one, plan.copy, workers):
+        if error is None:
+            copied += 1
+            copied_bytes += size
+            written_bytes += written
+        else:
+            logger.warning(f"Failed to copy {rel_path}: {error}")
+            errors.append(SyncError("copy", rel_path, error))
+
+    deleted = deleted_bytes = 0
+    for rel_path, size, error in _bounded_map(delete_one, plan.delete, workers):
+        if error is None:
+            deleted += 1
+            deleted_bytes += size
+        else:
+            logger.warning(f"Failed to delete {rel_path}: {error}")
+            errors.append(SyncError("delete", rel_path, error))
+
+    errors.sort(key=lambda e: (e.action, e.path))
+    return SyncResult(
+        copied, copied_bytes, len(plan.skip), skipped_bytes, deleted, deleted_bytes, written_bytes, errors
+    )
+
+
+def manifest_after_sync(source: TreeSnapshot, dest: TreeSnapshot, plan: SyncPlan, result: SyncResult) -> TreeSnapshot:
+    """
+    The destination as it is after `plan` was carried out: copied files take the size, mtime and
+    mode of their source (their inode and device are recorded as 0, unknown), deleted and
+    failed-to-copy files are dropped, and every other destination file is kept as it was.
+    """
+    failed = {(error.action, error.path) for error in result.errors}
+    dropped = {rel_path for rel_path, _ in plan.delete if ("delete", rel_path) not in failed}
+    dropped.update(rel_path for rel_path, _ in plan.copy if ("copy", rel_path) in failed)
+    rows = {entry.path: tuple(entry) for entry in dest.files() if entry.path not in dropped}
+    for rel_path, _ in plan.copy:
+        if ("copy", rel_path) not in failed:
+            entry = source[rel_path]
+            rows[rel_path] = (rel_path, entry.size, entry.mtime_ns, entry.mode, 0, 0)
+
+    dirs = {entry.path: tuple(entry) for entry in dest.dirs()}
+    for rel_path in list(rows):
+        rel_dir = rel_path.rpartition("/")[0]
+        while rel_dir and rel_dir not in dirs:
+            entry = source.get(rel_dir)
+            if entry is not None:
+                dirs[rel_dir] = (rel_dir, entry.size, entry.mtime_ns, entry.mode, 0, 0)
+            rel_dir = rel_dir.rpartition("/")[0]
+    return TreeSnapshot(dest.root, list(rows.values()) + list(dirs.values()))
+
+
+def manifest_digests(
+    source: TreeSnapshot,
+    synced: TreeSnapshot,
+    digest: typing.Callable[[str], str],
+    old_digests: typing.Optional[typing.Dict[str, str]] = None,
+    workers: typing.Optional[int] = None,
+) -> typing.Dict[str, str]:
+    """
+    The digests to save with the manifest `synced`: synced files that exist in the source now
+    have its content, so they get the source digest (usually a hash cache hit, since plan_sync
+    just hashed them); other destination files keep the digest of the previous manifest.
+    """
+    source_root = os.fspath(source.root)
+    digests = {rel_path: d for rel_path, d in (old_digests or {}).items() if rel_path in synced and rel_path not in source}
+
+    def hash_one(rel_path):
+        try:
+            return rel_path, digest(os.path.join(source_root, rel_path))
+        except OSError:
+            return rel_path, None
+
+    to_hash = [entry.path for entry in synced.files() if entry.path in source]
+    for rel_path, d in _bounded_map(hash_one, to_hash, workers):
+        if d is not None:
+            digests[rel_path] = d
+    return digests
+
+
+def save_manifest(
+    path: typing.Union[os.PathLike, str],
+    snapshot: TreeSnapshot,
+    header: dict,
+    digests: typing.Optional[typing.Dict[str, str]] = None,
+):
+    """
+    Atomically writes a manifest: the magic line, `header` as JSON, the snapshot (in the
+    TreeSnapshot file format), then the digests of its paths ('' where unknown).
+    """
+    digests = digests or {}
+    header = dict(header, algorithm=_MANIFEST_ALGORITHM)
+    packed = "\0".join(digests.get(rel_path, "") for rel_path in snapshot.paths).encode("ascii")
+    path = os.fspath(path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MANIFEST_MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        snapshot._write_to(f)
+        f.write(len(packed).to_bytes(8, "little"))
+        f.write(packed)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(
+    path: typing.Union[os.PathLike, str], header: dict
+) -> typing.Optional[typing.Tuple[TreeSnapshot, typing.Dict[str, str]]]:
+    """
+    Reads a manifest written by `save_manifest()` into `(snapshot, digests)`. Returns None if
+    there is none, it cannot be read, or its header does not agree with `header` (e.g. the
+    ignore patterns changed, or the destination directory was replaced).
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.readline() != _MANIFEST_MAGIC:
+                return None
+            saved = json.loads(f.readline())
+            if saved.get("algorithm") != _MANIFEST_ALGORITHM or any(saved.get(k) != v for k, v in header.items()):
+                return None
+            snapshot = TreeSnapshot._read_from(f, path)
+            packed = f.read(int.from_bytes(f.read(8), "little")).decode("ascii")
+    except (OSError, ValueError, EOFError):
+        return None
+    digests = {rel_path: digest for rel_path, digest in zip(snapshot.paths, packed.split("\0")) if digest}
+    return snapshot, digests
@@ -0,0 +1,245 @@
+"""
+nb_path_walker.py - The os.scandir based directory walker behind NbPath.walk_tree, iter_files and rglob_files.
+
+`os.scandir` returns the file type of every entry together with its name (from the
+directory listing itself on most filesystems), so the walker can tell files from
+directories without an extra `stat` per entry, and only the entries that are actually
+yielded ever become NbPath objects. Exclude rules are checked before a directory is
+opened, so ignored subtrees (.git, node_modules, .venv, ...) are never read at all.
+
+With a `WalkCache`, the listing of every directory is kept keyed by the directory's
+device, inode and mtime. A repeated walk then costs one `stat` per unchanged directory,
+and only directories whose entries changed are listed again.
+"""
+
+from collections import OrderedDict
+import concurrent.futures
+import os
+import threading
+import time
+import typing
+
+from nb_path.nb_path_matcher import PathMatcher
+
+
+def is_simple_name_pattern(pattern: str) -> bool:
+    """
+    True if `pattern` only looks at entry names (e.g. '*.py', 'tests'), which is what the
+    scandir walker handles. Patterns with separators or '**' are left to pathlib.
+    """
+    return bool(pattern) and "**" not in pattern and "/" not in pattern and os.sep not in pattern and (
+        os.altsep is None or os.altsep not in pattern
+    )
+
+
+class CachedDirEntry:
+    """An `os.DirEntry` look-alike rebuilt from a cached directory listing."""
+
+    __slots__ = ("name", "path", "_is_dir", "_is_file", "_is_symlink", "_stat")
+
+    def __init__(self, dirpath: str, name: str, is_dir: bool, is_file: bool, is_symlink: bool):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self._is_dir = is_dir
+        self._is_file = is_file
+        self._is_symlink = is_symlink
+        self._stat = None
+
+    def is_dir(self) -> bool:
+        return self._is_dir
+
+    def is_file(self) -> bool:
+        return self._is_file
+
+    def is_symlink(self) -> bool:
+        return self._is_symlink
+
+    def stat(self) -> os.stat_result:
+        # File metadata is never cached across walks, only the names and types of the entries.
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def __repr__(self):
+        return f"<CachedDirEntry {self.name!r}>"
+
+
+def _entry_types(entry: os.DirEntry) -> typing.Tuple[str, bool, bool, bool]:
+    try:
+        return entry.name, entry.is_dir(), entry.is_file(), entry.is_symlink()
+    except OSError:
+        return entry.name, False, False, False
+
+
+class WalkCache:
+    """
+    A bounded LRU of directory listings, keyed by path and validated by the directory's
+    device, inode and mtime. Pass one to the walker (or `cache=True` to NbPath's walk methods,
+    which share a process-wide instance) to make repeated walks of a mostly static tree cheap.
+
+    A directory's mtime changes whenever an entry is created, removed or renamed in it, so
+    listings never go stale. Listings of directories modified in the last `racy_seconds` are not
+    stored, because a change within the same mtime tick would go unnoticed.
+    """
+
+    def __init__(self, max_dirs: int = 100_000, racy_seconds: float = 2.0):
+        self.max_dirs = max_dirs
+        self.racy_ns = int(racy_seconds * 1e9)
+        self.hits = 0
+        self.misses = 0
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._listings)
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+            self.hits = self.misses = 0
+
+    def scandir(self, dirpath: str) -> typing.List[typing.Union[os.DirEntry, CachedDirEntry]]:
+        """Lists a directory like `list(os.scandir(dirpath))`, from the cache if it has not changed."""
+        key = os.path.abspath(dirpath)
+        st = os.stat(dirpath)
+        version = (st.st_dev, st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            cached = self._listings.get(key)
+            if cached is not None and cached[0] == version:
+                self._listings.move_to_end(key)
+                self.hits += 1
+                return [CachedDirEntry(dirpath, *types) for types in cached[1]]
+            self.misses += 1
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+        if time.time_ns() - st.st_mtime_ns >= self.racy_ns:
+            listing = tuple(_entry_types(entry) for entry in entries)
+            with self._lock:
+                self._listings[key] = (version, listing)
+                self._listings.move_to_end(key)
+                while len(self._listings) > self.max_dirs:
+                    self._listings.popitem(last=False)
+        return entries
+
+
+# The cache used by NbPath's walk methods when they are called with `cache=True`.
+default_walk_cache = WalkCache()
+
+
+def _list_dir(
+    dirpath: str, rel_dir: str, exclude: typing.Optional[PathMatcher], include: typing.Optional[PathMatcher],
+    stat: bool = False, cache: typing.Optional[WalkCache] = None,
+) -> typing.Optional[typing.Tuple[typing.List[os.DirEntry], typing.List[os.DirEntry]]]:
+    """
+    Lists one directory into filtered `(dirs, files)`, or None if it cannot be read.
+    With `stat`, `entry.stat()` is called here so it is cached on the entries (and done on the
+    worker thread in a parallel walk); entries that vanish before they are stat'ed are dropped.
+    """
+    try:
+        if cache is not None:
+            entries = cache.scandir(dirpath)
+        else:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+    except OSError:
+        return None
+    prefix = rel_dir + "/" if rel_dir else ""
+    dirs, files = [], []
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                if exclude and exclude.match(prefix + entry.name, True):
+                    continue
+                target = dirs
+            elif entry.is_file():
+                if exclude and exclude.match(prefix + entry.name):
+                    continue
+                if include and not include.match(prefix + entry.name):
+                    continue
+                target = files
+            else:
+                continue
+            if stat:
+                entry.stat()
+        except OSError:
+            continue
+        target.append(entry)
+    return dirs, files
+
+
+def _subdirs_to_walk(dirs: typing.List[os.DirEntry], rel_dir: str) -> typing.List[typing.Tuple[str, str]]:
+    prefix = rel_dir + "/" if rel_dir else ""
+    return [(entry.path, prefix + entry.name) for entry in dirs if not entry.is_symlink()]
+
+
+def scandir_tree(
+    top: typing.Union[os.PathLike, str],
+    exclude: typing.Optional[PathMatcher] = None,
+    include: typing.Optional[PathMatcher] = None,
+    workers: typing.Optional[int] = None,
+    stat: bool = False,
+    cache: typing.Optional[WalkCache] = None,
+) -> typing.Generator[typing.Tuple[str, typing.List[os.DirEntry], typing.List[os.DirEntry]], None, None]:
+    """
+    Walks the tree below `top` top-down and yields `(dirpath, dirs, files)` for every
+    directory, where `dirs` and `files` are `os.DirEntry` lists.
+
+    Like `Path.rglob`, symlinks to directories are reported in `dirs` but not descended
+    into, and unreadable directories are skipped silently. `files` follows symlinks
+    (like `Path.is_file`); entries that are neither (sockets, broken links) are dropped.
+
+    Entries whose relative path matches `exclude` are dropped, and excluded directories are
+    never opened. If `include` is given, only files matching it are reported. As with
+    `os.walk`, removing entries from the yielded `dirs` list stops the walk descending into them.
+
+    With `workers` > 1, directories are listed concurrently on a thread pool and yielded in
+    completion order (parents still come before their children). On high-latency filesystems
+    (NFS, SMB) this keeps many `readdir` round-trips in flight instead of one.
+    With `stat`, every yielded entry already has its `stat()` result cached.
+    With a `cache`, unchanged directories are not listed again (the entries are then
+    `CachedDirEntry` objects).
+    """
+    if workers is not None and workers > 1:
+        yield from _scandir_tree_parallel(os.fspath(top), exclude, include, workers, stat, cache)
+        return
+    stack = [(os.fspath(top), "")]
+    while stack:
+        dirpath, rel_dir = stack.pop()
+        listing = _list_dir(dirpath, rel_dir, exclude, include, stat, cache)
+        if listing is None:
+            continue
+        dirs, files = listing
+        yield dirpath, dirs, files
+        stack.extend(reversed(_subdirs_to_walk(dirs, rel_dir)))
+
+
+def _scandir_tree_parallel(
+    top: str, exclude: typing.Optional[PathMatcher], include: typing.Optional[PathMatcher], workers: int,
+    stat: bool = False, cache: typing.Optional[WalkCache] = None,
+) -> typing.Generator[typing.Tuple[str, typing.List[os.DirEntry], typing.List[os.DirEntry]], None, None]:
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nb_path_walk")
+    # Only a few directories per worker are queued on the pool; the others wait here as plain
+    # paths, so a wide tree does not become hundreds of thousands of futures.
+    limit = workers * 4
+    backlog = [(top, "")]
+    pending = {}
+    try:
+        while backlog or pending:
+            while backlog and len(pending) < limit:
+                dirpath, rel_dir = backlog.pop()
+                pending[pool.submit(_list_dir, dirpath, rel_dir, exclude, include, stat, cache)] = (dirpath, rel_dir)
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                dirpath, rel_dir = pending.pop(future)
+                listing = future.result()
+                if listing is None:
+                    continue
+                dirs, files = listing
+                yield dirpath, dirs, files
+                # Queued after the yield, so pruning of `dirs` by the consumer is honoured.
+                backlog.extend(_subdirs_to_walk(dirs, rel_dir))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,422 @@
+"""
+nb_path_watch.py - Filesystem change notifications for NbPath.watch().
+
+On Linux the kernel's inotify API is used through ctypes (no third-party package):
+every directory of the tree gets a watch, and new directories are added as they
+appear. If the kernel's event queue overflows, the tree is rescanned and diffed with
+the snapshot taken at the previous scan, so no change is lost (some may be reported
+twice). Elsewhere, or when inotify is not available (e.g. the watch limit is reached),
+the tree is polled: a `TreeSnapshot` is taken every `poll_interval` seconds and diffed
+with the previous one.
+
+Raw events are debounced (collected until the tree has been quiet for `debounce`
+seconds) and coalesced per path, so saving a file produces one `modified` event and a
+file that is created and deleted again within a burst produces none.
+"""
+
+import asyncio
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import typing
+
+from nb_path.nb_path_snapshot import TreeSnapshot
+from nb_path.nb_path_matcher import PathMatcher
+from nb_path.nb_path_walker import scandir_tree
+
+# `kind` is 'created', 'modified' or 'deleted'; `path` is an NbPath.
+WatchEvent = namedtuple("WatchEvent", ["kind", "path", "is_dir"])
+
+WATCH_BACKENDS = ("auto", "inotify", "poll")
+
+# How long an iteration waits per read() before checking whether the watcher was closed.
+_WAKEUP_INTERVAL = 0.2
+
+# (previous kind, new kind) -> coalesced kind; None drops the path from the batch.
+_COALESCE = {
+    ("created", "modified"): "created",
+    ("created", "deleted"): None,
+    ("deleted", "created"): "modified",
+    ("deleted", "modified"): "modified",
+    ("modified", "created"): "modified",
+}
+
+# inotify constants, from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def coalesce_events(events: typing.Iterable[typing.Tuple[str, str, bool]]) -> typing.List[typing.Tuple[str, str, bool]]:
+    """Merges a burst of raw `(kind, rel_path, is_dir)` events into at most one event per path."""
+    merged = {}
+    for kind, rel, is_dir in events:
+        previous = merged.pop(rel, None)
+        if previous is not None:
+            kind = _COALESCE.get((previous[0], kind), kind)
+            if kind is None:
+                continue
+        merged[rel] = (kind, rel, is_dir)
+    return list(merged.values())
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class _InotifyBackend:
+    """
+    One inotify instance with a watch on every (not excluded) directory of the tree.
+
+    `close()` can be called from another thread while `read()` waits: it wakes the reader
+    through a self-pipe, and the inotify fd is closed by whichever of the two finishes last,
+    so a reader never selects on or reads a closed (and possibly reused) fd.
+    """
+
+    def __init__(self, root: str, exclude: typing.Optional[PathMatcher], libc, logger: logging.Logger):
+        self.root = root
+        self.exclude = exclude
+        self.logger = logger
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self._wd_to_rel = {}
+        self._rel_to_wd = {}
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+        try:
+            self._add_tree(root, "")
+            self._snapshot = self._take()
+        except OSError:
+            self.close()
+            raise
+
+    def _take(self) -> TreeSnapshot:
+        return TreeSnapshot.take(self.root, self.exclude)
+
+    def _add_watch(self, path: str, rel: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # The directory may be gone already; running out of watches is a real error.
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, f"inotify_add_watch({path!r}) failed: {os.strerror(err)}")
+        self._wd_to_rel[wd] = rel
+        self._rel_to_wd[rel] = wd
+
+    def _add_tree(self, path: str, rel: str) -> typing.List[typing.Tuple[str, str, bool]]:
+        """Watches `path` and every directory below it; returns 'created' events for what is already inside."""
+        self._add_watch(path, rel)
+        found = []
+        for dirpath, dirs, files in scandir_tree(path, self.exclude_below(rel)):
+            sub_rel = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            prefix = "" if sub_rel == "." else sub_rel + "/"
+            for entry in dirs:
+                if not entry.is_symlink():
+                    self._add_watch(entry.path, prefix + entry.name)
+                found.append(("created", prefix + entry.name, True))
+            found.extend(("created", prefix + entry.name, False) for entry in files)
+        return found
+
+    def exclude_below(self, rel: str) -> typing.Optional[PathMatcher]:
+        # scandir_tree matches patterns relative to the directory it walks, so a subtree
+        # walk is only exact when nothing is excluded, or when it starts at the root.
+        if self.exclude is None or not rel:
+            return self.exclude
+        return _PrefixedPatterns(self.exclude, rel)
+
+    def _forget(self, rel: str):
+        for sub_rel in [r for r in self._rel_to_wd if r == rel or r.startswith(rel + "/")]:
+            wd = self._rel_to_wd.pop(sub_rel)
+            self._wd_to_rel.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self, timeout: typing.Optional[float], stopped: threading.Event) -> typing.List[typing.Tuple[str, str, bool]]:
+        with self._lock:
+            if self._closing:
+                return []
+            self._readers += 1
+        try:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not stopped.is_set():
+                wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+                readable, _, _ = select.select([self._fd, self._wake_r], [], [], wait)
+                if self._wake_r in readable:
+                    break
+                if readable:
+                    events = self._read_events()
+                    if events:
+                        return events
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+            return []
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if self._closing and not self._readers:
+                    self._close_fds()
+
+    def _read_events(self) -> typing.List[typing.Tuple[str, str, bool]]:
+        events = []
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+                offset += name_len
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                else:
+                    events.extend(self._translate(wd, mask, name))
+        if overflowed:
+            self.logger.warning(f"inotify queue overflowed while watching {self.root}; rescanning the tree.")
+            events.extend(self._rescan())
+        return events
+
+    def _rescan(self) -> typing.List[typing.Tuple[str, str, bool]]:
+        """Diffs the tree with the previous scan, and watches the directories created meanwhile."""
+        snapshot = self._take()
+        changes = snapshot.diff(self._snapshot)
+        old, self._snapshot = self._snapshot, snapshot
+        events = [("created", rel, snapshot[rel].is_dir) for rel in changes.added]
+        events += [("modified", rel, False) for rel in changes.modified if not snapshot[rel].is_dir]
+        events += [("deleted", rel, old[rel].is_dir) for rel in changes.removed]
+        for rel in changes.removed:
+            if old[rel].is_dir:
+                self._forget(rel)
+        for entry in snapshot.dirs():
+            if entry.path not in self._rel_to_wd and not os.path.islink(os.path.join(self.root, entry.path)):
+                self._add_watch(os.path.join(self.root, entry.path), entry.path)
+        return events
+
+    def _translate(self, wd: int, mask: int, name: str) -> typing.List[typing.Tuple[str, str, bool]]:
+        if mask & IN_IGNORED:
+            rel = self._wd_to_rel.pop(wd, None)
+            if rel is not None and self._rel_to_wd.get(rel) == wd:
+                del self._rel_to_wd[rel]
+            return []
+        dir_rel = self._wd_to_rel.get(wd)
+        if dir_rel is None or not name:
+            return []
+        rel = f"{dir_rel}/{name}" if dir_rel else name
+        is_dir = bool(mask & IN_ISDIR)
+        if self.exclude and self.exclude.match(rel, is_dir):
+            return []
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            events = [("created", rel, is_dir)]
+            if is_dir:
+                # Files can land in a new directory before its watch exists; report what is already there.
+                events += self._add_tree(os.path.join(self.root, *rel.split("/")), rel)
+            return events
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            if is_dir:
+                self._forget(rel)
+            return [("deleted", rel, is_dir)]
+        if mask & (IN_MODIFY | IN_CLOSE_WRITE) and not is_dir:
+            return [("modified", rel, False)]
+        return []
+
+    def close(self):
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            try:
+                os.write(self._wake_w, b"x")
+            except BlockingIOError:
+                pass
+            if not self._readers:
+                self._close_fds()
+
+    def _close_fds(self):
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            os.close(fd)
+        self._fd = self._wake_r = self._wake_w = -1
+
+
+class _PrefixedPatterns:
+    """Adapts root-relative exclude patterns to a walk that starts at the subdirectory `prefix`."""
+
+    def __init__(self, patterns: PathMatcher, prefix: str):
+        self._patterns = patterns
+        self._prefix = prefix + "/"
+
+    def __bool__(self):
+        return True
+
+    def match(self, rel_path: str, is_dir: bool = False) -> bool:
+        return self._patterns.match(self._prefix + rel_path, is_dir)
+
+
+class _PollBackend:
+    """Detects changes by diffing a fresh `TreeSnapshot` with the previous one every `interval` seconds."""
+
+    def __init__(self, root: str, exclude: typing.Optional[PathMatcher], interval: float, workers: typing.Optional[int]):
+        self.root = root
+        self.exclude = exclude
+        self.interval = interval
+        self.workers = workers
+        self._snapshot = self._take()
+        self._next_poll = time.monotonic() + interval
+
+    def _take(self) -> TreeSnapshot:
+        return TreeSnapshot.take(self.root, self.exclude, workers=self.workers)
+
+    def read(self, timeout: typing.Optional[float], stopped: threading.Event) -> typing.List[typing.Tuple[str, str, bool]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not stopped.is_set():
+            now = time.monotonic()
+            if deadline is not None and deadline < self._next_poll:
+                stopped.wait(max(deadline - now, 0))
+                return []
+            if stopped.wait(max(self._next_poll - now, 0)):
+                break
+            self._next_poll = time.monotonic() + self.interval
+            snapshot = self._take()
+            changes = snapshot.diff(self._snapshot)
+            old, self._snapshot = self._snapshot, snapshot
+            events = [("created", rel, snapshot[rel].is_dir) for rel in changes.added]
+            # A directory's mtime changes with its entries, which are reported themselves.
+            events += [("modified", rel, False) for rel in changes.modified if not snapshot[rel].is_dir]
+            events += [("deleted", rel, old[rel].is_dir) for rel in changes.removed]
+            if events:
+                return events
+        return []
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    """
+    Watches a directory tree; see `NbPath.watch()`.
+
+    Iterate over it (`for event in watcher`, or `async for event in watcher`) to receive
+    `WatchEvent`s until `close()` is called, or call `read(timeout)` to get one coalesced
+    batch at a time. Use it as a context manager to close it reliably.
+    """
+
+    def __init__(
+        self,
+        root: typing.Union[os.PathLike, str],
+        path_cls: type,
+        exclude: typing.Optional[PathMatcher] = None,
+        debounce: float = 0.1,
+        backend: str = "auto",
+        poll_interval: float = 1.0,
+        workers: typing.Optional[int] = None,
+        logger: logging.Logger = None,
+    ):
+        if backend not in WATCH_BACKENDS:
+            raise ValueError(f"`backend` must be one of {WATCH_BACKENDS}, got {backend!r}.")
+        self.root = os.fspath(root)
+        self.debounce = debounce
+        self._path_cls = path_cls
+        self._stopped = threading.Event()
+        self._backend = None
+        if backend in ("auto", "inotify"):
+            libc = _load_libc()
+            if libc is None and backend == "inotify":
+                raise OSError("inotify is not available on this platform.")
+            if libc is not None:
+                try:
+                    self._backend = _InotifyBackend(self.root, exclude, libc, logger or logging.getLogger(__name__))
+                except OSError as e:
+                    if backend == "inotify":
+                        raise
+                    if logger is not None:
+                        logger.warning(f"inotify unavailable for {self.root} ({e}), falling back to polling.")
+        if self._backend is None:
+            self._backend = _PollBackend(self.root, exclude, poll_interval, workers)
+        self.backend = "inotify" if isinstance(self._backend, _InotifyBackend) else "poll"
+
+    def read(self, timeout: typing.Optional[float] = None) -> typing.List[WatchEvent]:
+        """
+        Waits up to `timeout` seconds (forever if None, until `close()`) for changes, then collects
+        further changes until the tree has been quiet for `debounce` seconds, and returns them
+        coalesced to one event per path. Returns an empty list on timeout.
+        """
+        raw = self._backend.read(timeout, self._stopped)
+        if not raw:
+            return []
+        # Do not let a tree that never goes quiet hold events back for ever.
+        give_up = time.monotonic() + max(self.debounce * 20, 1.0)
+        while self.debounce > 0 and time.monotonic() < give_up:
+            more = self._backend.read(self.debounce, self._stopped)
+            if not more:
+                break
+            raw.extend(more)
+        return [
+            WatchEvent(kind, self._path_cls(os.path.join(self.root, *rel.split("/"))), is_dir)
+            for kind, rel, is_dir in coalesce_events(raw)
+        ]
+
+    def __iter__(self) -> typing.Iterator[WatchEvent]:
+        while not self._stopped.is_set():
+            yield from self.read(_WAKEUP_INTERVAL)
+
+    async def __aiter__(self) -> typing.AsyncIterator[WatchEvent]:
+        loop = asyncio.get_running_loop()
+        while not self._stopped.is_set():
+            for event in await loop.run_in_executor(None, self.read, _WAKEUP_INTERVAL):
+                yield event
+
+    @property
+    def closed(self) -> bool:
+        return self._stopped.is_set()
+
+    def close(self):
+        """Stops the watcher; a blocked iteration ends within a fraction of a second."""
+        self._stopped.set()
+        self._backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,74 @@
+import errno
+import os
+import shutil
+import sys
+
+from nb_path import NbPath
+from nb_path import nb_path_copy
+
+
+def test_copy_to_uses_engine_and_keeps_metadata():
+    with NbPath.tempdir() as root:
+        data = os.urandom(3 * (1 << 20) + 7)
+        src = root / "src.bin"
+        src.write_bytes(data)
+        os.chmod(src, 0o640)
+        os.utime(src, ns=(1_600_000_000 * 10**9, 1_600_000_000 * 10**9))
+
+        dst = src.copy_to(root / "dst.bin")
+        assert dst.read_bytes() == data
+        assert dst.stat().st_mtime_ns == src.stat().st_mtime_ns and (dst.stat().st_mode & 0o777) == 0o640
+        # Into a directory, like shutil.copy2
+        (root / "into").mkdir()
+        assert src.copy_to(root / "into") == root / "into" / "src.bin"
+        assert nb_path_copy.copy_file(src, root / "again.bin") in (
+            "reflink", "copy_file_range", "sendfile", "buffer", "copyfile"
+        )
+
+        (root / "tree" / "pkg" / "a.py").ensure_parent().write_text("a")
+        copied = (root / "tree").copy_to(root / "tree_copy")
+        assert (copied / "pkg" / "a.py").read_text() == "a"
+
+        try:
+            nb_path_copy.copy_file(src, src)
+        except shutil.SameFileError:
+            assert src.read_bytes() == data
+        else:
+            raise AssertionError("copying a file onto itself must fail")
+
+        if hasattr(os, "mkfifo"):
+            os.mkfifo(root / "pipe")
+            try:
+                nb_path_copy.copy_file(src, root / "pipe")
+            except shutil.SpecialFileError:
+                pass
+            else:
+                raise AssertionError("copying onto a named pipe must fail")
+
+
+def test_copy_fallbacks():
+    def unsupported(src_fd, dst_fd, offset):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    with NbPath.tempdir() as root:
+        data = os.urandom((1 << 20) * 2 + 3)
+        (root / "src.bin").write_bytes(data)
+        # An unsupported kernel copy copies nothing, and the buffered loop takes over
+        with open(root / "src.bin", "rb") as fsrc, open(root / "buffer.bin", "wb") as fdst:
+            assert not nb_path_copy._kernel_copy(unsupported, fsrc.fileno(), fdst.fileno())
+            nb_path_copy._buffered_copy(fsrc, fdst)
+        assert (root / "buffer.bin").read_bytes() == data
+
+        if sys.platform.startswith("linux"):
+            for name, copy_chunk in [("range.bin", nb_path_copy._copy_file_range), ("sendfile.bin", nb_path_copy._sendfile)]:
+                if copy_chunk is nb_path_copy._copy_file_range and not hasattr(os, "copy_file_range"):
+                    continue
+                with open(root / "src.bin", "rb") as fsrc, open(root / name, "wb") as fdst:
+                    supported = nb_path_copy._kernel_copy(copy_chunk, fsrc.fileno(), fdst.fileno())
+                assert (root / name).read_bytes() == (data if supported else b"")
+
+
+if __name__ == "__main__":
+    test_copy_to_uses_engine_and_keeps_metadata()
+    test_copy_fallbacks()
+    print("ok")
@@ -0,0 +1,56 @@
+import os
+
+from nb_path import NbPath
+
+
+def _make_tree(root: NbPath):
+    (root / "a.bin").write_bytes(b"x" * 100)
+    (root / "pkg" / "b.bin").ensure_parent().write_bytes(b"x" * 1000)
+    (root / "pkg" / "sub" / "c.bin").ensure_parent().write_bytes(b"x" * 10)
+    (root / "empty").mkdir()
+    os.link(root / "pkg" / "b.bin", root / "pkg" / "sub" / "b_link.bin")
+    os.symlink(root / "pkg", root / "link_to_pkg")
+
+
+def test_du_counts_hardlinks_once():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        usage = root.du()
+        assert usage.total == 1110
+        assert usage.file_count == 4
+        assert usage.dirs == {".": 1110, "pkg": 1010, "pkg/sub": 10, "empty": 0}
+        assert root.du(workers=4) == usage
+        assert root.size_human() == "0 B" and (root / "pkg" / "b.bin").size_human() == "1000.0 B"
+
+
+def _age_dirs(top: NbPath, seconds: int):
+    for path in [top] + [p for p in top.rglob("*") if p.is_dir() and not p.is_symlink()]:
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10**9))
+
+
+def test_du_cache_reuses_unchanged_dirs():
+    with NbPath.tempdir() as root:
+        (root / "tree").mkdir()
+        _make_tree(root / "tree")
+        cache_path = root / "du.json"
+        # Directories modified within the last seconds are not cached: a change in the same tick could be missed
+        first = (root / "tree").du(cache=True, cache_path=cache_path)
+        assert cache_path.exists() and first.total == 1110 and cache_path.read_text() == "{}"
+        _age_dirs(root / "tree", 10)
+        (root / "tree").du(cache=True, cache_path=cache_path)
+
+        # Not listed again: a cached directory keeps its summary while its mtime is unchanged
+        (root / "tree" / "pkg" / "sub" / "c.bin").write_bytes(b"x" * 20)
+        assert (root / "tree").du(cache=True, cache_path=cache_path).total == 1110
+
+        # A new entry changes the directory's mtime, so it is listed again
+        (root / "tree" / "pkg" / "sub" / "d.bin").write_bytes(b"x" * 5)
+        usage = (root / "tree").du(cache=True, cache_path=cache_path, workers=4)
+        assert usage.dirs["pkg/sub"] == 25 and usage.total == 1125
+
+
+if __name__ == "__main__":
+    test_du_counts_hardlinks_once()
+    test_du_cache_reuses_unchanged_dirs()
+    print("ok")
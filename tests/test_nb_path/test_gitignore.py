@@ -0,0 +1,102 @@
+from nb_path import NbPath
+from nb_path.nb_path_gitignore import IgnoreRules, parse_gitignore_line
+
+_FILES = [
+    "a.py", "b.pyc", "build/out.o", "build/keep.txt", "src/build/x.o", "src/main.c", "src/main.o",
+    "src/gen/keep_me.o", "src/gen/drop.o", "docs/a.md", "docs/sub/b.md", "docs/sub/c.txt", "logs/app.log",
+    "logs/important.log", "logs/old/x.log", "vendor/lib/a.js", "x/y/z/deep.tmp", "x/y/z/deep.txt",
+    "#hash.txt", "!bang.txt", "a/b/c/target/t.class", "target/t2.class", "abc/keep/x", "abc/x",
+]
+
+_ROOT_GITIGNORE = """# comment
+*.pyc
+/build/
+!build/keep.txt
+*.o
+!src/gen/keep_me.o
+docs/**/*.txt
+logs/*
+!logs/important.log
+vendor/
+\\#hash.txt
+\\!bang.txt
+**/target/
+abc/**
+!abc/keep/
+"""
+
+# What `git ls-files --others --exclude-standard` lists for the tree above.
+_NOT_IGNORED = [
+    ".gitignore", "a.py", "docs/a.md", "docs/sub/b.md", "logs/important.log", "src/gen/keep_me.o", "src/main.c",
+    "x/.gitignore", "x/y/.gitignore",
+]
+
+
+def _make_repo(root: NbPath):
+    (root / ".git").mkdir()
+    (root / ".git" / "HEAD").write_text("ref: refs/heads/master\n")
+    for rel in _FILES:
+        (root / rel).ensure_parent().write_text("x")
+    (root / ".gitignore").write_text(_ROOT_GITIGNORE)
+    (root / "x" / ".gitignore").write_text("y/z/*.tmp\n!*.txt\n")
+    (root / "x" / "y" / ".gitignore").write_text("deep.txt\n")
+
+
+def _walked(root: NbPath, **kwargs):
+    return sorted(
+        (dirpath / name).relative_to(root).as_posix()
+        for dirpath, _, filenames in root.walk_tree(respect_gitignore=True, **kwargs) for name in filenames
+    )
+
+
+def test_parse_gitignore_line():
+    assert parse_gitignore_line("# comment") is None
+    assert parse_gitignore_line("   ") is None
+    assert parse_gitignore_line("!/logs/\n") == ("logs", True, True, True)
+    assert parse_gitignore_line("*.pyc  ") == ("*.pyc", False, False, False)
+    assert parse_gitignore_line("a\\ ") == ("a\\ ", False, False, False)
+    assert parse_gitignore_line("docs/**/*.txt") == ("docs/**/*.txt", False, False, True)
+
+
+def test_last_matching_rule_wins():
+    rules = IgnoreRules(["*.log", "!important.log", "debug*", "!debug_keep*", "tmp/", "/top.txt"])
+    assert rules.check("a/app.log", False) is True
+    assert rules.check("a/important.log", False) is False
+    assert rules.check("debug_x", False) is True and rules.check("debug_keep", False) is False
+    assert rules.check("x/tmp", True) is True and rules.check("x/tmp", False) is None
+    assert rules.check("top.txt", False) is True and rules.check("a/top.txt", False) is None
+
+
+def test_walk_tree_respects_nested_gitignores():
+    with NbPath.tempdir() as root:
+        _make_repo(root)
+        assert _walked(root) == _NOT_IGNORED
+        assert _walked(root, workers=4) == _NOT_IGNORED
+        # A subdirectory still gets the rules of the .gitignore files above it
+        assert _walked(root / "src") == ["gen/keep_me.o", "main.c"]
+        assert _walked(root, exclude=["docs"]) == [p for p in _NOT_IGNORED if not p.startswith("docs/")]
+        # Ignored directories are pruned, not walked
+        visited = [dirpath.relative_to(root).as_posix() for dirpath, _, _ in root.walk_tree(respect_gitignore=True)]
+        assert "vendor" not in visited and "vendor/lib" not in visited and ".git" not in visited
+
+
+def test_bare_star_whitelists():
+    # Expected lists are what `git ls-files --others --exclude-standard` reports.
+    for gitignore, expected in [
+        ("*\n!*.py\n!*/\n", ["a.py", "src/tool.py"]),
+        ("*\n!.gitignore\n", [".gitignore"]),
+    ]:
+        with NbPath.tempdir() as root:
+            (root / ".git").mkdir()
+            for rel in ["a.py", "b.txt", "src/tool.py", "src/c.o", "docs/d.md"]:
+                (root / rel).ensure_parent().write_text("x")
+            (root / ".gitignore").write_text(gitignore)
+            assert _walked(root) == expected, gitignore
+
+
+if __name__ == "__main__":
+    test_parse_gitignore_line()
+    test_last_matching_rule_wins()
+    test_walk_tree_respects_nested_gitignores()
+    test_bare_star_whitelists()
+    print("ok")
@@ -0,0 +1,403 @@
+import os
+
+from nb_path import NbPath
+
+
+def _make_tree(root: NbPath):
+    for i in range(30):
+        (root / f"pkg{i % 3}" / f"m{i}.py").ensure_parent().write_text(
+            "import os\n" + "".join(f"value_{j} = {i}\n" for j in range(20)) + "# TODO fix\n"
+        )
+
+
+def test_grep_workers_same_as_sequential():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        expected = list(root.grep(r"value_1\d", file_pattern="*.py"))
+        for executor in ("thread", "process"):
+            got = list(root.grep(r"value_1\d", file_pattern="*.py", workers=4, executor=executor, max_pending=2))
+            assert [(r.path, r.line_number, r.line_content) for r in got] == [
+                (r.path, r.line_number, r.line_content) for r in expected
+            ]
+        unordered = list(root.grep("TODO", file_pattern="*.py", is_regex=False, workers=4, ordered=False))
+        assert len(unordered) == 30
+
+
+def test_buffer_scan_matches_line_scan():
+    import io
+    import random
+    from nb_path.nb_path_grep import GrepMatcher, scan_buffer, scan_lines
+
+    rnd = random.Random(7)
+    words = ["foo", "Foo", "bar", "error", "ERROR", "İstanbul", "x", "", " ", "\t", "a1", "b22"]
+    for _ in range(200):
+        lines = [" ".join(rnd.choice(words) for _ in range(rnd.randint(0, 5))) for _ in range(rnd.randint(0, 40))]
+        text = rnd.choice(["\n", "\r\n"]).join(lines) + rnd.choice(["", "\n"])
+        for pattern, is_regex, ignore_case in [
+            ("error", False, False), ("error", False, True), ("", False, False), ("İ", False, True),
+            (r"\d+", True, False), (r"^foo", True, False), (r"bar\s+x", True, True), (r"\s", True, False),
+            (r"o$", True, False), ("^", True, False),
+        ]:
+            matcher = GrepMatcher(pattern, is_regex=is_regex, ignore_case=ignore_case)
+            expected = list(scan_lines(io.StringIO(text, newline=None), "f", matcher))
+            for chunk_size in (1, 7, 1 << 20):
+                if not matcher.supports_buffer_scan:
+                    continue
+                got = list(scan_buffer(io.StringIO(text, newline=None), "f", matcher, chunk_size=chunk_size))
+                key = lambda r: (r.line_number, r.line_content, getattr(r.match, "span", lambda: r.match)(), r.context_lines)
+                assert [key(r) for r in got] == [key(r) for r in expected], (pattern, text, chunk_size)
+
+
+def test_required_literal_and_binary_skip():
+    from nb_path.nb_path_grep import GrepMatcher
+
+    assert GrepMatcher(r"def (\w+)\(self").required_literals == ["(self"]
+    assert GrepMatcher(r"foo|bar").required_literals is None
+    assert GrepMatcher(r"(?i)error 404").required_literals == [" 404"]
+    assert GrepMatcher("Error", is_regex=False, ignore_case=True).required_literals is None
+    assert GrepMatcher(r"ab\ncd").required_literals[0] in ("ab", "cd")
+    assert GrepMatcher(["foo", r"ba+r"]).required_literals == ["foo", "b"]
+
+    with NbPath.tempdir() as root:
+        (root / "a.txt").write_text("hello world\n")
+        (root / "b.bin").write_bytes(b"hello world\x00\x01")
+        (root / "c.txt").write_text("nothing here\n")
+        (root / "d.txt").write_text("x" * 5000 + "\nhello again\n")
+        assert sorted(r.path.name for r in root.grep("hello")) == ["a.txt", "d.txt"]
+        assert sorted(r.path.name for r in root.grep("hello", skip_binary=False)) == ["a.txt", "b.bin", "d.txt"]
+        (root / "e.txt").write_text("héllo wörld\n", encoding="utf-16")
+        assert [r.line_number for r in (root / "e.txt").grep("wörld", encoding="utf-16", skip_binary=False)] == [1]
+
+
+
+def test_grep_with_search_index():
+    with NbPath.tempdir() as root, NbPath.tempdir() as cache:
+        index_path = cache / "index.sqlite"
+        _make_tree(root)
+        (root / "pkg0" / "special.py").write_text("needle_in_haystack = 1\n")
+        with root.build_search_index("*.py", index_path=index_path) as index:
+            assert index.candidates([b"needle_in"]) == {str(root / "pkg0" / "special.py")}
+            assert index.candidates([b"needle_in", b"ne"]) is None
+
+        got = [r.path.name for r in root.grep(r"needle_\w+", file_pattern="*.py", use_index=True, index_path=index_path)]
+        assert got == ["special.py"]
+
+        # Changed and deleted files are picked up incrementally.
+        (root / "pkg1" / "m1.py").write_text("another needle_in_haystack\n")
+        (root / "pkg0" / "special.py").delete()
+        with root.build_search_index("*.py", index_path=index_path) as index:
+            assert index.candidates([b"needle_in", b"zzz"]) == {str(root / "pkg1" / "m1.py")}
+        got = [r.path.name for r in root.grep("needle_in", file_pattern="*.py", is_regex=False, use_index=True, index_path=index_path)]
+        assert got == ["m1.py"]
+
+
+def test_search_index_does_not_trust_fresh_files():
+    from nb_path.nb_path_search_index import NbPathSearchIndex
+
+    with NbPath.tempdir() as root:
+        path = root / "a.txt"
+        path.write_text("old content")
+        with NbPathSearchIndex(root, root / "index.sqlite") as index:
+            assert index.refresh([path]) == {"added": 1, "updated": 0, "removed": 0, "unchanged": 0}
+            # Rewritten within the same mtime tick, with the same size
+            st = path.stat()
+            path.write_text("new content")
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            assert index.refresh([path])["updated"] == 1
+            assert index.candidates([b"new content"]) == {str(path)}
+
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - 10**10))
+            index.refresh([path])
+            assert index.refresh([path])["unchanged"] == 1
+
+
+
+def test_context_keeps_nearby_matches():
+    import random
+    from nb_path.nb_path_grep import GrepMatcher, scan_lines
+
+    rnd = random.Random(3)
+    matcher = GrepMatcher("hit", is_regex=False)
+    for _ in range(300):
+        lines = [rnd.choice(["hit\n", "miss\n", "miss\n"]) for _ in range(rnd.randint(0, 25))]
+        before, after = rnd.randint(0, 4), rnd.randint(0, 4)
+        hits = [n for n, line in enumerate(lines, 1) if line == "hit\n"]
+        window = lambda n: list(range(max(1, n - before), min(len(lines), n + after) + 1))
+
+        results = list(scan_lines(iter(lines), "f", matcher, before, after))
+        assert [r.line_number for r in results] == hits
+        for r in results:
+            assert [num for num, _ in r.context_lines] == window(r.line_number)
+
+        merged = list(scan_lines(iter(lines), "f", matcher, before, after, merge_context=True))
+        assert [r.line_number for r in merged] == hits
+        for r in merged:
+            group = [m for m in merged if m.context_lines is r.context_lines]
+            expected = sorted({n for m in group for n in window(m.line_number)})
+            assert [num for num, _ in r.context_lines] == expected
+        # Distinct groups must be separated by at least one line outside every window.
+        blocks = []
+        for r in merged:
+            if not blocks or blocks[-1] is not r.context_lines:
+                blocks.append(r.context_lines)
+        for a, b in zip(blocks, blocks[1:]):
+            assert b[0][0] - a[-1][0] > 1
+
+
+def test_merged_context_is_bounded():
+    from nb_path import nb_path_grep
+    from nb_path.nb_path_grep import GrepMatcher, scan_lines
+
+    read = []
+
+    def lines():
+        for n in range(1, 1001):
+            read.append(n)
+            yield "hit\n" if n % 3 else "miss\n"
+
+    original = nb_path_grep.MERGED_GROUP_MAX_LINES
+    nb_path_grep.MERGED_GROUP_MAX_LINES = 50
+    try:
+        results = scan_lines(lines(), "f", GrepMatcher("hit", is_regex=False), 2, 2, merge_context=True)
+        first = next(results)
+        # The first block was handed out long before the end of the dense run of matches
+        assert first.line_number == 1 and len(read) < 60 and len(first.context_lines) <= 50 + 2
+        rest = list(results)
+    finally:
+        nb_path_grep.MERGED_GROUP_MAX_LINES = original
+    assert [r.line_number for r in [first] + rest] == [n for n in range(1, 1001) if n % 3]
+    assert max(len(r.context_lines) for r in rest) <= 50 + 2
+    # Each split block starts with the 'before' context of its first match
+    second = next(r for r in rest if r.context_lines is not first.context_lines)
+    assert [n for n, _ in second.context_lines][:3] == [second.line_number - 2, second.line_number - 1, second.line_number]
+
+
+
+def test_agrep():
+    import asyncio
+
+    async def collect(root, **kwargs):
+        return [r async for r in root.agrep(r"value_1\d", file_pattern="*.py", **kwargs)]
+
+    async def stop_early(root):
+        agen = root.agrep("import", file_pattern="*.py", concurrency=2)
+        first = await agen.__anext__()
+        await agen.aclose()
+        return first
+
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        expected = [(r.path, r.line_number) for r in root.grep(r"value_1\d", file_pattern="*.py")]
+        assert [(r.path, r.line_number) for r in asyncio.run(collect(root, concurrency=3))] == expected
+        unordered = asyncio.run(collect(root, concurrency=3, ordered=False))
+        assert sorted((r.path, r.line_number) for r in unordered) == sorted(expected)
+        assert asyncio.run(stop_early(root)).line_number == 1
+
+
+def test_agrep_overlaps_and_cancels_the_walk():
+    import asyncio
+    import time
+    from nb_path import nb_path_class
+
+    walked = []
+    original = nb_path_class.scandir_tree
+
+    def slow_scandir_tree(*args, **kwargs):
+        for item in original(*args, **kwargs):
+            walked.append(item[0])
+            time.sleep(0.01)
+            yield item
+
+    async def first_then_cancel(root):
+        agen = root.agrep("import", file_pattern="*.py", is_regex=False, concurrency=2)
+        first = await agen.__anext__()
+        # The first result came long before the walk of 200 directories could finish
+        assert len(walked) < 50
+
+        async def consume():
+            async for _ in agen:
+                pass
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        count = len(walked)
+        await asyncio.sleep(0.3)
+        # Cancelling stopped the walk thread too
+        assert len(walked) <= count + 1 and len(walked) < 200
+        return first
+
+    with NbPath.tempdir() as root:
+        for i in range(200):
+            (root / f"d{i:03}" / "m.py").ensure_parent().write_text("import os\n")
+        nb_path_class.scandir_tree = slow_scandir_tree
+        try:
+            assert asyncio.run(first_then_cancel(root)).line_number == 1
+        finally:
+            nb_path_class.scandir_tree = original
+
+
+
+def test_multi_pattern_grep():
+    import io
+    import random
+    from nb_path.nb_path_grep import GrepMatcher, scan_buffer, scan_lines
+
+    with NbPath.tempdir() as root:
+        (root / "app.log").write_text("ok\nERROR disk full\nWARN slow\nerror and warn\n")
+        got = [(r.line_number, r.pattern_key) for r in root.grep({"err": "(?i)error", "warn": "WARN"})]
+        assert got == [(2, "err"), (3, "warn"), (4, "err")]
+        got = [(r.line_number, r.pattern_key) for r in root.grep(["error", "warn"], is_regex=False, ignore_case=True)]
+        assert got == [(2, "error"), (3, "warn"), (4, "error"), (4, "warn")]
+        got = [(r.line_number, r.pattern_key) for r in root.grep([r"(r)\1", "ok"], workers=2, executor="process")]
+        assert got == [(1, "ok"), (4, r"(r)\1")]
+
+    rnd = random.Random(5)
+    words = ["foo", "Foo", "bar", "error", "x", "", "a1"]
+    for _ in range(100):
+        text = "\n".join(" ".join(rnd.choice(words) for _ in range(3)) for _ in range(30))
+        for patterns, is_regex, ignore_case in [
+            (["foo", "bar"], False, False), (["FOO", "a1"], False, True), ({1: r"f\w+", 2: r"\d"}, True, False),
+        ]:
+            matcher = GrepMatcher(patterns, is_regex=is_regex, ignore_case=ignore_case)
+            assert matcher.supports_buffer_scan
+            key = lambda r: r._replace(match=getattr(r.match, "span", lambda: r.match)())
+            expected = [key(r) for r in scan_lines(io.StringIO(text), "f", matcher)]
+            assert [key(r) for r in scan_buffer(io.StringIO(text), "f", matcher, chunk_size=13)] == expected
+
+
+
+def test_grep_compressed_files():
+    import bz2
+    import gzip
+    import lzma
+
+    text = "line one\r\nERROR two\nthree\n"
+    with NbPath.tempdir() as root:
+        (root / "logs" / "a.log.gz").ensure_parent().write_bytes(gzip.compress(text.encode()))
+        (root / "logs" / "b.log.bz2").write_bytes(bz2.compress(text.encode()))
+        (root / "logs" / "c.log.xz").write_bytes(lzma.compress(text.encode()))
+        (root / "logs" / "d.log").write_text(text)
+        (root / "logs" / "e.bin").write_bytes(b"ERROR\x00")
+        archive = (root / "logs").zip_to(root / "logs.zip")
+
+        assert [r.path.name for r in root.grep("ERROR")] == ["d.log"]
+        got = sorted((str(r.path.relative_to(root)), r.line_number, r.line_content)
+                     for r in root.grep("ERROR", search_compressed=True, context=1))
+        assert got == sorted(
+            [(f"logs/{name}", 2, "ERROR two\n") for name in ("a.log.gz", "b.log.bz2", "c.log.xz", "d.log")]
+            + [("logs.zip!d.log", 2, "ERROR two\n")]  # Compressed members are binary inside the zip.
+        )
+        got = [r.path.name for r in archive.grep("ERROR", search_compressed=True, skip_binary=False)]
+        assert "logs.zip!e.bin" in got
+
+
+
+def test_grep_modes():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        (root / "pkg0" / "empty.py").write_text("nothing\n")
+        counts = {c.path.name: c.count for c in root.grep(r"value_1\d", file_pattern="*.py", mode="count")}
+        assert len(counts) == 30 and set(counts.values()) == {10}
+        capped = {c.count for c in root.grep("value_", file_pattern="*.py", is_regex=False, mode="count", max_count=3)}
+        assert capped == {3}
+        files = list(root.grep("TODO", file_pattern="*.py", mode="files", workers=2, executor="process"))
+        assert len(files) == 30 and "empty.py" not in {f.name for f in files}
+        first = list(root.grep(r"value_\d", file_pattern="*.py", mode="first"))
+        assert len(first) == 30 and {r.line_number for r in first} == {2}
+        limited = list(root.grep(r"value_\d", file_pattern="*.py", max_count=2, context=1))
+        assert len(limited) == 60
+        multi = {c.count for c in root.grep(["value_1", "value_2"], file_pattern="*.py", is_regex=False, mode="count")}
+        assert multi == {12}  # "value_1" hits value_1 and value_10..19 (11 lines), "value_2" one line.
+
+
+
+def test_grep_auto_encoding():
+    import gzip
+    from nb_path import nb_path_encoding
+
+    text = "第一行：正常\n第二行：数据库连接失败，请检查配置文件。\n" * 20
+    with NbPath.tempdir() as root:
+        (root / "gbk.log").write_bytes(text.encode("gbk"))
+        (root / "utf8.log").write_text(text)
+        (root / "gbk.log.gz").write_bytes(gzip.compress(text.encode("gbk")))
+        got = sorted({r.path.name for r in root.grep("连接失败", encoding="auto", search_compressed=True)})
+        assert got == ["gbk.log", "gbk.log.gz", "utf8.log"]
+        assert (root / "gbk.log").read_text(encoding="auto") == text
+        assert (root / "gbk.log").detect_encoding() in ("gb2312", "gbk", "gb18030")
+
+        # Detection is cached until the file changes.
+        calls = []
+        original = nb_path_encoding.UniversalDetector
+        nb_path_encoding.UniversalDetector = lambda: calls.append(1) or original()
+        try:
+            _age(root / "utf8.log", 10)
+            (root / "utf8.log").detect_encoding()
+            (root / "utf8.log").detect_encoding()
+            assert calls == [1]
+            (root / "utf8.log").write_text("ascii only now\n")
+            assert (root / "utf8.log").detect_encoding() == "utf-8" and calls == [1, 1]
+        finally:
+            nb_path_encoding.UniversalDetector = original
+
+
+def _age(path: NbPath, seconds: int):
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10**9))
+
+
+def test_encoding_cache_skips_fresh_files():
+    gbk = "数据库连接失败".encode("gbk") * 28 + b"xxxx"
+    with NbPath.tempdir() as root:
+        path = root / "a.log"
+        path.write_bytes(gbk)
+        assert path.detect_encoding() in ("gb2312", "gbk", "gb18030")
+        # Rewritten within the same mtime tick, with the same size
+        st = path.stat()
+        path.write_bytes(b"a" * len(gbk))
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert path.detect_encoding() == "utf-8"
+
+
+def test_grep_utf16_is_not_binary():
+    import gzip
+
+    text = "line one\nconnection error here\n" * 20
+    with NbPath.tempdir() as root:
+        (root / "bom.log").write_bytes(text.encode("utf-16"))
+        (root / "le.log").write_bytes(text.encode("utf-16-le"))
+        (root / "wide.log.gz").write_bytes(gzip.compress(text.encode("utf-32")))
+        (root / "blob.bin").write_bytes(b"connection error\x00\x01\x02")
+
+        def names(**kwargs):
+            return sorted({r.path.name for r in root.grep("error", is_regex=False, **kwargs)})
+
+        # skip_binary stays on: the null bytes of UTF-16/32 text do not make it binary
+        assert names() == []
+        assert names(encoding="auto", search_compressed=True) == ["bom.log", "le.log", "wide.log.gz"]
+        assert names(encoding="utf-16-le", file_pattern="*.log") == ["bom.log", "le.log"]
+        assert names(encoding="latin-1") == []
+        assert names(encoding="latin-1", skip_binary=False) == ["blob.bin"]
+
+
+if __name__ == "__main__":
+    test_grep_workers_same_as_sequential()
+    test_buffer_scan_matches_line_scan()
+    test_required_literal_and_binary_skip()
+    test_grep_with_search_index()
+    test_search_index_does_not_trust_fresh_files()
+    test_context_keeps_nearby_matches()
+    test_merged_context_is_bounded()
+    test_agrep()
+    test_agrep_overlaps_and_cancels_the_walk()
+    test_multi_pattern_grep()
+    test_grep_compressed_files()
+    test_grep_modes()
+    test_grep_auto_encoding()
+    test_encoding_cache_skips_fresh_files()
+    test_grep_utf16_is_not_binary()
+    print("ok")
@@ -0,0 +1,52 @@
+from pathlib import PurePosixPath
+
+from nb_path import NbPath
+
+PathMatcher = NbPath.PathMatcher
+
+
+def test_path_matcher_same_as_purepath_match():
+    patterns = ["*.pyc", "__pycache__", "node_modules", "*~", "*_test.py", "docs/*.md", "[ab].py", "[!a]*.txt",
+                "a?c", "src/*/gen_*.py", "*"]
+    paths = ["x.pyc", "d/x.pyc", ".pyc", "__pycache__", "q/__pycache__", "node_modules", "a/node_modules/x",
+             "file~", "a/b_test.py", "test.py", "docs/a.md", "x/docs/a.md", "docs/sub/a.md", "a.py", "c.py",
+             "z/a.txt", "z/b.txt", "abc", "a/abc", "abcd", "src/pkg/gen_x.py", "src/gen_x.py", "x.PYC"]
+    for path in paths:
+        expected = any(PurePosixPath(path).match(p) for p in patterns)
+        assert PathMatcher(patterns).match(path) == expected, path
+        # Each pattern on its own, so every fast path is compared too
+        for p in patterns:
+            assert PathMatcher([p]).match(path) == PurePosixPath(path).match(p), (p, path)
+
+
+def test_path_matcher_anchoring_and_dir_only():
+    matcher = PathMatcher(["/build", "logs/", "a/**/z.txt"])
+    assert matcher.match("build") and not matcher.match("src/build")
+    assert matcher.match("x/logs", is_dir=True) and not matcher.match("x/logs")
+    assert matcher.match("a/z.txt") and matcher.match("a/b/c/z.txt") and matcher.match("q/a/b/z.txt")
+    assert PathMatcher.compile(["*.py"]) is PathMatcher.compile(["*.py"])
+    assert not PathMatcher([]) and PathMatcher(["x"])
+    # A bare '*' matches everything, also next to suffix patterns
+    assert PathMatcher(["*"]).match("a.txt") and PathMatcher(["*", "*.py"]).match("d/a.txt")
+
+
+def test_pattern_lists_in_walk_and_grep():
+    with NbPath.tempdir() as root:
+        for rel in ["a.py", "b.pyi", "Makefile", "c.txt", "docs/d.md", "pkg/e.py", "pkg/docs/f.md"]:
+            (root / rel).ensure_parent().write_text("needle\n")
+        got = sorted(p.relative_to(root).as_posix() for p in root.rglob_files(["*.py", "*.pyi", "Makefile", "docs/*.md"]))
+        assert got == ["Makefile", "a.py", "b.pyi", "docs/d.md", "pkg/docs/f.md", "pkg/e.py"]
+        assert sorted(p.relative_to(root).as_posix() for p in root.rglob_dirs(["docs", "pkg"])) == [
+            "docs", "pkg", "pkg/docs"
+        ]
+        hits = sorted(r.path.name for r in root.grep("needle", file_pattern=["*.md", "Makefile"]))
+        assert hits == ["Makefile", "d.md", "f.md"]
+        assert len(list(root.iter_files(["*", "*.py"]))) == 7
+        assert list(root.walk_tree(exclude=["*"])) == [(root, [], [])]
+
+
+if __name__ == "__main__":
+    test_path_matcher_same_as_purepath_match()
+    test_path_matcher_anchoring_and_dir_only()
+    test_pattern_lists_in_walk_and_grep()
+    print("ok")
@@ -0,0 +1,56 @@
+import os
+
+from nb_path import NbPath
+
+
+def _make_tree(root: NbPath):
+    for rel in ["a.py", "b.txt", "pkg/c.py", "pkg/sub/d.py", ".git/HEAD"]:
+        (root / rel).ensure_parent().write_text(rel)
+
+
+def test_snapshot_records_stat():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        snap = root.snapshot(exclude=[".git"])
+        assert snap.paths == ["a.py", "b.txt", "pkg", "pkg/c.py", "pkg/sub", "pkg/sub/d.py"]
+        st = os.stat(root / "pkg" / "c.py")
+        entry = snap["pkg/c.py"]
+        assert entry.is_file and not entry.is_dir
+        assert (entry.size, entry.mtime_ns, entry.mode, entry.ino) == (st.st_size, st.st_mtime_ns, st.st_mode, st.st_ino)
+        assert snap["pkg/sub"].is_dir and "pkg/nope" not in snap and snap.get("nope") is None
+        assert [e.path for e in snap.files()] == ["a.py", "b.txt", "pkg/c.py", "pkg/sub/d.py"]
+        assert sorted(e.path for e in root.snapshot(workers=4).files()) == sorted(
+            p.relative_to(root).as_posix() for p in root.rglob_files("*")
+        )
+
+
+def test_snapshot_diff_filter_and_save():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        old = root.snapshot()
+        (root / "a.py").write_text("changed, and longer")
+        (root / "b.txt").delete()
+        (root / "pkg" / "new.py").write_text("new")
+        new = root.snapshot()
+        changes = new.diff(old)
+        assert changes.added == ["pkg/new.py"]
+        assert changes.removed == ["b.txt"]
+        assert changes.modified == ["a.py", "pkg"]  # pkg's mtime changed when new.py was created
+        assert (new - old).paths == ["pkg/new.py"]
+
+        assert new.filter(exclude=["pkg"]).paths == [".git", ".git/HEAD", "a.py"]
+        assert new.filter(include=["*.py"], predicate=lambda e: e.is_file).paths == [
+            "a.py", "pkg/c.py", "pkg/new.py", "pkg/sub/d.py"
+        ]
+
+        saved = root / "tree.snap"
+        new.save(saved)
+        loaded = NbPath.TreeSnapshot.load(saved)
+        assert loaded.root == str(root) and list(loaded) == list(new)
+        assert not loaded.diff(new).added and not loaded.diff(new).modified
+
+
+if __name__ == "__main__":
+    test_snapshot_records_stat()
+    test_snapshot_diff_filter_and_save()
+    print("ok")
@@ -0,0 +1,210 @@
+import os
+
+from nb_path import NbPath
+
+
+def _make_tree(root: NbPath):
+    (root / "a.txt").ensure_parent().write_bytes(b"x" * 10)
+    (root / "pkg" / "b.txt").ensure_parent().write_bytes(b"x" * 100)
+    for i in range(50):
+        (root / "many" / f"f{i}.txt").ensure_parent().write_bytes(b"y" * i)
+
+
+def _age(root: NbPath, seconds: int):
+    for path in root.rglob_files("*"):
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10**9))
+
+
+def test_sync_to_result_counts():
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        _make_tree(src)
+        (dst / "extra.txt").ensure_parent().write_bytes(b"z" * 7)
+
+        result = src.sync_to(dst, delete_extraneous=True, dry_run=True)
+        assert (result.copied, result.deleted, result.failed) == (52, 1, 0)
+        assert (dst / "extra.txt").exists() and not (dst / "a.txt").exists()
+
+        result = src.sync_to(dst, delete_extraneous=True, workers=8)
+        assert result.ok and (result.copied, result.copied_bytes) == (52, 110 + sum(range(50)))
+        assert (result.deleted, result.deleted_bytes) == (1, 7)
+        assert (dst / "many" / "f49.txt").read_bytes() == b"y" * 49
+
+        # Everything is up to date now; one changed file is copied again
+        _age(dst, -10)
+        (src / "pkg" / "b.txt").write_bytes(b"new")
+        os.utime(src / "pkg" / "b.txt", ns=(0, (dst / "pkg" / "b.txt").stat().st_mtime_ns + 10**9))
+        result = src.sync_to(dst, workers=8)
+        assert (result.copied, result.copied_bytes, result.skipped) == (1, 3, 51)
+        assert (dst / "pkg" / "b.txt").read_bytes() == b"new"
+
+
+def test_sync_to_collects_errors_per_file():
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        _make_tree(src)
+        # A directory where a file should go, and a file where a directory should go
+        (dst / "a.txt").mkdir(parents=True)
+        (dst / "pkg").write_bytes(b"not a dir")
+        for workers in (None, 4):
+            result = src.sync_to(dst, workers=workers)
+            assert [(e.action, e.path) for e in result.errors] == [("copy", "a.txt"), ("copy", "pkg/b.txt")]
+            assert all(isinstance(e.error, OSError) for e in result.errors)
+            # The other files were still copied (on the second pass they are up to date)
+            assert result.copied + result.skipped == 50 and (dst / "many" / "f0.txt").exists()
+
+
+def test_sync_to_compare_modes():
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        t = 1_600_000_000 * 10**9
+        for name, src_data, dst_data, dst_mtime in [
+            ("same_size_same_mtime.txt", b"hello", b"HELLO", t),  # e.g. a corrupted copy
+            ("bigger_newer_dest.txt", b"abc", b"abcdef", t + 10**9),  # e.g. a skewed clock
+            ("same_content_older_dest.txt", b"same", b"same", t - 10**9),  # e.g. restored from backup
+        ]:
+            (src / name).ensure_parent().write_bytes(src_data)
+            (dst / name).ensure_parent().write_bytes(dst_data)
+            os.utime(src / name, ns=(t, t))
+            os.utime(dst / name, ns=(dst_mtime, dst_mtime))
+
+        copied = {compare: src.sync_to(dst, dry_run=True, compare=compare, workers=4).copied
+                  for compare in ("mtime", "size+mtime", "checksum")}
+        assert copied == {"mtime": 1, "size+mtime": 2, "checksum": 2}
+
+        result = src.sync_to(dst, compare="checksum", hash_cache=False)
+        assert (result.copied, result.skipped) == (2, 1)
+        assert (dst / "same_size_same_mtime.txt").read_bytes() == b"hello"
+        assert (dst / "same_content_older_dest.txt").stat().st_mtime_ns == t - 10**9
+        assert src.sync_to(dst, compare="checksum").copied == 0
+
+        try:
+            src.sync_to(dst, compare="md5")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("an unknown compare mode must be rejected")
+
+
+def test_hash_cache():
+    with NbPath.tempdir() as root:
+        path = root / "data.bin"
+        path.write_bytes(b"x" * 100)
+        assert path.hash(cache=True) == path.hash() == path.hash("sha256")
+        with NbPath.HashCache(root / "hashes.sqlite", racy_seconds=0) as cache:
+            digest = cache.hash(path)
+            assert cache.hash(path) == digest and (cache.hits, cache.misses) == (1, 1)
+            path.write_bytes(b"y" * 100)
+            assert cache.hash(path) == path.hash() != digest and cache.misses == 2
+        # The digests survive in the file
+        with NbPath.HashCache(root / "hashes.sqlite", racy_seconds=0) as cache:
+            assert cache.hash(path) == path.hash() and cache.hits == 1
+
+
+def test_sync_to_delta_rewrites_changed_blocks_only():
+    block = 1 << 16
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        data = bytearray(os.urandom(block * 100 + 123))
+        (src / "image.bin").ensure_parent().write_bytes(bytes(data))
+        (src / "small.bin").write_bytes(b"s" * 10)
+        src.sync_to(dst)
+
+        data[block * 10 + 5] ^= 0xFF  # one block changed in place
+        data[block * 70:block * 70 + 2] = b"xx"  # and another
+        data += b"appended"
+        (src / "image.bin").write_bytes(bytes(data))
+        (src / "small.bin").write_bytes(b"t" * 10)
+        for name in ("image.bin", "small.bin"):
+            st = (dst / name).stat()
+            os.utime(dst / name, ns=(st.st_atime_ns, st.st_mtime_ns - 10**10))
+        result = src.sync_to(dst, delta_threshold=block, workers=2)
+        assert result.copied == 2 and result.copied_bytes == len(data) + 10
+        # The two changed blocks, the grown last block (123 + 8 bytes) and the small file
+        assert result.written_bytes == 2 * block + 131 + 10
+        assert (dst / "image.bin").read_bytes() == bytes(data)
+        assert (dst / "image.bin").stat().st_mtime_ns == (src / "image.bin").stat().st_mtime_ns
+
+        # A shrinking file is truncated
+        (src / "image.bin").write_bytes(bytes(data[:block * 3]))
+        src.sync_to(dst, delta_threshold=block, compare="size+mtime")
+        assert (dst / "image.bin").read_bytes() == bytes(data[:block * 3])
+
+
+def test_sync_to_manifest_skips_destination_walk():
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        _make_tree(src)
+        for compare in ("mtime", "checksum"):
+            dst.delete()
+            count = len(src.rglob_files("*"))
+            assert src.sync_to(dst, manifest=True, compare=compare).copied == count
+            assert (dst / ".nb_path_sync_manifest").is_file()
+            assert src.sync_to(dst, manifest=True, compare=compare).skipped == count
+
+            # A stray file the manifest does not know about is not seen: the destination is not walked
+            (dst / "stray.txt").write_text("stray")
+            (src / "many" / "f0.txt").delete()
+            (src / "new" / f"{compare}.txt").ensure_parent().write_text("new")
+            result = src.sync_to(dst, manifest=True, compare=compare, delete_extraneous=True, workers=4)
+            assert (result.copied, result.deleted) == (1, 1)
+            assert (dst / "new" / f"{compare}.txt").read_text() == "new" and not (dst / "many" / "f0.txt").exists()
+            assert (dst / "stray.txt").exists()
+
+            # Other ignore patterns invalidate the manifest
+            result = src.sync_to(dst, manifest=True, compare=compare, delete_extraneous=True, ignore_patterns=["*.md"])
+            assert result.deleted == 1 and not (dst / "stray.txt").exists()
+            (src / "many" / "f0.txt").write_text("back")
+
+        # A sync without the manifest removes it
+        src.sync_to(dst)
+        assert not (dst / ".nb_path_sync_manifest").exists()
+
+        # A manifest in the source (e.g. the source was itself a sync destination) is not synced
+        (src / ".nb_path_sync_manifest").write_text("not mine")
+        src.sync_to(dst, manifest=True)
+        assert (dst / ".nb_path_sync_manifest").read_bytes() != b"not mine"
+        assert src.sync_to(dst, manifest=True).copied == 0
+        assert src.sync_to(dst, dry_run=True).copied == 0
+
+        # Only the manifest at the root is special: a nested file of that name is synced and deleted as usual
+        (src / "pkg" / ".nb_path_sync_manifest").write_text("user data")
+        (dst / "many" / ".nb_path_sync_manifest").write_text("extraneous")
+        src.sync_to(dst, delete_extraneous=True)
+        assert (dst / "pkg" / ".nb_path_sync_manifest").read_text() == "user data"
+        assert not (dst / "many" / ".nb_path_sync_manifest").exists()
+        (src / "pkg" / ".nb_path_sync_manifest").write_text("more user data")
+        src.sync_to(dst, manifest=True)
+        assert (dst / "pkg" / ".nb_path_sync_manifest").read_text() == "more user data"
+        assert src.sync_to(dst, manifest=True).copied == 0
+
+
+def test_sync_to_checksum_manifest_reads_source_once():
+    from nb_path import nb_path_class
+
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        _make_tree(src)
+        src.sync_to(dst, manifest=True, compare="checksum", hash_cache=False)
+        hashed = []
+        original = nb_path_class.file_digest
+        nb_path_class.file_digest = lambda path, *args: hashed.append(path) or original(path, *args)
+        try:
+            result = src.sync_to(dst, manifest=True, compare="checksum", hash_cache=False)
+        finally:
+            nb_path_class.file_digest = original
+        # The destination digests come from the manifest, and every source file is read once
+        assert result.skipped == len(hashed) == len(set(hashed)) == 52
+        assert all(path.startswith(str(src)) for path in hashed)
+
+
+if __name__ == "__main__":
+    test_sync_to_result_counts()
+    test_sync_to_collects_errors_per_file()
+    test_sync_to_compare_modes()
+    test_hash_cache()
+    test_sync_to_delta_rewrites_changed_blocks_only()
+    test_sync_to_manifest_skips_destination_walk()
+    test_sync_to_checksum_manifest_reads_source_once()
+    print("ok")
@@ -0,0 +1,186 @@
+import os
+
+from nb_path import NbPath
+
+
+def _make_tree(root: NbPath):
+    for rel in ["a.py", "b.txt", ".hidden.py", "pkg/c.py", "pkg/sub/d.py", "pkg/sub/e.PY", "tests/t.py",
+                "pkg/tests/u.py", "node_modules/lib/x.js", "__pycache__/a.cpython-311.pyc"]:
+        (root / rel).ensure_parent().write_text(rel)
+    (root / "empty_dir").mkdir()
+    os.symlink(root / "pkg", root / "link_to_pkg")
+    os.symlink(root / "a.py", root / "link_to_a.py")
+    os.symlink(root / "missing", root / "broken_link")
+
+
+def _pathlib_files(root, pattern):
+    return sorted(str(p) for p in root.rglob(pattern) if p.is_file())
+
+
+def _pathlib_dirs(root, pattern):
+    return sorted(str(p) for p in root.rglob(pattern) if p.is_dir())
+
+
+def test_rglob_matches_pathlib():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        for pattern in ["*", "*.py", "?.py", "[ab].*", "tests", "*.js", "sub/*.py", "**/*.txt"]:
+            got = root.rglob_files(pattern)
+            assert all(type(p) is NbPath for p in got)
+            assert sorted(map(str, got)) == _pathlib_files(root, pattern), pattern
+            assert sorted(map(str, root.rglob_dirs(pattern))) == _pathlib_dirs(root, pattern), pattern
+
+
+
+def test_iter_files_is_lazy():
+    import types
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        it = root.iter_files("*.py")
+        assert isinstance(it, types.GeneratorType)
+        first = next(it)
+        assert first.suffix == ".py"
+        assert sorted(map(str, [first, *it])) == sorted(map(str, root.rglob_files("*.py")))
+        assert sorted(map(str, root.iter_dirs("sub"))) == _pathlib_dirs(root, "sub")
+
+
+def test_zip_to_uses_walker():
+    import zipfile
+    with NbPath.tempdir() as root:
+        _make_tree(root / "src")
+        (root / "src" / "broken_link").unlink()
+        archive = (root / "src").zip_to(root / "src.zip")
+        names = set(zipfile.ZipFile(archive).namelist())
+        assert {"pkg/sub/d.py", "empty_dir/", "link_to_pkg/", "link_to_a.py"} <= names
+        assert "link_to_pkg/c.py" not in names
+
+
+
+def test_walk_tree_prunes_excluded_dirs():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        (root / ".gitignore").write_text("# build output\n/pkg/sub/\n*.js\n")
+        opened = []
+        for dirpath, dirnames, filenames in root.walk_tree(exclude=["node_modules", "__pycache__", "*.txt"]):
+            opened.append(dirpath.relative_to(root).as_posix())
+            assert "b.txt" not in filenames
+        assert "node_modules" not in opened and "node_modules/lib" not in opened
+        assert "__pycache__" not in opened and "pkg/sub" in opened
+
+        def walked_files(**kwargs):
+            return sorted(
+                (dirpath / name).relative_to(root).as_posix()
+                for dirpath, _, filenames in root.walk_tree(**kwargs) for name in filenames
+            )
+
+        assert walked_files(include=["tests/*.py"]) == ["pkg/tests/u.py", "tests/t.py"]
+        assert walked_files(include=["/tests/*.py"]) == ["tests/t.py"]
+        ignored = walked_files(respect_gitignore=True)
+        assert "pkg/c.py" in ignored and "pkg/sub/d.py" not in ignored and "node_modules/lib/x.js" not in ignored
+
+        # Pruning in place, as with os.walk
+        seen = []
+        for dirpath, dirnames, _ in root.walk_tree():
+            dirnames[:] = [d for d in dirnames if d != "pkg"]
+            seen.append(dirpath.name)
+        assert "sub" not in seen
+
+
+def test_sync_to_prunes_ignored_dirs():
+    with NbPath.tempdir() as root:
+        src, dst = root / "src", root / "dst"
+        _make_tree(src)
+        (dst / "__pycache__" / "keep.pyc").ensure_parent().write_text("kept")
+        src.sync_to(dst, delete_extraneous=True, ignore_patterns=["__pycache__", "node_modules", "*.txt"])
+        assert (dst / "pkg" / "sub" / "d.py").read_text() == "pkg/sub/d.py"
+        assert not (dst / "node_modules").exists() and not (dst / "b.txt").exists()
+        assert (dst / "__pycache__" / "keep.pyc").read_text() == "kept"
+
+
+
+def test_parallel_walk_same_as_sequential():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        for i in range(20):
+            (root / "wide" / f"d{i}" / f"f{i}.py").ensure_parent().write_text("x")
+        for pattern in ["*", "*.py", "sub"]:
+            assert sorted(map(str, root.rglob_files(pattern, workers=8))) == _pathlib_files(root, pattern)
+            assert sorted(map(str, root.rglob_dirs(pattern, workers=8))) == _pathlib_dirs(root, pattern)
+
+        # Pruning in place still works, and abandoning the walk early is fine
+        seen = []
+        for dirpath, dirnames, _ in root.walk_tree(exclude=["node_modules"], workers=4):
+            dirnames[:] = [d for d in dirnames if d != "wide"]
+            seen.append(dirpath.relative_to(root).as_posix())
+        assert not any(s.startswith(("wide", "node_modules")) for s in seen) and "pkg/sub" in seen
+        next(root.iter_files(workers=4))
+
+        dst = root / "dst"
+        (root / "pkg").sync_to(dst, workers=4)
+        assert sorted(p.relative_to(dst).as_posix() for p in dst.rglob_files("*")) == [
+            "c.py", "sub/d.py", "sub/e.PY", "tests/u.py"
+        ]
+
+
+def test_parallel_walk_bounds_queued_dirs():
+    from nb_path import nb_path_walker
+
+    with NbPath.tempdir() as root:
+        for i in range(300):
+            (root / f"d{i}").mkdir()
+        listed, yielded, most = [0], [0], [0]
+        original = nb_path_walker._list_dir
+
+        def counting_list_dir(*args):
+            listed[0] += 1
+            most[0] = max(most[0], listed[0] - yielded[0])
+            return original(*args)
+
+        nb_path_walker._list_dir = counting_list_dir
+        try:
+            for _ in nb_path_walker.scandir_tree(str(root), workers=2):
+                yielded[0] += 1
+        finally:
+            nb_path_walker._list_dir = original
+        # Only a few directories per worker are handed to the pool at a time
+        assert yielded[0] == 301 and most[0] <= 2 * 4
+
+
+
+def test_cached_walk_relists_only_changed_dirs():
+    with NbPath.tempdir() as root:
+        _make_tree(root)
+        old = 1_000_000_000  # mtimes in the past, so the listings are not too fresh to cache
+        for dirpath, _, _ in root.walk_tree():
+            os.utime(dirpath, (old, old))
+        cache = NbPath.WalkCache(max_dirs=100)
+        expected = _pathlib_files(root, "*.py")
+        assert sorted(map(str, root.rglob_files("*.py", cache=cache))) == expected
+        listed = cache.misses
+        assert cache.hits == 0 and listed == len(cache)
+
+        assert sorted(map(str, root.rglob_files("*.py", cache=cache))) == expected
+        assert cache.misses == listed and cache.hits == listed
+
+        (root / "pkg" / "sub" / "new.py").write_text("new")
+        os.utime(root / "pkg" / "sub", (old + 1, old + 1))
+        assert sorted(map(str, root.rglob_files("*.py", cache=cache, workers=4))) == _pathlib_files(root, "*.py")
+        assert cache.misses == listed + 1
+
+        # Bounded: the least recently used listings are dropped
+        small = NbPath.WalkCache(max_dirs=2)
+        root.rglob_files("*", cache=small)
+        assert len(small) == 2
+        assert sorted(map(str, root.rglob_files("*", cache=True))) == _pathlib_files(root, "*")
+
+
+if __name__ == "__main__":
+    test_rglob_matches_pathlib()
+    test_iter_files_is_lazy()
+    test_zip_to_uses_walker()
+    test_walk_tree_prunes_excluded_dirs()
+    test_sync_to_prunes_ignored_dirs()
+    test_parallel_walk_same_as_sequential()
+    test_parallel_walk_bounds_queued_dirs()
+    test_cached_walk_relists_only_changed_dirs()
+    print("ok")
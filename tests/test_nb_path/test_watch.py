@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from nb_path import NbPath
+from nb_path.nb_path_watch import coalesce_events
+
+
+def _collect(watcher, timeout=3.0):
+    events = watcher.read(timeout)
+    return sorted((e.kind, e.path.relative_to(watcher.root).as_posix(), e.is_dir) for e in events)
+
+
+def test_coalesce_events():
+    raw = [
+        ("created", "a.txt", False), ("modified", "a.txt", False),
+        ("created", "tmp.txt", False), ("deleted", "tmp.txt", False),
+        ("deleted", "b.txt", False), ("created", "b.txt", False),
+        ("modified", "c.txt", False), ("modified", "c.txt", False),
+    ]
+    assert coalesce_events(raw) == [
+        ("created", "a.txt", False), ("modified", "b.txt", False), ("modified", "c.txt", False)
+    ]
+
+
+def _check_backend(backend):
+    with NbPath.tempdir() as root:
+        (root / "old.txt").write_text("old")
+        (root / "keep.txt").write_text("keep")
+        with root.watch(backend=backend, exclude=["*.tmp"], debounce=0.3, poll_interval=0.1) as watcher:
+            assert watcher.backend == backend
+            (root / "new.txt").write_text("new")
+            (root / "ignored.tmp").write_text("x")
+            (root / "keep.txt").write_text("changed content")
+            (root / "old.txt").unlink()
+            (root / "sub" / "inner.txt").ensure_parent().write_text("inner")
+            assert _collect(watcher) == [
+                ("created", "new.txt", False),
+                ("created", "sub", True),
+                ("created", "sub/inner.txt", False),
+                ("deleted", "old.txt", False),
+                ("modified", "keep.txt", False),
+            ]
+            # New directories are watched too
+            (root / "sub" / "later.txt").write_text("later")
+            assert _collect(watcher) == [("created", "sub/later.txt", False)]
+            assert watcher.read(0.3) == []
+
+
+def test_watch_inotify():
+    import sys
+    if sys.platform.startswith("linux"):
+        _check_backend("inotify")
+
+
+def test_watch_poll():
+    _check_backend("poll")
+
+
+def test_inotify_close_and_overflow():
+    import sys
+    import threading
+    if not sys.platform.startswith("linux"):
+        return
+    with NbPath.tempdir() as root:
+        (root / "old.txt").write_text("old")
+        watcher = root.watch(backend="inotify", debounce=0)
+        # close() from another thread wakes a reader blocked without a timeout
+        results = []
+        reader = threading.Thread(target=lambda: results.append(watcher.read()))
+        reader.start()
+        time.sleep(0.2)
+        watcher.close()
+        reader.join(2)
+        assert not reader.is_alive() and results == [[]]
+        assert watcher._backend._fd == -1 and watcher.read(0.1) == []
+
+        # An overflowed queue is made up for by diffing a rescan with the previous scan
+        with root.watch(backend="inotify", debounce=0) as watcher:
+            (root / "old.txt").unlink()
+            (root / "sub" / "inner.txt").ensure_parent().write_text("inner")
+            assert sorted(watcher._backend._rescan()) == [
+                ("created", "sub", True), ("created", "sub/inner.txt", False), ("deleted", "old.txt", False)
+            ]
+            watcher.read(0.3)
+            (root / "sub" / "later.txt").write_text("later")
+            assert _collect(watcher) == [("created", "sub/later.txt", False)]
+
+
+def test_watch_async():
+    async def main():
+        with NbPath.tempdir() as root:
+            with root.watch(debounce=0.05, poll_interval=0.1) as watcher:
+                (root / "a.txt").write_text("a")
+                async for event in watcher:
+                    assert (event.kind, event.path.name) == ("created", "a.txt")
+                    watcher.close()
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+
+
+if __name__ == "__main__":
+    test_coalesce_events()
+    test_watch_inotify()
+    test_watch_poll()
+    test_inotify_close_and_overflow()
+    test_watch_async()
+    print("ok")